@@ -1,3 +1,6 @@
 from tarr.compiler import branch, rule, branch_rule, HAVE_NOT_DONE_IT
+from tarr.columnar import branch_batch, rule_batch
 
-__all__ = ['branch', 'rule', 'branch_rule', 'HAVE_NOT_DONE_IT']
+__all__ = [
+    'branch', 'rule', 'branch_rule', 'HAVE_NOT_DONE_IT',
+    'branch_batch', 'rule_batch']
@@ -0,0 +1,79 @@
+'''
+Aho-Corasick automaton: finds any of many keywords in a text in a single
+pass over the text, independently of the number of keywords.
+'''
+
+from collections import deque
+
+
+class Automaton(object):
+
+    '''
+    Keyword trie with failure links.
+
+    States are numbered, state 0 is the root:
+
+    * goto[state]:   dict of char -> next state in the trie
+    * fail[state]:   state of the longest proper suffix being a trie prefix
+    * output[state]: a keyword ending at state (directly or through
+                     failure links) or None
+    '''
+
+    def __init__(self, keywords):
+        self.keywords = frozenset(keywords)
+        self.goto = [dict()]
+        self.fail = [0]
+        self.output = [None]
+
+        for keyword in self.keywords:
+            self.add(keyword)
+        self.link()
+
+    def add(self, keyword):
+        state = 0
+        for char in keyword:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append(dict())
+                self.fail.append(0)
+                self.output.append(None)
+            state = next_state
+        self.output[state] = keyword
+
+    def link(self):
+        goto, fail, output = self.goto, self.fail, self.output
+
+        # breadth first: failure states are shallower, thus already linked
+        pending = deque(goto[0].itervalues())
+        while pending:
+            state = pending.popleft()
+            for (char, next_state) in goto[state].iteritems():
+                pending.append(next_state)
+                fail_state = fail[state]
+                while fail_state and char not in goto[fail_state]:
+                    fail_state = fail[fail_state]
+                fail[next_state] = goto[fail_state].get(char, 0)
+                if output[next_state] is None:
+                    output[next_state] = output[fail[next_state]]
+
+    def search(self, text):
+        '''The first keyword found in text, None if there is none'''
+        goto, fail, output = self.goto, self.fail, self.output
+
+        if output[0] is not None:
+            # the empty keyword
+            return output[0]
+
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state] is not None:
+                return output[state]
+        return None
+
+    def contains_any(self, text):
+        return self.search(text) is not None
@@ -1,13 +1,16 @@
-from tarr.compiler import Program
+from tarr.codegen import instruction_name
+from tarr.compiler import Program, pack_statistics, merge_statistics
+from tarr.data import DataBatch, DataRow
 from tarr.language import RETURN_TRUE
+from tarr.metrics import MetricsReporter, ProgressMonitor
 import contextlib
 import os
 import multiprocessing
 import itertools
+import operator
 
 
 # TODO:
-# - test main
 # - logging of [transform] exceptions
 # - convert direct file operations into external operations
 # - consider using pyfileseq (show stopper: pyfileseq has no tests (1.0.1))
@@ -21,6 +24,15 @@ class Reader(object):
     def __iter__(self):
         pass
 
+    def batches(self, size):
+        '''DataBatch objects of at most size items'''
+        iterator = iter(self)
+        while True:
+            batch = DataBatch.from_data(itertools.islice(iterator, size))
+            if not batch:
+                return
+            yield batch
+
     def close(self):
         pass
 
@@ -33,6 +45,11 @@ class Writer(object):
     def write(self, data):
         pass
 
+    def write_batch(self, batch):
+        write = self.write
+        for data in batch.scan():
+            write(data)
+
     def close(self):
         pass
 
@@ -51,6 +68,17 @@ class BatchTransform(object):
     - how to write output data (get_writer)
     '''
 
+    # seconds between live metrics reports of main, None to disable them
+    # see tarr.metrics
+    metrics_interval = None
+
+    # number of items processed so far
+    processed_count = 0
+
+    # with a batch size data is passed from reader to writer as
+    # tarr.data.DataBatch objects
+    batch_size = None
+
     def get_reader(self, filename):
         return Reader(filename)
 
@@ -60,12 +88,49 @@ class BatchTransform(object):
     def transform(self, data):
         return data
 
+    def transform_many(self, data_items):
+        return itertools.imap(self.transform, data_items)
+
+    def transform_data_batch(self, batch):
+        '''Transform the rows of batch in place'''
+        for (index, data) in enumerate(self.transform_many(batch.scan())):
+            # the payload of a row view is already set in the batch
+            if data.__class__ is not DataRow:
+                batch[index] = data
+        return batch
+
     def process(self, input_filename, output_filename):
         closing = contextlib.closing
         with closing(self.get_reader(input_filename)) as reader:
             with closing(self.get_writer(output_filename)) as writer:
-                for data in iter(reader):
-                    writer.write(self.transform(data))
+                if self.batch_size is None:
+                    write = writer.write
+                    for data in self.transform_many(iter(reader)):
+                        write(data)
+                        self.processed_count += 1
+                else:
+                    write_batch = writer.write_batch
+                    for batch in reader.batches(self.batch_size):
+                        write_batch(self.transform_data_batch(batch))
+                        self.processed_count += len(batch)
+
+    # statistics of the processing - workers return them to main
+    # that merges them into a report for the whole job
+
+    def get_statistics(self):
+        '''Picklable statistics of the processing done so far'''
+        return None
+
+    def add_statistics(self, statistics):
+        '''Merge statistics returned by get_statistics of another instance'''
+        pass
+
+    def write_statistics(self, filename_prefix):
+        pass
+
+    def get_instruction_names(self):
+        '''Names of the instructions in statistics by index'''
+        return []
 
 
 class TarrBatchTransform(BatchTransform):
@@ -90,12 +155,76 @@ class TarrBatchTransform(BatchTransform):
         except Exception:
             return data
 
+    def transform_many(self, data_items):
+        '''Transform data_items with Program.run_many.
+
+        Subclasses overriding transform() are run through it item by item.
+        '''
+        if (self.__class__.transform.__func__ is not
+                TarrBatchTransform.transform.__func__):
+            return super(TarrBatchTransform, self).transform_many(data_items)
+        # data raising an exception is passed through
+        return itertools.imap(
+            operator.itemgetter(0),
+            self.transformation.run_many(data_items, exceptions=(Exception,)))
+
+    def get_statistics(self):
+        return pack_statistics(self.transformation.statistics)
+
+    def add_statistics(self, statistics):
+        merge_statistics(self.transformation.statistics, statistics)
+
+    def get_instruction_names(self):
+        return [
+            instruction_name(instruction)
+            for instruction in self.transformation.instructions]
+
+    def write_statistics(self, filename_prefix):
+        '''Write statistics of the program as text and dot reports, and
+        save them for tarr.dagviz
+        '''
+        self.transformation.save_statistics(filename_prefix + '.statistics')
+        reports = (
+            ('.statistics.txt', self.transformation.to_text),
+            ('.statistics.dot', self.transformation.to_dot))
+        for (extension, report) in reports:
+            with open(filename_prefix + extension, 'w') as f:
+                f.write(report(with_statistics=True))
+
+
+# queue of tarr.metrics.Progress messages to main, if live metrics are
+# reported - it is inherited by the worker processes, see init_worker
+_progress_queue = None
+
+
+def init_worker(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+
 
 def transform_batch(tio):
     # multiprocessing.Pool.map supports one iterable argument
     # so we have to pack and unpack them into/from a tuple
     transformer_class, input, output = tio
-    transformer_class().process(input, output)
+    transformer = transformer_class()
+    if _progress_queue is None:
+        transformer.process(input, output)
+    else:
+        monitor = ProgressMonitor(
+            _progress_queue, transformer, input,
+            transformer.metrics_interval)
+        with monitor:
+            transformer.process(input, output)
+    return transformer.get_statistics()
+
+
+def write_statistics(batch_class, statistics_list, filename_prefix):
+    '''Merge statistics of the workers and write reports on them'''
+    batch = batch_class()
+    for statistics in statistics_list:
+        if statistics is not None:
+            batch.add_statistics(statistics)
+    batch.write_statistics(filename_prefix)
 
 
 # file sequence discovery - should match that of csvtools
@@ -123,21 +252,45 @@ def gen_names(prefix, count):
 
 def main(batch_class, arguments):
     # TODO: argparse & help
-    # TODO: test
+    # statistics of the whole job - and live metrics if enabled -
+    # are written next to the output(s)
     input, output = arguments
+    if os.path.exists(input):
+        inputs = [input]
+        outputs = [output]
+    else:
+        input_count = count_files_with(prefix=input)
+        inputs = list(gen_names(input, input_count))
+        outputs = list(gen_names(output, input_count))
+
+    progress_queue = None
+    if batch_class.metrics_interval is not None:
+        progress_queue = multiprocessing.Queue()
+        reporter = MetricsReporter(
+            progress_queue, output, inputs,
+            batch_class().get_instruction_names(),
+            interval=batch_class.metrics_interval)
+        reporter.start()
+
     if os.path.exists(input):
         # single input
-        transform_batch((batch_class, input, output))
+        init_worker(progress_queue)
+        try:
+            statistics_list = [transform_batch((batch_class, input, output))]
+        finally:
+            init_worker(None)
     else:
         # multiple input -> multiprocessing
-        input_count = count_files_with(prefix=input)
-        pool = multiprocessing.Pool(maxtasksperchild=1)
-        pool.map(
+        pool = multiprocessing.Pool(
+            maxtasksperchild=1,
+            initializer=init_worker, initargs=(progress_queue,))
+        statistics_list = pool.map(
             transform_batch,
-            zip(
-                itertools.repeat(batch_class),
-                gen_names(input, input_count),
-                gen_names(output, input_count)),
+            zip(itertools.repeat(batch_class), inputs, outputs),
             chunksize=1)
-        pool.terminate()
+        pool.close()
         pool.join()
+
+    if progress_queue is not None:
+        reporter.stop()
+    write_statistics(batch_class, statistics_list, output)
@@ -1,12 +1,13 @@
 import tarr.batch
-from tarr.data import Data
+from tarr.data import Data, DataBatch
 from tarr.payload import New as new_payload
 import unicodecsv
 import collections  # namedtuple
+import csv
+import functools
+import itertools
 import operator
 
-# FIXME: add tests
-
 
 def make_extractor(result_classname, fields, accessors):
     cls = collections.namedtuple(result_classname, fields)
@@ -40,6 +41,15 @@ class TarrCsvReader(tarr.batch.Reader):
         self.extractor_payload = (
             make_extractor(
                 'Input', payload_fields, accessors))
+        # for batches: all the fields with one itemgetter
+        index = dict((field, i) for (i, field) in enumerate(header))
+        fields = tuple(id_fields) + tuple(payload_fields)
+        self.id_count = len(id_fields)
+        self.width = len(fields)
+        if fields:
+            self.project = operator.itemgetter(*[index[f] for f in fields])
+        _, self.make_id = make_tuple_class('Id', id_fields)
+        _, self.make_input = make_tuple_class('Input', payload_fields)
 
     def __iter__(self):
         return self
@@ -50,6 +60,121 @@ class TarrCsvReader(tarr.batch.Reader):
         payload = self.extractor_payload(row)
         return Data(id, new_payload(payload))
 
+    def batches(self, size):
+        '''DataBatch objects of at most size rows.
+
+        The fields are extracted and transposed by builtins, without
+        Python calls per field or row.
+        '''
+        id_count = self.id_count
+        while True:
+            rows = list(itertools.islice(self.reader, size))
+            if not rows:
+                return
+            row_count = len(rows)
+            if self.width == 0:
+                columns = []
+            elif self.width == 1:
+                columns = [map(self.project, rows)]
+            else:
+                columns = zip(*map(self.project, rows))
+            ids = map(self.make_id, transpose(columns[:id_count], row_count))
+            inputs = map(
+                self.make_input, transpose(columns[id_count:], row_count))
+            yield DataBatch(ids, map(new_payload, inputs))
+
+    def close(self):
+        self.file.close()
+
+
+def make_tuple_class(result_classname, fields):
+    '''namedtuple class and a constructor of it from a tuple of values'''
+    cls = collections.namedtuple(result_classname, fields)
+    # without calling the Python level __new__ of the namedtuple
+    return cls, functools.partial(tuple.__new__, cls)
+
+
+def transpose(columns, row_count):
+    '''Rows as tuples'''
+    if not columns:
+        return [()] * row_count
+    return zip(*columns)
+
+
+# separator of the fields of a chunk while decoding,
+# csv does not accept NUL bytes in its input
+FIELD_SEPARATOR = '\0'
+
+
+class ChunkedCsvReader(tarr.batch.Reader):
+
+    # rows parsed, decoded and converted at once
+    chunk_size = 10000
+
+    def __init__(
+            self, id_fields, payload_fields, input_filename,
+            encoding='utf-8', chunk_size=None):
+        '''Read a CSV file like TarrCsvReader, but chunk_size rows at once.
+
+        Only the id_fields and payload_fields columns are extracted and
+        decoded, all the other fields are skipped.
+        '''
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+        self.input_filename = input_filename
+        self.encoding = encoding
+        self.file = open(input_filename, 'rb')
+        self.reader = csv.reader(self.file)
+        header = [
+            field.decode(encoding) for field in self.reader.next()]
+        index = dict((field, i) for (i, field) in enumerate(header))
+        fields = tuple(id_fields) + tuple(payload_fields)
+        self.id_count = len(id_fields)
+        self.width = len(fields)
+        if fields:
+            self.project = operator.itemgetter(*[index[f] for f in fields])
+        _, self.make_id = make_tuple_class('Id', id_fields)
+        _, self.make_input = make_tuple_class('Input', payload_fields)
+
+    def read_chunk(self, size):
+        '''(ids, inputs) of the next at most size rows'''
+        width = self.width
+        if width == 0:
+            # no fields selected, the rows are only counted
+            row_count = sum(1 for _ in itertools.islice(self.reader, size))
+            return (
+                map(self.make_id, transpose([], row_count)),
+                map(self.make_input, transpose([], row_count)))
+        rows = map(self.project, itertools.islice(self.reader, size))
+        if not rows:
+            return [], []
+        if width > 1:
+            fields = itertools.chain.from_iterable(rows)
+        else:
+            fields = rows
+        fields = (
+            FIELD_SEPARATOR.join(fields)
+            .decode(self.encoding).split(FIELD_SEPARATOR))
+        columns = [fields[i::width] for i in xrange(width)]
+        id_count = self.id_count
+        return (
+            map(self.make_id, transpose(columns[:id_count], len(rows))),
+            map(self.make_input, transpose(columns[id_count:], len(rows))))
+
+    def batches(self, size=None):
+        '''DataBatch objects of size - by default chunk_size - rows'''
+        size = size or self.chunk_size
+        while True:
+            ids, inputs = self.read_chunk(size)
+            if not ids:
+                return
+            yield DataBatch(ids, map(new_payload, inputs))
+
+    def __iter__(self):
+        for batch in self.batches():
+            for (id, payload) in itertools.izip(batch.ids, batch.payloads):
+                yield Data(id, payload)
+
     def close(self):
         self.file.close()
 
@@ -77,5 +202,11 @@ class CsvWriter(tarr.batch.Writer):
         self.writer.writerow(
             [extractor(data) for extractor in self.extractors])
 
+    def write_batch(self, batch):
+        extractors = self.extractors
+        self.writer.writerows(
+            [extractor(data) for extractor in extractors]
+            for data in batch.scan())
+
     def close(self):
         self.file.close()
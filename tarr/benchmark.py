@@ -0,0 +1,115 @@
+'''
+Compare the speed of program execution engines.
+
+    python -m tarr.benchmark [rule count] [item count]
+
+The benchmark program is made of many cheap rules and conditions split
+into subprograms, which is where interpreter dispatch dominates run time.
+'''
+
+import sys
+import timeit
+
+from tarr import (
+    compiler_base, compiler, flat, codegen, optimizer, columnar, tracing)
+from tarr.data import Data
+from tarr.compiler import rule, branch, DEF, IF, ELSE, ENDIF, RETURN_TRUE
+
+
+class CodegenProgramWithoutStatistics(codegen.Program):
+
+    with_statistics = False
+
+
+class CountingProgram(compiler.Program):
+
+    statistics_level = compiler.STATISTICS_COUNTS
+
+
+class SampledProgram(compiler.Program):
+
+    statistics_level = compiler.STATISTICS_SAMPLED
+
+
+class InliningFlatProgram(flat.Program):
+
+    optimizers = (optimizer.Inliner(),)
+
+
+class InliningCodegenProgram(CodegenProgramWithoutStatistics):
+
+    optimizers = (optimizer.Inliner(),)
+
+
+ENGINES = [
+    ('runner', compiler_base.Program),
+    ('statistics', compiler.Program),
+    ('counts', CountingProgram),
+    ('sampled', SampledProgram),
+    ('flat', flat.Program),
+    ('codegen', CodegenProgramWithoutStatistics),
+    ('codegen+stat', codegen.Program),
+    ('flat+inline', InliningFlatProgram),
+    ('codegen+inline', InliningCodegenProgram),
+    ('columnar', columnar.Program),
+    ('tracing', tracing.Program),
+]
+
+
+@rule
+def inc(n):
+    return n + 1
+
+
+@rule
+def dec(n):
+    return n - 1
+
+
+@branch
+def is_odd(n):
+    return n % 2 == 1
+
+
+def program_spec(rule_count):
+    '''A program executing about `rule_count` rules and conditions'''
+    block = [
+        IF (is_odd), inc,
+        ELSE, inc, dec,
+        ENDIF,
+        inc,
+        RETURN_TRUE]
+    block_size = 4
+    blocks = max(1, rule_count // block_size)
+
+    main = ['block{}'.format(i) for i in xrange(blocks)] + [RETURN_TRUE]
+    definitions = []
+    for i in xrange(blocks):
+        definitions.append(DEF('block{}'.format(i)))
+        definitions.extend(block)
+    return main + definitions
+
+
+def measure(program_class, spec, items, repeat=3):
+    program = program_class(spec)
+
+    def run():
+        program.run_batch(Data(i, i) for i in xrange(items))
+
+    return min(timeit.repeat(run, number=1, repeat=repeat))
+
+
+def main(rule_count=400, items=2000):
+    spec = program_spec(rule_count)
+    baseline = None
+    print '{:<16} {:>10} {:>12} {:>8}'.format(
+        'engine', 'seconds', 'items/sec', 'speedup')
+    for (name, program_class) in ENGINES:
+        seconds = measure(program_class, spec, items)
+        baseline = baseline or seconds
+        print '{:<16} {:>10.4f} {:>12.0f} {:>7.2f}x'.format(
+            name, seconds, items / seconds, baseline / seconds)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,48 @@
+'''
+Monotonic, high resolution clock for measuring run times.
+
+now_ns() returns integer nanoseconds from an arbitrary starting point,
+only differences of its values are meaningful.
+
+It is time.perf_counter_ns where available, clock_gettime(CLOCK_MONOTONIC)
+through ctypes on POSIX systems, and time.time as a last resort - which is
+not monotonic.
+'''
+
+import time
+
+
+def _posix_monotonic_ns():
+    import ctypes
+    import ctypes.util
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    CLOCK_MONOTONIC = 1
+
+    libc = ctypes.CDLL(ctypes.util.find_library('c'))
+    clock_gettime = libc.clock_gettime
+    value = timespec()
+    value_ref = ctypes.byref(value)
+    if clock_gettime(CLOCK_MONOTONIC, value_ref) != 0:
+        raise OSError('clock_gettime(CLOCK_MONOTONIC) failed')
+
+    def monotonic_ns():
+        clock_gettime(CLOCK_MONOTONIC, value_ref)
+        return value.tv_sec * 1000000000 + value.tv_nsec
+
+    return monotonic_ns
+
+
+def _time_ns():
+    return int(time.time() * 1e9)
+
+
+try:
+    now_ns = time.perf_counter_ns
+except AttributeError:
+    try:
+        now_ns = _posix_monotonic_ns()
+    except (ImportError, AttributeError, OSError, TypeError):
+        now_ns = _time_ns
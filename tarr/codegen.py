@@ -0,0 +1,412 @@
+'''
+Compile programs into Python source code.
+
+Every subprogram becomes a Python function, branching instructions
+become real if/elif/else statements and CALLs direct function calls, so
+CPython runs the program without interpreting it instruction by
+instruction.
+
+The instruction graph of a subprogram is not a tree: paths are joined
+again after ENDIF. Instructions having more than one predecessor start
+their own function, which is continued with by all of their predecessors.
+
+Generated functions have the signature
+
+    function(data, status) -> (data, status, next_function)
+
+where status is the exit status of the last instruction and
+next_function is the function to continue with, or None at the end of
+the subprogram. Functions are not calling each other directly: run()
+calls them in a loop, so the length of the program is not limited by
+the Python recursion limit.
+
+A Dispatch (see tarr.optimizer.Dispatcher) continues with the function of
+the selected target from a list indexed by the exit status, its targets
+start their own functions.
+
+CALLs are Python calls here, so the call depth is limited by the Python
+recursion limit and not by Runner.max_call_depth.
+'''
+
+import heapq
+import linecache
+import weakref
+
+from tarr import compiler_base, compiler, optimizer
+from tarr.compiler import HAVE_NOT_DONE_IT
+from tarr.flat import (
+    opcode,
+    RULE, BRANCH, BRANCH_RULE, CALL, RETURN, BRANCHING_INSTRUCTION,
+    INLINED_RETURN, DISPATCH)
+
+
+# weak references to the owners of the generated sources in
+# linecache.cache by filename, their callback removes the source
+_cached_sources = dict()
+
+
+def cache_source(owner, filename, source):
+    '''Make source visible in tracebacks while owner is alive'''
+    def remove(ref):
+        linecache.cache.pop(filename, None)
+        _cached_sources.pop(filename, None)
+
+    linecache.cache[filename] = (
+        len(source), None, source.splitlines(True), filename)
+    _cached_sources[filename] = weakref.ref(owner, remove)
+
+
+# returned by Generator.emit_instruction if there is no instruction to
+# continue with on the current path
+END_OF_PATH = object()
+
+
+def run(function, data, status):
+    '''Run the generated functions of a subprogram starting with function'''
+    while function is not None:
+        data, status, function = function(data, status)
+    return data, status
+
+
+def successors(instruction):
+    return set(optimizer.successors(instruction))
+
+
+def instruction_name(instruction):
+    if isinstance(instruction, compiler_base.Call):
+        return 'CALL "{}"'.format(instruction.label)
+    if isinstance(instruction, compiler_base.Return):
+        return 'RETURN {}'.format(instruction.return_value)
+    return getattr(
+        instruction, 'instruction_name', instruction.__class__.__name__)
+
+
+class Generator(object):
+
+    # deeper paths are continued in a new function to stay within
+    # the limits of the Python parser
+    MAX_DEPTH = 32
+
+    def __init__(self, start_instruction, statistics=None):
+        self.statistics = statistics
+        self.lines = []
+        self.namespace = dict(
+            HAVE_NOT_DONE_IT=HAVE_NOT_DONE_IT,
+            statistics=statistics,
+            run=run)
+        if statistics is not None:
+            # counter arrays of the statistics, see count()
+            self.namespace.update(
+                item_count=statistics.item_count,
+                success_count=statistics.success_count,
+                failure_count=statistics.failure_count)
+        self.slots = dict()
+        self.dispatches = []
+        self.labels = dict()
+        self.entries = [start_instruction]
+        self.leaders = set()
+        self.discover(start_instruction)
+
+    def discover(self, start_instruction):
+        predecessors = dict()
+        pending = [start_instruction]
+        while pending:
+            instruction = pending.pop()
+            if instruction in self.slots:
+                continue
+            self.slots[instruction] = len(self.slots)
+            for successor in successors(instruction):
+                predecessors.setdefault(successor, set()).add(instruction)
+                pending.append(successor)
+            if isinstance(instruction, compiler_base.Call):
+                start = instruction.start_instruction
+                if start not in self.labels:
+                    self.labels[start] = instruction.label
+                    self.entries.append(start)
+                pending.append(start)
+            if opcode(instruction) == DISPATCH:
+                self.dispatches.append(instruction)
+
+        self.leaders = set(self.entries)
+        for dispatch in self.dispatches:
+            self.leaders.update(successors(dispatch))
+        self.leaders.update(
+            instruction
+            for (instruction, preds) in predecessors.iteritems()
+            if len(preds) > 1)
+
+    # names in the generated code
+
+    def name(self, prefix, instruction, value):
+        name = '{}{}'.format(prefix, self.slots[instruction])
+        self.namespace[name] = value
+        return name
+
+    def function_name(self, instruction):
+        return 'f{}'.format(self.slots[instruction])
+
+    def func(self, instruction):
+        return self.name('c', instruction, instruction.func)
+
+    def instance(self, instruction):
+        return self.name('i', instruction, instruction)
+
+    def dispatch_table(self, instruction):
+        return self.name('t', instruction, [])
+
+    # source output
+
+    def add(self, depth, line):
+        self.lines.append('    ' * depth + line)
+
+    def source(self):
+        # emit_function() can add new leaders, they are generated in
+        # the order of their slots
+        queued = set(self.leaders)
+        pending = [(self.slots[leader], leader) for leader in queued]
+        heapq.heapify(pending)
+        while pending:
+            slot, leader = heapq.heappop(pending)
+            self.emit_function(leader)
+            for new_leader in self.leaders - queued:
+                queued.add(new_leader)
+                heapq.heappush(pending, (self.slots[new_leader], new_leader))
+        self.emit_dispatch_tables()
+        return '\n'.join(self.lines) + '\n'
+
+    def emit_dispatch_tables(self):
+        # filled in after all functions are defined
+        for dispatch in self.dispatches:
+            functions = [
+                'None' if target is None
+                else self.function_name(target)
+                for target in dispatch.targets]
+            self.add(0, '')
+            self.add(0, '{}[:] = [{}]'.format(
+                self.dispatch_table(dispatch), ', '.join(functions)))
+
+    def emit_function(self, leader):
+        self.add(0, '')
+        self.add(0, '')
+        if leader in self.labels:
+            self.add(0, '# DEF ("{}")'.format(self.labels[leader]))
+        self.add(0, 'def {}(data, status):'.format(self.function_name(leader)))
+        self.emit(leader, 1, first=True)
+
+    def emit(self, instruction, depth, first=False):
+        while True:
+            if instruction is None:
+                self.add(depth, 'return data, status, None')
+                return
+            if not first and (
+                    instruction in self.leaders or depth > self.MAX_DEPTH):
+                self.leaders.add(instruction)
+                self.add(
+                    depth,
+                    'return data, status, {}'.format(
+                        self.function_name(instruction)))
+                return
+            first = False
+
+            instruction = self.emit_instruction(instruction, depth)
+            if instruction is END_OF_PATH:
+                return
+
+    def emit_comment(self, instruction, depth):
+        self.add(
+            depth,
+            '# {} {}'.format(instruction.index, instruction_name(instruction)))
+
+    def emit_instruction(self, instruction, depth):
+        op = opcode(instruction)
+        on_success = instruction.next_instruction(exit_status=True)
+
+        if op == BRANCH:
+            return self.emit_branch(instruction, depth)
+
+        if op == DISPATCH:
+            return self.emit_dispatch(instruction, depth)
+
+        self.emit_comment(instruction, depth)
+        self.count_item(instruction, depth)
+        if op == RULE:
+            self.add(
+                depth,
+                'data.payload = {}(data.payload)'.format(
+                    self.func(instruction)))
+            self.count_exit_status(instruction, depth)
+            return on_success
+
+        if op == RETURN:
+            if instruction.return_value is None:
+                self.count_exit_status(instruction, depth)
+            else:
+                self.add(depth, 'status = {!r}'.format(
+                    instruction.return_value))
+                self.count(
+                    instruction, depth,
+                    'success_count' if instruction.return_value
+                    else 'failure_count')
+            self.add(depth, 'return data, status, None')
+            return END_OF_PATH
+
+        if op == INLINED_RETURN:
+            if instruction.return_value is not None:
+                self.add(depth, 'status = {!r}'.format(
+                    instruction.return_value))
+            return self.emit_status_branches(instruction, depth)
+
+        if op == BRANCH_RULE:
+            self.add(depth, 'output = {}(data.payload)'.format(
+                self.func(instruction)))
+            self.add(depth, 'status = output is not HAVE_NOT_DONE_IT')
+            return self.emit_status_branches(
+                instruction, depth, on_success_lines=['data.payload = output'])
+
+        if op == CALL:
+            self.add(depth, 'data, status = run({}, data, status)'.format(
+                self.function_name(instruction.start_instruction)))
+            return self.emit_status_branches(instruction, depth)
+
+        # generic instruction
+        self.add(depth, 'runner.exit_status = status')
+        self.add(depth, 'data = {}.run(runner, data)'.format(
+            self.instance(instruction)))
+        self.add(depth, 'status = runner.exit_status')
+        if op == BRANCHING_INSTRUCTION:
+            return self.emit_status_branches(instruction, depth)
+
+        self.count_exit_status(instruction, depth)
+        return on_success
+
+    def emit_status_branches(self, instruction, depth, on_success_lines=()):
+        on_success = instruction.next_instruction(exit_status=True)
+        on_failure = instruction.next_instruction(exit_status=False)
+
+        if on_success is on_failure:
+            if on_success_lines:
+                self.add(depth, 'if status:')
+                for line in on_success_lines:
+                    self.add(depth + 1, line)
+            self.count_exit_status(instruction, depth)
+            return on_success
+
+        self.add(depth, 'if status:')
+        for line in on_success_lines:
+            self.add(depth + 1, line)
+        self.count(instruction, depth + 1, 'success_count')
+        self.emit(on_success, depth + 1)
+        self.add(depth, 'else:')
+        self.count(instruction, depth + 1, 'failure_count')
+        self.emit(on_failure, depth + 1)
+        return END_OF_PATH
+
+    def emit_dispatch(self, instruction, depth):
+        self.emit_comment(instruction, depth)
+        dispatch = self.instance(instruction)
+        self.add(depth, 'status = {0}.lookup({0}.key(data))'.format(dispatch))
+        if self.statistics is not None:
+            self.add(depth, '{}.count(statistics, status)'.format(dispatch))
+        self.add(depth, 'return data, status, {}[status]'.format(
+            self.dispatch_table(instruction)))
+        return END_OF_PATH
+
+    def can_continue_as_elif(self, instruction):
+        return (
+            self.statistics is None and
+            instruction is not None and
+            instruction not in self.leaders and
+            opcode(instruction) == BRANCH and
+            len(successors(instruction)) == 2)
+
+    def emit_branch(self, instruction, depth):
+        keyword = 'if'
+        while True:
+            self.emit_comment(instruction, depth)
+            self.count_item(instruction, depth)
+            on_success = instruction.next_instruction(exit_status=True)
+            on_failure = instruction.next_instruction(exit_status=False)
+            condition = '{}(data.payload)'.format(self.func(instruction))
+
+            if on_success is on_failure:
+                self.add(depth, 'status = {}'.format(condition))
+                self.count_exit_status(instruction, depth)
+                return on_success
+
+            self.add(depth, '{} {}:'.format(keyword, condition))
+            self.add(depth + 1, 'status = True')
+            self.count(instruction, depth + 1, 'success_count')
+            self.emit(on_success, depth + 1)
+
+            if not self.can_continue_as_elif(on_failure):
+                break
+            keyword = 'elif'
+            instruction = on_failure
+
+        self.add(depth, 'else:')
+        self.add(depth + 1, 'status = False')
+        self.count(instruction, depth + 1, 'failure_count')
+        self.emit(on_failure, depth + 1)
+        return END_OF_PATH
+
+    # inline statistics
+
+    def count(self, instruction, depth, counter):
+        if self.statistics is not None:
+            self.add(
+                depth, '{}[{}] += 1'.format(counter, instruction.index))
+
+    def count_item(self, instruction, depth):
+        self.count(instruction, depth, 'item_count')
+
+    def count_exit_status(self, instruction, depth):
+        if self.statistics is not None:
+            self.add(depth, 'if status:')
+            self.count(instruction, depth + 1, 'success_count')
+            self.add(depth, 'else:')
+            self.count(instruction, depth + 1, 'failure_count')
+
+
+class CompiledRunner(compiler_base.Runner):
+
+    source = None
+    filename = None
+    statistics = None
+    functions = None
+
+    def __init__(self, start_instruction, statistics=None):
+        self.statistics = statistics
+        generator = Generator(start_instruction, statistics)
+        self.source = generator.source()
+
+        namespace = generator.namespace
+        namespace['runner'] = self
+        self.filename = '<tarr program {}>'.format(id(self))
+        cache_source(self, self.filename, self.source)
+        exec compile(self.source, self.filename, 'exec') in namespace
+
+        self.functions = dict(
+            (entry, namespace[generator.function_name(entry)])
+            for entry in generator.entries)
+
+    def run(self, start_instruction, state):
+        function = self.functions[start_instruction]
+        state, self.exit_status = run(function, state, self.exit_status)
+        return state
+
+
+class Program(compiler.Program):
+
+    # statistics are collected by counters in the generated code,
+    # run times are not measured
+    with_statistics = True
+
+    def make_runner(self):
+        statistics = None
+        if self.with_statistics:
+            statistics = compiler.make_statistics(len(self.instructions))
+        return CompiledRunner(self.entry_instruction, statistics)
+
+    @property
+    def source(self):
+        return self.runner.source
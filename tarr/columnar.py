@@ -0,0 +1,293 @@
+'''
+Columnar execution of compiled programs.
+
+ColumnarRunner runs a program on a whole batch of states at once: every
+instruction is run once for all the states reaching it, which are
+identified by a selection vector - the list of their positions in the
+batch. Branching instructions partition their selection into the
+selections of their successors, joins merge them again.
+
+Instructions are processed in topological order, so a joined instruction
+is run only after all of its predecessors are done with the batch.
+
+Instructions made by the @rule_batch and @branch_batch decorators get
+the payloads of the whole selection in one call, as a NumPy array if
+NumPy is available, otherwise as a list:
+
+    @branch_batch
+    def is_odd(numbers):
+        return numbers % 2 == 1
+
+They work with all the other runners as well, called with single item
+batches.
+'''
+
+import heapq
+
+from tarr import compiler_base
+from tarr.compiler import (
+    TarrInstructionBase, TarrRuleInstruction, TarrBranchInstruction,
+    TarrBranchRuleInstruction, HAVE_NOT_DONE_IT)
+from tarr.optimizer import Dispatch, successors
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def make_column(payloads):
+    '''NumPy array of payloads if NumPy is available, the list otherwise'''
+    if numpy is None:
+        return payloads
+
+    try:
+        column = numpy.array(payloads)
+    except ValueError:
+        # ragged sequences
+        column = None
+    if column is None or column.ndim != 1:
+        column = numpy.empty(len(payloads), dtype=object)
+        column[:] = payloads
+    return column
+
+
+class TarrBatchRuleInstruction(TarrInstructionBase, compiler_base.Instruction):
+
+    def run(self, runner, data):
+        data.payload = self.func(make_column([data.payload]))[0]
+        return data
+
+
+def rule_batch(func):
+    '''
+    Decorator, enable function transforming a column of payloads to be
+    used as an instruction in a Tarr program.
+
+    Usage:
+
+    @rule_batch
+    def func(payloads):
+        ...
+        return new_payloads
+    '''
+    func.compile = TarrBatchRuleInstruction(func).compile
+    return func
+
+
+class TarrBatchBranchInstruction(
+        TarrInstructionBase, compiler_base.BranchingInstruction):
+
+    def run(self, runner, data):
+        runner.set_exit_status(self.func(make_column([data.payload]))[0])
+        return data
+
+
+def branch_batch(func):
+    '''
+    Decorator, enable function testing a column of payloads to be used as
+    a condition in a Tarr program.
+
+    Usage:
+
+    @branch_batch
+    def cond(payloads):
+        ...
+        return [True | False for each payload]
+    '''
+    func.compile = TarrBatchBranchInstruction(func).compile
+    return func
+
+
+# column handlers: run an instruction on the states of a selection
+# and return the new states and exit statuses
+
+def run_rule(runner, instruction, states, statuses):
+    func = instruction.func
+    for state in states:
+        state.payload = func(state.payload)
+    return states, statuses
+
+
+def run_branch(runner, instruction, states, statuses):
+    func = instruction.func
+    return states, [func(state.payload) for state in states]
+
+
+def run_branch_rule(runner, instruction, states, statuses):
+    func = instruction.func
+    statuses = []
+    for state in states:
+        output = func(state.payload)
+        done_it = output is not HAVE_NOT_DONE_IT
+        if done_it:
+            state.payload = output
+        statuses.append(done_it)
+    return states, statuses
+
+
+def run_batch_rule(runner, instruction, states, statuses):
+    payloads = instruction.func(
+        make_column([state.payload for state in states]))
+    for (state, payload) in zip(states, payloads):
+        state.payload = payload
+    return states, statuses
+
+
+def run_batch_branch(runner, instruction, states, statuses):
+    return states, list(
+        instruction.func(make_column([state.payload for state in states])))
+
+
+def run_generic(runner, instruction, states, statuses):
+    new_states = []
+    new_statuses = []
+    for (state, status) in zip(states, statuses):
+        runner.exit_status = status
+        new_states.append(instruction.run(runner, state))
+        new_statuses.append(runner.exit_status)
+    return new_states, new_statuses
+
+
+COLUMN_HANDLERS = {
+    TarrRuleInstruction: run_rule,
+    TarrBranchInstruction: run_branch,
+    TarrBranchRuleInstruction: run_branch_rule,
+    TarrBatchRuleInstruction: run_batch_rule,
+    TarrBatchBranchInstruction: run_batch_branch,
+}
+
+
+def topological_ranks(start_instruction):
+    '''Rank of instructions, lower for instructions run earlier'''
+    def edges(instruction):
+        edges = successors(instruction)
+        if isinstance(instruction, compiler_base.Call):
+            edges.append(instruction.start_instruction)
+        return iter(edges)
+
+    postorder = []
+    visited = set([start_instruction])
+    stack = [(start_instruction, edges(start_instruction))]
+    while stack:
+        (instruction, children) = stack[-1]
+        for child in children:
+            if child not in visited:
+                visited.add(child)
+                stack.append((child, edges(child)))
+                break
+        else:
+            stack.pop()
+            postorder.append(instruction)
+
+    return dict(
+        (instruction, rank)
+        for (rank, instruction) in enumerate(reversed(postorder)))
+
+
+class Frame(object):
+
+    '''Selections waiting for the instructions of a running subprogram'''
+
+    def __init__(self, i_call, ranks):
+        self.i_call = i_call
+        self.ranks = ranks
+        self.queue = []
+        self.selections = dict()
+        self.returned = []
+
+    def add(self, instruction, selection):
+        if not selection:
+            return
+        if instruction is None:
+            self.returned.extend(selection)
+        elif instruction in self.selections:
+            self.selections[instruction].extend(selection)
+        else:
+            self.selections[instruction] = list(selection)
+            heapq.heappush(self.queue, (self.ranks[instruction], instruction))
+
+    def pop(self):
+        (_, instruction) = heapq.heappop(self.queue)
+        return instruction, sorted(self.selections.pop(instruction))
+
+
+class ColumnarRunner(compiler_base.Runner):
+
+    ranks = None
+    exit_statuses = None
+
+    def __init__(self, start_instruction):
+        self.ranks = topological_ranks(start_instruction)
+
+    def run(self, start_instruction, state):
+        [state] = self.run_batch(start_instruction, [state])
+        return state
+
+    def run_batch(self, start_instruction, states):
+        states = list(states)
+        self.exit_statuses = [self.exit_status] * len(states)
+
+        call_stack = []
+        frame = Frame(None, self.ranks)
+        frame.add(start_instruction, range(len(states)))
+        while True:
+            while frame.queue:
+                instruction, selection = frame.pop()
+                if isinstance(instruction, compiler_base.Call):
+                    if len(call_stack) >= self.max_call_depth:
+                        raise compiler_base.CallDepthExceededError(
+                            instruction.label)
+                    call_stack.append(frame)
+                    frame = Frame(instruction, self.ranks)
+                    frame.add(instruction.start_instruction, selection)
+                else:
+                    self.run_column(instruction, selection, states)
+                    self.split(instruction, selection, frame)
+
+            if not call_stack:
+                break
+
+            i_call, returned = frame.i_call, frame.returned
+            frame = call_stack.pop()
+            self.split(i_call, sorted(returned), frame)
+
+        if states:
+            self.exit_status = self.exit_statuses[-1]
+        return states
+
+    def run_column(self, instruction, selection, states):
+        statuses = self.exit_statuses
+        handler = COLUMN_HANDLERS.get(instruction.__class__, run_generic)
+        column_states, column_statuses = handler(
+            self, instruction,
+            [states[i] for i in selection],
+            [statuses[i] for i in selection])
+        for (i, state, status) in zip(
+                selection, column_states, column_statuses):
+            states[i] = state
+            statuses[i] = status
+
+    def split(self, instruction, selection, frame):
+        '''Pass on the selection to the successors of instruction'''
+        statuses = self.exit_statuses
+        if isinstance(instruction, Dispatch):
+            targets = instruction.targets
+            for i in selection:
+                frame.add(targets[statuses[i]], [i])
+        elif isinstance(instruction, compiler_base.BranchingInstruction):
+            frame.add(
+                instruction.instruction_on_yes,
+                [i for i in selection if statuses[i]])
+            frame.add(
+                instruction.instruction_on_no,
+                [i for i in selection if not statuses[i]])
+        else:
+            frame.add(
+                instruction.next_instruction(exit_status=True), selection)
+
+
+class Program(compiler_base.Program):
+
+    def make_runner(self):
+        return ColumnarRunner(self.entry_instruction)
@@ -1,72 +1,426 @@
+from array import array
+import pickle
+
 from tarr import compiler_base
-from datetime import datetime, timedelta
+from tarr.clock import now_ns
+from tarr.histogram import (
+    LatencyHistogram, BUCKET_COUNT, SUB_BUCKET_BITS)
+from tarr.optimizer import Dispatch
+from tarr.profiling import Profile
 
 
 from tarr.compiler_base import (
-    Instruction, BranchingInstruction,
+    Instruction, BranchingInstruction, Call,
     RETURN_TRUE, RETURN_FALSE,
     DEF, IF, ELIF, ELSE, ENDIF,
-    IF_NOT, ELIF_NOT)
+    IF_NOT, ELIF_NOT, EXCLUSIVE_IF)
+
+
+# counters of an instruction, StatisticsStore has an array for each
+COUNTERS = (
+    'item_count', 'success_count', 'failure_count',
+    # nanoseconds spent in the timed runs
+    'run_time',
+    # number of timed runs
+    'timed_count')
+
+try:
+    COUNTER_TYPECODE = 'q'
+    array(COUNTER_TYPECODE)
+except ValueError:
+    # no 'q' before Python 3.3, long is 64 bits on 64 bit POSIX systems
+    COUNTER_TYPECODE = 'l'
+
+
+def _counter(name):
+    def get(self):
+        return getattr(self.store, name)[self.index]
+
+    def set(self, value):
+        getattr(self.store, name)[self.index] = value
+
+    return property(get, set)
 
 
 class InstructionStatistic(object):
 
-    index = int
-    item_count = int
-    success_count = int
-    failure_count = int
-    run_time = timedelta
+    '''View of the statistics of one instruction in a StatisticsStore'''
+
+    item_count = _counter('item_count')
+    success_count = _counter('success_count')
+    failure_count = _counter('failure_count')
+    run_time = _counter('run_time')
+    timed_count = _counter('timed_count')
 
-    def init(self, index):
+    def __init__(self, store, index):
+        self.store = store
         self.index = index
-        self.item_count = 0
-        self.success_count = 0
-        self.failure_count = 0
-        self.run_time = timedelta()
+
+    @property
+    def latency(self):
+        '''Copy of the latencies of the timed runs as a LatencyHistogram'''
+        return self.store.latency_histogram(self.index)
+
+    def add_run_time(self, run_time):
+        self.store.add_run_time(self.index, run_time)
 
     @property
     def had_exception(self):
         return self.item_count > self.success_count + self.failure_count
 
+    @property
+    def estimated_run_time(self):
+        '''Nanoseconds for all the runs, extrapolated from the timed ones'''
+        if not self.timed_count:
+            return 0
+        return self.run_time * self.item_count / float(self.timed_count)
+
     def merge(self, from_stat):
-        assert self.node_name == from_stat.node_name
-        self.item_count += from_stat.item_count
-        self.success_count += from_stat.success_count
-        self.failure_count += from_stat.failure_count
-        self.run_time += from_stat.run_time
+        assert self.index == from_stat.index
+        for name in COUNTERS:
+            getattr(self.store, name)[self.index] += getattr(from_stat, name)
+        self.store.merge_latency(self.index, from_stat.latency)
 
 
-class StatisticsCollectorRunner(compiler_base.Runner):
+class StatisticsStore(object):
+
+    '''
+    Statistics of the instructions of a program, indexed by instruction
+    index.
+
+    Every counter in COUNTERS is an array, e.g. store.item_count[index].
+    The latency histograms are sparse: latency_max[index] is the longest
+    timed run, latency_counts maps the index of each timed instruction to
+    an array of its BUCKET_COUNT bucket counts - allocated on its first
+    timed run, so untimed instructions cost no histogram memory. The
+    number of recorded latencies is timed_count.
+    store[index] is an InstructionStatistic view of the same data.
+
+    Pickles arrays as raw bytes, used latencies in packed form.
+    '''
+
+    def __init__(self, count=0):
+        for name in COUNTERS:
+            setattr(self, name, array(COUNTER_TYPECODE))
+        self.latency_max = array(COUNTER_TYPECODE)
+        self.latency_counts = {}
+        self.extend_to(count)
+
+    def extend_to(self, count):
+        '''Make room for count instructions.
+
+        Arrays are extended in place, so references to them stay valid.
+        '''
+        missing = count - len(self)
+        if missing > 0:
+            for name in COUNTERS + ('latency_max',):
+                getattr(self, name).extend(
+                    array(COUNTER_TYPECODE, [0]) * missing)
+
+    def buckets(self, index):
+        '''Bucket counts of instruction index, allocated on first use'''
+        counts = self.latency_counts.get(index)
+        if counts is None:
+            counts = self.latency_counts[index] = (
+                array(COUNTER_TYPECODE, [0]) * BUCKET_COUNT)
+        return counts
+
+    def __len__(self):
+        return len(self.item_count)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [
+                InstructionStatistic(self, i)
+                for i in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return InstructionStatistic(self, index)
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield InstructionStatistic(self, index)
+
+    def add_run_time(self, index, run_time):
+        self.run_time[index] += run_time
+        self.timed_count[index] += 1
+        if run_time < 0:
+            # clock went backwards
+            run_time = 0
+        # histogram.bucket_index inlined, this is run for every timed
+        # instruction
+        shift = run_time.bit_length() - SUB_BUCKET_BITS - 1
+        if shift <= 0:
+            bucket = run_time
+        else:
+            bucket = min(
+                (shift << SUB_BUCKET_BITS) + (run_time >> shift),
+                BUCKET_COUNT - 1)
+        counts = self.latency_counts.get(index)
+        if counts is None:
+            counts = self.buckets(index)
+        counts[bucket] += 1
+        if run_time > self.latency_max[index]:
+            self.latency_max[index] = run_time
+
+    @property
+    def latency(self):
+        '''LatencyHistogram copies of all the instructions'''
+        return [self.latency_histogram(index) for index in xrange(len(self))]
+
+    def latency_histogram(self, index):
+        '''Copy of the latencies of instruction index'''
+        histogram = LatencyHistogram()
+        count = self.timed_count[index]
+        counts = self.latency_counts.get(index)
+        if count and counts is not None:
+            histogram.counts = counts.tolist()
+            histogram.count = count
+            histogram.max = self.latency_max[index]
+        return histogram
+
+    def merge_latency(self, index, histogram):
+        '''Add the buckets and maximum of a LatencyHistogram to index.
+
+        The count is not changed, that is timed_count.
+        '''
+        if not histogram.count:
+            return
+        counts = self.buckets(index)
+        for (bucket, count) in enumerate(histogram.counts):
+            if count:
+                counts[bucket] += count
+        self.latency_max[index] = max(
+            self.latency_max[index], histogram.max)
+
+    def snapshot(self):
+        '''
+        Copy of the store.
+
+        Each array is copied by a single slice, which does not release
+        the GIL, so counters are not torn, even if another thread is
+        updating them. Only the allocated histograms are copied.
+        '''
+        copy = self.__class__()
+        for name in COUNTERS + ('latency_max',):
+            setattr(copy, name, getattr(self, name)[:])
+        copy.latency_counts = dict(
+            (index, counts[:])
+            for (index, counts) in self.latency_counts.items())
+        return copy
+
+    def merge(self, other):
+        '''Add statistics of the same program'''
+        if len(other) != len(self):
+            raise ValueError(
+                'Statistics of {} instructions can not be merged into {}'
+                .format(len(other), len(self)))
+        for name in COUNTERS:
+            counters = getattr(self, name)
+            for (index, value) in enumerate(getattr(other, name)):
+                if value:
+                    counters[index] += value
+        for index in other.latency_counts.keys():
+            self.merge_latency(index, other.latency_histogram(index))
+
+    def __getstate__(self):
+        return dict(
+            counters=[getattr(self, name).tostring() for name in COUNTERS],
+            size=len(self),
+            latency=dict(
+                (index, self.latency_histogram(index).pack())
+                for index in self.latency_counts.keys()
+                if self.timed_count[index]))
+
+    def __setstate__(self, state):
+        for (name, counters) in zip(COUNTERS, state['counters']):
+            values = array(COUNTER_TYPECODE)
+            values.fromstring(counters)
+            setattr(self, name, values)
+        self.latency_max = array(COUNTER_TYPECODE, [0]) * state['size']
+        self.latency_counts = {}
+        for (index, latency) in state['latency'].iteritems():
+            self.merge_latency(index, LatencyHistogram.unpack(latency))
+
+
+def make_statistics(count):
+    return StatisticsStore(count)
+
+
+def pack_statistics(statistics):
+    '''
+    Compact, picklable copy of statistics, e.g. to send them between
+    processes
+    '''
+    return statistics.snapshot()
+
+
+def merge_statistics(statistics, packed):
+    '''Add packed statistics of the same program to statistics'''
+    statistics.merge(packed)
+
+
+def save_statistics(statistics, filename):
+    with open(filename, 'wb') as f:
+        pickle.dump(statistics, f, pickle.HIGHEST_PROTOCOL)
+
+
+def load_statistics(filename):
+    '''Statistics saved by save_statistics'''
+    with open(filename, 'rb') as f:
+        return pickle.load(f)
+
+
+# statistics levels, see Program.statistics_level
+STATISTICS_OFF = 'off'
+STATISTICS_COUNTS = 'counts'
+STATISTICS_SAMPLED = 'sampled'
+STATISTICS_FULL = 'full'
+
+
+class StatisticsRunner(compiler_base.Runner):
+
+    '''
+    Runner with statistics, a StatisticsStore preallocated for all the
+    instructions.
+
+    This one does not update statistics at all.
+    '''
 
     statistics = None
 
-    def __init__(self):
-        self.statistics = []
+    def __init__(self, statistics):
+        self.statistics = statistics
+
+    def ensure_statistics(self, index):
+        self.statistics.extend_to(index + 1)
+
+
+class CountingRunner(StatisticsRunner):
+
+    '''Counts items, successes and failures, does not measure time'''
+
+    def __init__(self, statistics):
+        super(CountingRunner, self).__init__(statistics)
+        self.item_count = statistics.item_count
+        self.success_count = statistics.success_count
+        self.failure_count = statistics.failure_count
 
     def run_instruction(self, instruction, state):
-        self.ensure_statistics(instruction.index)
+        if isinstance(instruction, Dispatch):
+            return self.run_dispatch(instruction, state)
 
-        before = datetime.now()
-        stat = self.statistics[instruction.index]
-        stat.item_count += 1
+        index = instruction.index
+        self.item_count[index] += 1
 
         state = instruction.run(self, state)
 
         if self.exit_status:
-            stat.success_count += 1
+            self.success_count[index] += 1
         else:
-            stat.failure_count += 1
+            self.failure_count[index] += 1
 
-        after = datetime.now()
-        stat.run_time += after - before
+        return state
 
+    def run_dispatch(self, dispatch, state):
+        state = dispatch.run(self, state)
+        dispatch.count(self.statistics, self.exit_status)
         return state
 
-    def ensure_statistics(self, index):
-        while index >= len(self.statistics):
-            stat = InstructionStatistic()
-            stat.init(len(self.statistics))
-            self.statistics.append(stat)
+    def enter_call(self, i_call):
+        self.item_count[i_call.index] += 1
+
+    def leave_call(self, i_call, context):
+        if self.exit_status:
+            self.success_count[i_call.index] += 1
+        else:
+            self.failure_count[i_call.index] += 1
+
+
+class StatisticsCollectorRunner(CountingRunner):
+
+    '''Counts and measures the run time of every instruction'''
+
+    def run_instruction(self, instruction, state):
+        if isinstance(instruction, Dispatch):
+            return self.run_dispatch(instruction, state)
+
+        index = instruction.index
+        self.item_count[index] += 1
+
+        before = now_ns()
+        state = instruction.run(self, state)
+        after = now_ns()
+
+        if self.exit_status:
+            self.success_count[index] += 1
+        else:
+            self.failure_count[index] += 1
+
+        self.statistics.add_run_time(index, after - before)
+
+        return state
+
+    def run_dispatch(self, dispatch, state):
+        before = now_ns()
+        state = dispatch.run(self, state)
+        after = now_ns()
+
+        dispatch.count(self.statistics, self.exit_status)
+        self.statistics.add_run_time(dispatch.index, after - before)
+
+        return state
+
+    def enter_call(self, i_call):
+        self.item_count[i_call.index] += 1
+        return now_ns()
+
+    def leave_call(self, i_call, before):
+        index = i_call.index
+        if self.exit_status:
+            self.success_count[index] += 1
+        else:
+            self.failure_count[index] += 1
+
+        # before is None for calls entered without measuring time
+        if before is not None:
+            self.statistics.add_run_time(index, now_ns() - before)
+
+
+class SampledStatisticsRunner(StatisticsCollectorRunner):
+
+    '''Counts every item, but measures run times for every interval-th
+    item only
+    '''
+
+    interval = 100
+    item_number = 0
+
+    def __init__(self, statistics, interval=None):
+        super(SampledStatisticsRunner, self).__init__(statistics)
+        if interval is not None:
+            self.interval = interval
+
+        # the hooks are switched per item, not checked per instruction
+        timed = super(SampledStatisticsRunner, self)
+        self.timed_hooks = (
+            timed.run_instruction, timed.run_dispatch, timed.enter_call)
+        self.counting_hooks = (
+            CountingRunner.run_instruction.__get__(self),
+            CountingRunner.run_dispatch.__get__(self),
+            CountingRunner.enter_call.__get__(self))
+
+    def run(self, start_instruction, state):
+        if self.item_number % self.interval == 0:
+            hooks = self.timed_hooks
+        else:
+            hooks = self.counting_hooks
+        self.run_instruction, self.run_dispatch, self.enter_call = hooks
+        self.item_number += 1
+        return super(SampledStatisticsRunner, self).run(
+            start_instruction, state)
 
 
 class ToTextVisitor(compiler_base.ProgramVisitor):
@@ -129,13 +483,39 @@ class ToTextVisitor(compiler_base.ProgramVisitor):
 
 class ToTextVisitorWithStatistics(ToTextVisitor):
 
+    '''
+    Text with counts, and latency percentiles of timed instructions.
+
+    The latency of a DEF is that of all the CALLs to it - CALLs come
+    before the called DEF, so they are already visited.
+    '''
+
     def __init__(self, statistics):
         super(ToTextVisitorWithStatistics, self).__init__()
         self.statistics = statistics
+        self.subprogram_latencies = dict()
+
+    def add_latency(self, latency):
+        summary = latency.summary()
+        if summary is not None:
+            self.addcomment('  # latency: {0}'.format(summary))
+
+    def enter_subprogram(self, label, instructions):
+        super(ToTextVisitorWithStatistics, self).enter_subprogram(
+            label, instructions)
+        if label in self.subprogram_latencies:
+            self.add_latency(self.subprogram_latencies[label])
+
+    def visit_call(self, i_call):
+        latency = self.subprogram_latencies.setdefault(
+            i_call.label, LatencyHistogram())
+        latency.merge(self.statistics[i_call.index].latency)
+        super(ToTextVisitorWithStatistics, self).visit_call(i_call)
 
     def format_branch(self, instruction, name):
         statistics = self.statistics[instruction.index]
         self.addcode(instruction, name)
+        self.add_latency(statistics.latency)
         on_success = instruction.next_instruction(exit_status=True).index
         on_failure = instruction.next_instruction(exit_status=False).index
         self.addcomment(
@@ -149,6 +529,12 @@ class ToTextVisitorWithStatistics(ToTextVisitor):
         statistics = self.statistics[instruction.index]
         self.addcode(
             instruction, '{0}   (*{1.item_count})'.format(name, statistics))
+        self.add_latency(statistics.latency)
+
+    def visit_instruction(self, instruction):
+        super(ToTextVisitorWithStatistics, self).visit_instruction(
+            instruction)
+        self.add_latency(self.statistics[instruction.index].latency)
 
     def format_call_line(self, i_call):
         statistics = self.statistics[i_call.index]
@@ -225,17 +611,17 @@ class ToDotVisitor(compiler_base.ProgramVisitor):
     def add_return_node(self, instruction, name):
         self.add_node(instruction, name)
 
-    def format_edge(self, instruction1, instruction2, label):
+    def format_edge(self, instruction1, instruction2, label, attrs=()):
         node1 = self.node_name(instruction1)
         node2 = self.node_name(instruction2)
-        attrs = dict()
+        attrs = dict(attrs)
         if label:
             attrs['label'] = '"{}"'.format(self.escape(label))
         if attrs:
             formatted_attrs = ' [{}]'.format(
                 ','.join(
                     '{}={}'.format(attr, value)
-                    for (attr, value) in attrs.iteritems()))
+                    for (attr, value) in sorted(attrs.iteritems())))
         else:
             formatted_attrs = ''
 
@@ -285,17 +671,226 @@ class ToDotVisitorWithStatistics(ToDotVisitor):
         return str(statistics.item_count)
 
 
+class ToDotHeatMapVisitor(ToDotVisitor):
+
+    '''
+    Performance view of a program.
+
+    Nodes are coloured and sized by their share of the total run time -
+    of the total item count, if run times were not measured. The share of
+    a CALL is its part of the cost of the called subprogram - including
+    the subprograms called from there - by its item count. The measured
+    run time of a CALL includes timing overhead, so it is not used.
+    Edges are as wide as the number of times they were traversed.
+
+    Subprograms below cold_threshold share are collapsed into a single
+    node each.
+    '''
+
+    MIN_FONT_SIZE = 10
+    MAX_FONT_SIZE = 30
+    MAX_PEN_WIDTH = 8
+
+    def __init__(self, statistics, sub_programs, cold_threshold=None):
+        super(ToDotHeatMapVisitor, self).__init__()
+        self.statistics = statistics
+        sub_programs = list(sub_programs)
+        instructions = [
+            instruction
+            for (_, sub_program) in sub_programs
+            for instruction in sub_program]
+
+        self.use_run_time = any(
+            statistics[i.index].timed_count for i in instructions)
+        self.total = sum(
+            self.cost(i) for i in instructions if not isinstance(i, Call))
+        self.max_share = max(
+            [self.share(i) for i in instructions if not isinstance(i, Call)] +
+            [0]) or 1.0
+        self.max_count = max(
+            [statistics[i.index].item_count for i in instructions] + [0]) or 1
+
+        # label -> instructions of the subprogram
+        self.sub_programs = dict(sub_programs)
+        # label -> item count of all the CALLs to it
+        self.call_counts = dict()
+        for instruction in instructions:
+            if isinstance(instruction, Call):
+                self.call_counts[instruction.label] = (
+                    self.call_counts.get(instruction.label, 0) +
+                    statistics[instruction.index].item_count)
+        # label -> cost of a call of the subprogram, including the
+        # subprograms called from it
+        self.costs_per_call = dict()
+
+        # instructions of collapsed subprograms -> (node name, share)
+        self.collapsed = dict()
+        self.in_collapsed = False
+        if cold_threshold is not None:
+            for (label, sub_program) in sub_programs:
+                if label is None:
+                    continue
+                share = sum(
+                    self.share(i) for i in sub_program
+                    if not isinstance(i, Call))
+                if share < cold_threshold:
+                    node = 'collapsed_{}'.format(sub_program[0].index)
+                    for instruction in sub_program:
+                        self.collapsed[instruction] = (node, share)
+
+    def cost(self, instruction):
+        stat = self.statistics[instruction.index]
+        if self.use_run_time:
+            return stat.estimated_run_time
+        return stat.item_count
+
+    def cost_per_call(self, label):
+        # subprograms can only call the ones defined after them,
+        # so this ends
+        if label not in self.costs_per_call:
+            call_count = self.call_counts[label]
+            cost = sum(
+                self.inclusive_cost(instruction)
+                for instruction in self.sub_programs[label])
+            self.costs_per_call[label] = (
+                cost / float(call_count) if call_count else 0.0)
+        return self.costs_per_call[label]
+
+    def inclusive_cost(self, instruction):
+        if isinstance(instruction, Call):
+            return (
+                self.statistics[instruction.index].item_count *
+                self.cost_per_call(instruction.label))
+        return self.cost(instruction)
+
+    def share(self, instruction):
+        if not self.total:
+            return 0.0
+        return self.inclusive_cost(instruction) / float(self.total)
+
+    def heat_attrs(self, share):
+        # relative to the hottest non-CALL instruction
+        heat = min(1.0, share / self.max_share)
+        return (
+            'style=filled',
+            'fillcolor="0.000 {:.3f} 1.000"'.format(heat),
+            'fontsize={}'.format(
+                int(round(
+                    self.MIN_FONT_SIZE +
+                    heat * (self.MAX_FONT_SIZE - self.MIN_FONT_SIZE)))))
+
+    def node_name(self, instruction):
+        if instruction in self.collapsed:
+            node, _ = self.collapsed[instruction]
+            return node
+        return super(ToDotHeatMapVisitor, self).node_name(instruction)
+
+    def enter_subprogram(self, label, instructions):
+        self.in_collapsed = bool(
+            instructions and instructions[0] in self.collapsed)
+        if not self.in_collapsed:
+            super(ToDotHeatMapVisitor, self).enter_subprogram(
+                label, instructions)
+            return
+
+        node, share = self.collapsed[instructions[0]]
+        self.addline('')
+        self.addline(
+            '{} [label="DEF {}\\n{:.1%} (collapsed)",{}];'.format(
+                node, self.escape(label), share,
+                ','.join(self.heat_attrs(share))))
+
+    def leave_subprogram(self, label):
+        if self.in_collapsed:
+            self.in_collapsed = False
+            return
+        super(ToDotHeatMapVisitor, self).leave_subprogram(label)
+
+    def add_node(self, instruction, name):
+        if instruction in self.collapsed:
+            return
+        share = self.share(instruction)
+        incl = ' incl.' if isinstance(instruction, Call) else ''
+        self.addline(
+            '    {} [label="{}\\n{:.1%}{}",{}];'.format(
+                self.node_name(instruction), self.escape(name), share, incl,
+                ','.join(self.heat_attrs(share))))
+
+    def edge_attrs(self, count):
+        return dict(
+            penwidth='{:.1f}'.format(
+                1 + (self.MAX_PEN_WIDTH - 1) * count / float(self.max_count)))
+
+    def add_counted_edge(self, instruction1, instruction2, count):
+        if self.node_name(instruction1) == self.node_name(instruction2):
+            # within a collapsed subprogram
+            return
+        self.addline(
+            self.format_edge(
+                instruction1, instruction2, str(count),
+                self.edge_attrs(count)))
+
+    def format_branch(self, instruction, name):
+        self.add_node(instruction, name)
+        stat = self.statistics[instruction.index]
+        self.add_counted_edge(
+            instruction, instruction.next_instruction(exit_status=True),
+            stat.success_count)
+        self.add_counted_edge(
+            instruction, instruction.next_instruction(exit_status=False),
+            stat.failure_count)
+
+    def format_instruction(self, instruction, name):
+        self.add_node(instruction, name)
+        stat = self.statistics[instruction.index]
+        self.add_counted_edge(
+            instruction, instruction.next_instruction(exit_status=True),
+            stat.success_count + stat.failure_count)
+
+    def visit_call(self, i_call):
+        count = self.statistics[i_call.index].item_count
+        if (
+                self.node_name(i_call) !=
+                self.node_name(i_call.start_instruction)):
+            self.inter_cluster_edges.append(
+                self.format_edge(
+                    i_call, i_call.start_instruction, str(count),
+                    self.edge_attrs(count)))
+        self.format_branch(i_call, 'CALL {0}'.format(i_call.label))
+
+
 class Program(compiler_base.Program):
 
-    # FIXME: Program.__init__ should initialize statistic
-    # as well by calling runner.ensure_statistics
+    # what to collect in statistics: STATISTICS_OFF, STATISTICS_COUNTS,
+    # STATISTICS_SAMPLED (counts, run time of some items) or
+    # STATISTICS_FULL (counts, run time of all items)
+    statistics_level = STATISTICS_FULL
+    # STATISTICS_SAMPLED measures run time of every timing_interval-th item
+    timing_interval = 100
+
     def make_runner(self):
-        return StatisticsCollectorRunner()
+        statistics = make_statistics(len(self.instructions))
+        level = self.statistics_level
+        if level == STATISTICS_OFF:
+            return StatisticsRunner(statistics)
+        if level == STATISTICS_COUNTS:
+            return CountingRunner(statistics)
+        if level == STATISTICS_SAMPLED:
+            return SampledStatisticsRunner(statistics, self.timing_interval)
+        if level == STATISTICS_FULL:
+            return StatisticsCollectorRunner(statistics)
+        raise ValueError('Unknown statistics level: {!r}'.format(level))
 
     @property
     def statistics(self):
         return self.runner.statistics
 
+    def save_profile(self, filename):
+        '''Save statistics for ordering EXCLUSIVE_IF ladders,
+        see tarr.profiling
+        '''
+        Profile.from_statistics(self.statistics).save(filename)
+
     def to_text(self, with_statistics=False):
         if with_statistics:
             v = ToTextVisitorWithStatistics(self.statistics)
@@ -312,6 +907,19 @@ class Program(compiler_base.Program):
         self.accept(v)
         return v.text()
 
+    def to_heat_map_dot(self, cold_threshold=None):
+        '''
+        Graph of the program coloured by statistics, subprograms below
+        cold_threshold (0..1) share of the total run time are collapsed
+        '''
+        v = ToDotHeatMapVisitor(
+            self.statistics, self.sub_programs(), cold_threshold)
+        self.accept(v)
+        return v.text()
+
+    def save_statistics(self, filename):
+        save_statistics(self.statistics, filename)
+
 
 # decorators to make simple functions into Instructions
 
@@ -413,10 +1021,84 @@ def branch_rule(func):
     return func
 
 
+class FieldEquals(compiler_base.FieldEquals):
+
+    '''
+    Condition data.payload[field] == value.
+
+    Usage:
+
+    IF (FieldEquals('object', 'dog')),
+        ...
+    ELIF (FieldEquals('object', 'cat')),
+        ...
+    ENDIF
+    '''
+
+    def key(self, data):
+        return data.payload[self.field]
+
+
+class FieldSearch(compiler_base.FieldSearch):
+
+    '''
+    Condition re.search(pattern, data.payload[field], flags).
+
+    Usage:
+
+    IF (FieldSearch('text', r'\bdogs?\b', re.IGNORECASE)),
+        ...
+    ELIF (FieldSearch('text', r'\bcats?\b', re.IGNORECASE)),
+        ...
+    ENDIF
+    '''
+
+    def key(self, data):
+        return data.payload[self.field]
+
+
+class FieldContainsKeyword(compiler_base.FieldContainsKeyword):
+
+    '''
+    Condition data.payload[field] contains any of the keywords.
+
+    Usage:
+
+    IF (FieldContainsKeyword('text', KEYWORDS)),
+        ...
+    ENDIF
+    '''
+
+    def key(self, data):
+        return data.payload[self.field]
+
+
+class FieldInBucket(compiler_base.FieldInBucket):
+
+    '''
+    Condition data.payload[field] falls into bucket of thresholds.
+
+    Usage:
+
+    IF (FieldInBucket('size', [10, 100], 0)),
+        # size < 10
+    ELIF (FieldInBucket('size', [10, 100], 1)),
+        # 10 <= size < 100
+    ELSE,
+        # 100 <= size
+    ENDIF
+    '''
+
+    def key(self, data):
+        return data.payload[self.field]
+
+
 __all__ = [
     Program,
+    STATISTICS_OFF, STATISTICS_COUNTS, STATISTICS_SAMPLED, STATISTICS_FULL,
     branch, rule, branch_rule, HAVE_NOT_DONE_IT,
+    FieldEquals, FieldSearch, FieldContainsKeyword, FieldInBucket,
     RETURN_TRUE, RETURN_FALSE,
     DEF, IF, ELIF, ELSE, ENDIF,
-    IF_NOT, ELIF_NOT,
+    IF_NOT, ELIF_NOT, EXCLUSIVE_IF,
 ]
@@ -1,3 +1,9 @@
+import bisect
+import re
+
+from tarr.aho_corasick import Automaton
+
+
 class DuplicateLabelError(Exception):
     pass
 
@@ -30,6 +36,10 @@ class ElIfAfterElseError(Exception):
     pass
 
 
+class CallDepthExceededError(Exception):
+    pass
+
+
 class Compilable(object):
 
     def compile(self, compiler):
@@ -39,6 +49,8 @@ class Compilable(object):
 class InstructionBase(Compilable):
 
     index = None
+    # checked by Runner for every instruction, cheaper than isinstance()
+    is_call = False
 
     # run time
     def run(self, runner, state):
@@ -133,6 +145,157 @@ class BranchingInstruction(InstructionBase):
         visitor.visit_branch(self)
 
 
+class FieldEquals(BranchingInstruction):
+
+    '''
+    Branch on state[field] == value.
+
+    ELIF chains of FieldEquals on the same field can be run as a single
+    dict lookup, see tarr.optimizer.Dispatcher.
+    '''
+
+    field = None
+    value = None
+
+    def __init__(self, field, value):
+        self.field = field
+        self.value = value
+
+    def key(self, state):
+        return state[self.field]
+
+    def matches(self, key):
+        return key == self.value
+
+    def run(self, runner, state):
+        runner.set_exit_status(self.matches(self.key(state)))
+        return state
+
+    def clone(self):
+        return self.__class__(self.field, self.value)
+
+    @property
+    def instruction_name(self):
+        return '{0} == {1!r}'.format(self.field, self.value)
+
+
+class FieldSearch(BranchingInstruction):
+
+    '''
+    Branch on re.search(pattern, state[field], flags) finding a match.
+
+    ELIF chains of FieldSearch on the same field can be run as a single
+    combined regular expression, see tarr.optimizer.Dispatcher.
+    '''
+
+    field = None
+    pattern = None
+    flags = 0
+    regex = None
+
+    def __init__(self, field, pattern, flags=0):
+        self.field = field
+        self.pattern = pattern
+        self.flags = flags
+        self.regex = re.compile(pattern, flags)
+
+    def key(self, state):
+        return state[self.field]
+
+    def matches(self, key):
+        return self.regex.search(key) is not None
+
+    def run(self, runner, state):
+        runner.set_exit_status(self.matches(self.key(state)))
+        return state
+
+    def clone(self):
+        return self.__class__(self.field, self.pattern, self.flags)
+
+    @property
+    def instruction_name(self):
+        return '{0} =~ {1!r}'.format(self.field, self.pattern)
+
+
+class FieldContainsKeyword(BranchingInstruction):
+
+    '''
+    Branch on state[field] containing any of the keywords.
+
+    The keywords are indexed once in an Aho-Corasick automaton, which is
+    shared by the clones.
+    '''
+
+    field = None
+    automaton = None
+
+    def __init__(self, field, keywords):
+        self.field = field
+        if isinstance(keywords, Automaton):
+            self.automaton = keywords
+        else:
+            self.automaton = Automaton(keywords)
+
+    def key(self, state):
+        return state[self.field]
+
+    def run(self, runner, state):
+        runner.set_exit_status(self.automaton.contains_any(self.key(state)))
+        return state
+
+    def clone(self):
+        return self.__class__(self.field, self.automaton)
+
+    @property
+    def instruction_name(self):
+        return '{0} contains any of {1} keywords'.format(
+            self.field, len(self.automaton.keywords))
+
+
+class FieldInBucket(BranchingInstruction):
+
+    '''
+    Branch on state[field] falling into bucket of thresholds:
+
+        thresholds[bucket - 1] <= state[field] < thresholds[bucket]
+
+    Bucket 0 is below the first threshold, bucket len(thresholds) is at
+    or above the last one.
+
+    ELIF chains of FieldInBucket on the same field and thresholds can be
+    run as a single bisect, see tarr.optimizer.Dispatcher.
+    '''
+
+    field = None
+    thresholds = None
+    bucket = None
+
+    def __init__(self, field, thresholds, bucket):
+        self.field = field
+        self.thresholds = tuple(sorted(thresholds))
+        self.bucket = bucket
+
+    def key(self, state):
+        return state[self.field]
+
+    def bucket_of(self, value):
+        return bisect.bisect_right(self.thresholds, value)
+
+    def matches(self, key):
+        return self.bucket_of(key) == self.bucket
+
+    def run(self, runner, state):
+        runner.set_exit_status(self.matches(self.key(state)))
+        return state
+
+    def clone(self):
+        return self.__class__(self.field, self.thresholds, self.bucket)
+
+    @property
+    def instruction_name(self):
+        return '{0} in bucket {1}'.format(self.field, self.bucket)
+
+
 class Define(Compilable):
 
     label = None
@@ -151,7 +314,15 @@ DEF = Define
 
 class Runner(object):
 
+    '''
+    Runs instructions until the RETURN of the start instruction's program.
+
+    CALLs are not run recursively: the runner keeps the return addresses
+    on an explicit call stack and jumps into the called subprogram.
+    '''
+
     exit_status = None
+    max_call_depth = 1000
 
     def set_exit_status(self, value):
         self.exit_status = value
@@ -159,18 +330,55 @@ class Runner(object):
     def run_instruction(self, instruction, state):
         return instruction.run(self, state)
 
+    def enter_call(self, i_call):
+        '''Called before jumping into a subprogram.
+
+        The return value is passed to leave_call().
+        '''
+        pass
+
+    def leave_call(self, i_call, context):
+        '''Called after the subprogram of i_call has returned'''
+        pass
+
     def run(self, start_instruction, state):
-        instruction = start_instruction
+        return self.resume(start_instruction, state, [])
 
-        while instruction:
-            state = self.run_instruction(instruction, state)
-            instruction = instruction.next_instruction(self.exit_status)
+    def resume(self, instruction, state, call_stack):
+        '''Continue running at instruction.
 
-        return state
+        call_stack is a list of (i_call, context) for the CALLs to return
+        from after the current subprogram, the innermost last.
+        '''
+        run_instruction = self.run_instruction
+        while True:
+            while instruction and not instruction.is_call:
+                state = run_instruction(instruction, state)
+                instruction = instruction.next_instruction(self.exit_status)
+
+            if instruction:
+                if len(call_stack) >= self.max_call_depth:
+                    raise CallDepthExceededError(instruction.label)
+                context = self.enter_call(instruction)
+                call_stack.append((instruction, context))
+                instruction = instruction.start_instruction
+                continue
+
+            if not call_stack:
+                return state
+
+            i_call, context = call_stack.pop()
+            self.leave_call(i_call, context)
+            instruction = i_call.next_instruction(self.exit_status)
+
+    def run_batch(self, start_instruction, states):
+        '''Run on each of states, returns the list of the results'''
+        return [self.run(start_instruction, state) for state in states]
 
 
 class Call(BranchingInstruction):
 
+    is_call = True
     label = None
     start_instruction = None
 
@@ -228,8 +436,55 @@ class CompileIfNot(CompileIf):
 IF_NOT = CompileIfNot
 
 
+class CompileExclusiveIf(CompileIf):
+
+    '''
+    IF starting a ladder of mutually exclusive conditions.
+
+    At most one of the conditions of the IF and its ELIFs may hold for
+    any state, so they can be tested in any order - see
+    tarr.profiling.Profile for reordering them.
+    '''
+
+    def compile(self, compiler):
+        super(CompileExclusiveIf, self).compile(compiler)
+        frame = compiler.control_stack[-1]
+        frame.ladder = ExclusiveLadder(compiler.last_instruction)
+
+EXCLUSIVE_IF = CompileExclusiveIf
+
+
+class ExclusiveLadder(object):
+
+    '''
+    Conditions of an EXCLUSIVE_IF ladder in source order.
+
+    arms are (instruction, negated) pairs, negated is True for ELIF_NOT:
+    a condition holds if instruction exits with (not negated), otherwise
+    the next arm is tested.
+    '''
+
+    def __init__(self, instruction):
+        self.arms = [(instruction, False)]
+
+    def add_arm(self, instruction, negated):
+        self.arms.append((instruction, negated))
+
+    @property
+    def head(self):
+        return self.arms[0][0]
+
+    @property
+    def tail(self):
+        '''Instruction to continue with when none of the conditions hold'''
+        instruction, negated = self.arms[-1]
+        return instruction.next_instruction(negated)
+
+
 class CompileElIf(Compilable):
 
+    negated = False
+
     def __init__(self, branch_instruction):
         self.branch_instruction = branch_instruction
 
@@ -248,6 +503,8 @@ class CompileElIf(Compilable):
         frame.elif_path, frame.else_path = frame.else_path.split(
             compiler.last_instruction)
         compiler.path = frame.elif_path
+        if frame.ladder is not None:
+            frame.ladder.add_arm(compiler.last_instruction, self.negated)
 
         compiler.control_stack.append(frame)
 
@@ -256,6 +513,8 @@ ELIF = CompileElIf
 
 class CompileElIfNot(CompileElIf):
 
+    negated = True
+
     def compile(self, compiler):
         super(CompileElIfNot, self).compile(compiler)
         frame = compiler.control_stack.pop()
@@ -296,6 +555,8 @@ class CompileEndIf(Compilable):
         frame.main_path.join(frame.else_path)
 
         compiler.path = frame.main_path
+        if frame.ladder is not None:
+            compiler.exclusive_ladders.append(frame.ladder)
 
 ENDIF = CompileEndIf()
 
@@ -445,6 +706,7 @@ class IfElseControlFrame(object):
     * if_path:   the first conditional path to define
     * elif_path: optional, used by ELIF to keep the current conditional path
     * else_path: ELSE branch goes here
+    * ladder:    ExclusiveLadder of EXCLUSIVE_IF, None for other IFs
 
     ENDIF merges if_path, elif_path, else_path back to main_path,
     before restoring
@@ -456,6 +718,7 @@ class IfElseControlFrame(object):
         self.elif_path = None
         self.else_path = else_path
         self.else_used = False
+        self.ladder = None
 
 
 class Compiler(object):
@@ -467,6 +730,7 @@ class Compiler(object):
     labels_with_indices = []
     previous_labels = None
     linkers = None
+    exclusive_ladders = None
 
     @property
     def last_instruction(self):
@@ -479,6 +743,7 @@ class Compiler(object):
         self.labels_with_indices = []
         self.previous_labels = set()
         self.linkers = dict()
+        self.exclusive_ladders = []
 
     def compile(self, program_spec):
         for instruction in program_spec:
@@ -529,6 +794,63 @@ class Compiler(object):
         self.linkers.setdefault(label, []).append(linker)
 
 
+class SubProgram(object):
+
+    def __init__(self, label, instructions):
+        self.label = label
+        self.instructions = instructions
+
+    @property
+    def start_instruction(self):
+        return self.instructions[0]
+
+
+class PassManager(object):
+
+    '''
+    Runs transformation passes over compiled instructions.
+
+    Passes get the list of SubPrograms (the first one is the main program)
+    and modify them in place. The first instruction of a SubProgram must
+    remain its start instruction.
+
+    Instructions are re-numbered after the passes.
+    '''
+
+    def __init__(self, passes):
+        self.passes = passes
+
+    def run(self, instructions, labels_with_indices):
+        sub_programs = self.split(instructions, labels_with_indices)
+        for compiler_pass in self.passes:
+            compiler_pass.run(sub_programs)
+        return self.join(sub_programs)
+
+    def split(self, instructions, labels_with_indices):
+        boundaries = (
+            [(None, 0)] +
+            list(labels_with_indices) +
+            [(None, len(instructions))])
+        return [
+            SubProgram(label, instructions[index:next_index])
+            for ((label, index), (_, next_index))
+            in zip(boundaries, boundaries[1:])]
+
+    def join(self, sub_programs):
+        instructions = []
+        labels_with_indices = []
+        for sub_program in sub_programs:
+            if sub_program.label is not None:
+                labels_with_indices.append(
+                    (sub_program.label, len(instructions)))
+            instructions.extend(sub_program.instructions)
+
+        for (index, instruction) in enumerate(instructions):
+            instruction.index = index
+
+        return instructions, labels_with_indices
+
+
 class ProgramVisitor(object):
 
     def enter_subprogram(self, label, instructions):
@@ -555,23 +877,75 @@ class Program(object):
     instructions = None
     runner = None
 
-    def __init__(self, program_spec):
+    # passes rewrite the compiled instructions, see tarr.passes
+    passes = ()
+    # optimizers make an optimized copy of the instruction graph to run,
+    # see tarr.optimizer
+    optimizers = ()
+    entry_instruction = None
+    # tarr.profiling.Profile to order EXCLUSIVE_IF ladders by
+    profile = None
+    exclusive_ladders = ()
+
+    def __init__(self, program_spec, profile=None):
         self.labels_with_indices = None
+        if profile is not None:
+            self.profile = profile
         self.compile(program_spec)
 
     def run(self, state):
-        return self.runner.run(self.start_instruction, state)
+        self.runner.exit_status = None
+        return self.runner.run(self.entry_instruction, state)
+
+    def run_batch(self, states):
+        self.runner.exit_status = None
+        return self.runner.run_batch(self.entry_instruction, states)
+
+    def run_many(self, states, exceptions=()):
+        '''
+        Run the program on states one by one, yield (state, exit_status).
+
+        The exit status is reset before each item.
+        Items raising one of exceptions are yielded with exit status None,
+        other exceptions are not caught.
+        '''
+        runner = self.runner
+        run = runner.run
+        start_instruction = self.entry_instruction
+        for state in states:
+            runner.exit_status = None
+            try:
+                state = run(start_instruction, state)
+            except exceptions:
+                yield state, None
+            else:
+                yield state, runner.exit_status
 
     def compile(self, program_spec):
         compiler = Compiler()
         compiler.compile(program_spec)
-        self.init(compiler.instructions, compiler.labels_with_indices)
+        instructions = compiler.instructions
+        labels_with_indices = compiler.labels_with_indices
+        self.exclusive_ladders = compiler.exclusive_ladders
+        if self.passes:
+            instructions, labels_with_indices = PassManager(self.passes).run(
+                instructions, labels_with_indices)
+        self.init(instructions, labels_with_indices)
 
     def init(self, instructions, labels_with_indices):
         self.instructions = instructions
         self.labels_with_indices = labels_with_indices
+        self.entry_instruction = self.optimize(self.start_instruction)
         self.runner = self.make_runner()
 
+    def optimize(self, start_instruction):
+        if self.profile is not None and self.exclusive_ladders:
+            start_instruction = self.profile.reorder(
+                start_instruction, self.exclusive_ladders)
+        for optimizer in self.optimizers:
+            start_instruction = optimizer.optimize(start_instruction)
+        return start_instruction
+
     @property
     def start_instruction(self):
         return self.instructions[0]
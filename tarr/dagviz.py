@@ -1,9 +1,51 @@
-import sys
-from tarr.compiler import Program
+'''
+Print the graph of a TARR program in DOT format.
 
-name, = sys.argv[1:]
+    python -m tarr.dagviz module [--statistics FILE] [--cold-threshold N]
 
-module = __import__(name, fromlist=[True])
+module is the name of a Python module defining TARR_PROGRAM.
+With a statistics file - saved by Program.save_statistics, or by
+tarr.batch.main as <output>.statistics - the graph is a heat map of the
+program, subprograms below N percent of the total run time collapsed.
+'''
 
-program = Program(module.TARR_PROGRAM)
-print program.to_dot()
+import argparse
+from tarr.compiler import Program, load_statistics, merge_statistics
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description='Print the graph of a TARR program in DOT format')
+    parser.add_argument(
+        'module', help='name of the module defining TARR_PROGRAM')
+    parser.add_argument(
+        '--statistics', metavar='FILE',
+        help='statistics of the program to draw a heat map of')
+    parser.add_argument(
+        '--cold-threshold', metavar='PERCENT', type=float, default=None,
+        help=(
+            'collapse subprograms taking less than PERCENT of the total'
+            ' run time into a single node (needs --statistics)'))
+    return parser.parse_args(args)
+
+
+def to_dot(module_name, statistics_filename=None, cold_threshold=None):
+    module = __import__(module_name, fromlist=[True])
+    program = Program(module.TARR_PROGRAM)
+    if statistics_filename is None:
+        return program.to_dot()
+
+    merge_statistics(
+        program.statistics, load_statistics(statistics_filename))
+    if cold_threshold is not None:
+        cold_threshold = cold_threshold / 100.0
+    return program.to_heat_map_dot(cold_threshold)
+
+
+def main(args=None):
+    args = parse_args(args)
+    print to_dot(args.module, args.statistics, args.cold_threshold)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,3 +12,86 @@ class Data(object):
     def __init__(self, id, payload):
         self.id = id
         self.payload = payload
+
+
+class DataRow(object):
+
+    '''View of a row of a DataBatch with the interface of Data'''
+
+    __slots__ = ('batch', 'index')
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    @property
+    def id(self):
+        return self.batch.ids[self.index]
+
+    @property
+    def payload(self):
+        return self.batch.payloads[self.index]
+
+    @payload.setter
+    def payload(self, payload):
+        self.batch.payloads[self.index] = payload
+
+
+class DataBatch(object):
+
+    '''
+    A batch of data as columns of ids and payloads.
+
+    Rows are DataRow views - reading or setting their payload reads or
+    sets the column, so a batch passes from reader through the program
+    to the writer without Data objects. Every row still has its own
+    payload, as that is what the rules transform.
+
+    Iterating over the batch gives a new view for each row, scan() moves
+    a single view over the rows.
+    '''
+
+    def __init__(self, ids=None, payloads=None):
+        self.ids = [] if ids is None else ids
+        self.payloads = [] if payloads is None else payloads
+        assert len(self.ids) == len(self.payloads)
+
+    @classmethod
+    def from_data(cls, data_items):
+        batch = cls()
+        for data in data_items:
+            batch.append(data.id, data.payload)
+        return batch
+
+    def append(self, id, payload):
+        self.ids.append(id)
+        self.payloads.append(payload)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.ids)
+        if not 0 <= index < len(self.ids):
+            raise IndexError(index)
+        return DataRow(self, index)
+
+    def __setitem__(self, index, data):
+        '''Store data - e.g. a transformed row - as the index-th row'''
+        self.ids[index] = data.id
+        self.payloads[index] = data.payload
+
+    def __iter__(self):
+        for index in xrange(len(self.ids)):
+            yield DataRow(self, index)
+
+    def scan(self):
+        '''The same DataRow view positioned at each row in turn.
+
+        The view is only valid until the next row is requested.
+        '''
+        row = DataRow(self, 0)
+        for index in xrange(len(self.ids)):
+            row.index = index
+            yield row
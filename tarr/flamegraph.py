@@ -0,0 +1,145 @@
+'''
+Time spent by call stacks of subprograms.
+
+CALLs nest DEF subprograms, so every instruction runs in a call stack,
+like main;classify;normalize_address. CallStackRunner collects the usual
+statistics, and also the time spent in each call stack - without the
+time spent in the subprograms called from it.
+
+    program = tarr.flamegraph.Program(spec)
+    ... run it ...
+    text = program.to_folded()
+
+to_folded() is in the folded stack format of flamegraph.pl and speedscope
+(weights are nanoseconds), to_chrome_trace() is the trace event JSON of
+chrome://tracing and Perfetto for every trace_interval-th item.
+'''
+
+import collections
+import json
+
+from tarr import compiler
+from tarr.clock import now_ns
+
+
+# name of the main program in the stacks
+MAIN = 'main'
+
+
+def frame_name(label):
+    # ; separates the frames in the folded stack format
+    return label.replace(';', ':')
+
+
+class CallStackRunner(compiler.StatisticsCollectorRunner):
+
+    '''
+    Collects statistics, time spent by call stack, and trace events of
+    the CALLs of every trace_interval-th item, for at most
+    max_traced_items items.
+    '''
+
+    trace_interval = 100
+    max_traced_items = 1000
+
+    def __init__(
+            self, statistics, trace_interval=None, max_traced_items=None):
+        super(CallStackRunner, self).__init__(statistics)
+        if trace_interval is not None:
+            self.trace_interval = trace_interval
+        if max_traced_items is not None:
+            self.max_traced_items = max_traced_items
+        # call stack (tuple of frame names) -> nanoseconds
+        self.stack_times = collections.defaultdict(int)
+        self.stack = None
+        self.mark = None
+        self.item_number = 0
+        self.traced_items = 0
+        self.tracing = False
+        self.trace_events = []
+
+    def add_trace_event(self, phase, name, time_ns, **args):
+        event = dict(
+            name=name, ph=phase, ts=time_ns / 1e3, pid=1, tid=1)
+        if args:
+            event['args'] = args
+        self.trace_events.append(event)
+
+    def account(self):
+        '''Add the time since the last mark to the current stack'''
+        now = now_ns()
+        self.stack_times[self.stack] += now - self.mark
+        self.mark = now
+        return now
+
+    def run(self, start_instruction, state):
+        if self.stack is not None:
+            # nested run, e.g. by Call.run
+            return super(CallStackRunner, self).run(start_instruction, state)
+
+        self.tracing = (
+            self.item_number % self.trace_interval == 0 and
+            self.traced_items < self.max_traced_items)
+        self.stack = (MAIN,)
+        self.mark = now_ns()
+        if self.tracing:
+            self.traced_items += 1
+            self.add_trace_event(
+                'B', MAIN, self.mark, item_number=self.item_number)
+        self.item_number += 1
+        try:
+            return super(CallStackRunner, self).run(start_instruction, state)
+        finally:
+            now = self.account()
+            if self.tracing:
+                # frames left open by an exception are closed as well
+                for name in reversed(self.stack):
+                    self.add_trace_event('E', name, now)
+            self.stack = None
+
+    def enter_call(self, i_call):
+        before = super(CallStackRunner, self).enter_call(i_call)
+        now = self.account()
+        name = frame_name(i_call.label)
+        self.stack += (name,)
+        if self.tracing:
+            self.add_trace_event('B', name, now)
+        return before
+
+    def leave_call(self, i_call, before):
+        now = self.account()
+        if self.tracing:
+            self.add_trace_event('E', self.stack[-1], now)
+        self.stack = self.stack[:-1]
+        super(CallStackRunner, self).leave_call(i_call, before)
+
+
+def to_folded(stack_times):
+    '''Lines of "frame;frame;... nanoseconds", sorted by stack'''
+    return ''.join(
+        '{} {}\n'.format(';'.join(stack), time)
+        for (stack, time) in sorted(stack_times.iteritems()))
+
+
+def to_chrome_trace(trace_events):
+    return json.dumps(
+        dict(traceEvents=trace_events, displayTimeUnit='ns'),
+        sort_keys=True)
+
+
+class Program(compiler.Program):
+
+    trace_interval = CallStackRunner.trace_interval
+    max_traced_items = CallStackRunner.max_traced_items
+
+    def make_runner(self):
+        return CallStackRunner(
+            compiler.make_statistics(len(self.instructions)),
+            trace_interval=self.trace_interval,
+            max_traced_items=self.max_traced_items)
+
+    def to_folded(self):
+        return to_folded(self.runner.stack_times)
+
+    def to_chrome_trace(self):
+        return to_chrome_trace(self.runner.trace_events)
@@ -0,0 +1,183 @@
+'''
+Table driven execution of compiled programs.
+
+The linked instruction graph is lowered into parallel tables indexed by
+slot number (opcode, operand, successor on yes/no) which are executed by
+a single loop - without calling Runner.run_instruction() and
+Instruction.next_instruction() for every step.
+
+Instructions without a dedicated opcode are run through their own
+.run() method, so any program runnable by compiler_base.Runner is
+runnable by FlatRunner as well.
+'''
+
+from tarr import compiler_base
+from tarr.optimizer import InlinedReturn, Dispatch, successors
+from tarr.compiler import (
+    TarrRuleInstruction, TarrBranchInstruction, TarrBranchRuleInstruction,
+    HAVE_NOT_DONE_IT)
+
+
+# opcodes
+RULE = 0
+BRANCH = 1
+BRANCH_RULE = 2
+CALL = 3
+RETURN = 4
+INSTRUCTION = 5
+BRANCHING_INSTRUCTION = 6
+INLINED_RETURN = 7
+DISPATCH = 8
+
+# successor of instructions ending a (sub)program
+NO_SLOT = -1
+
+
+OPCODE_BY_CLASS = {
+    TarrRuleInstruction: RULE,
+    TarrBranchInstruction: BRANCH,
+    TarrBranchRuleInstruction: BRANCH_RULE,
+    compiler_base.Call: CALL,
+    compiler_base.Return: RETURN,
+    InlinedReturn: INLINED_RETURN,
+}
+
+
+def opcode(instruction):
+    # exact class match: subclasses might override run()
+    try:
+        return OPCODE_BY_CLASS[instruction.__class__]
+    except KeyError:
+        if isinstance(instruction, Dispatch):
+            # all dispatches are run through key() and lookup()
+            return DISPATCH
+        if isinstance(instruction, compiler_base.BranchingInstruction):
+            return BRANCHING_INSTRUCTION
+        return INSTRUCTION
+
+
+def slot(instruction, slots):
+    if instruction is None:
+        return NO_SLOT
+    return slots[instruction]
+
+
+def operand(instruction, opcode, slots):
+    if opcode in (RULE, BRANCH, BRANCH_RULE):
+        return instruction.func
+    if opcode == CALL:
+        return slots[instruction.start_instruction]
+    if opcode in (RETURN, INLINED_RETURN):
+        return instruction.return_value
+    if opcode == DISPATCH:
+        return (
+            instruction.key, instruction.lookup,
+            [slot(target, slots) for target in instruction.targets])
+    return instruction
+
+
+class FlatRunner(compiler_base.Runner):
+
+    instructions = None
+    slots = None
+    opcodes = None
+    operands = None
+    on_yes = None
+    on_no = None
+
+    def __init__(self, start_instruction):
+        self.lower(start_instruction)
+
+    def lower(self, start_instruction):
+        # assign slots in depth first order of reachability
+        self.instructions = []
+        self.slots = dict()
+        pending = [start_instruction]
+        while pending:
+            instruction = pending.pop()
+            if instruction is None or instruction in self.slots:
+                continue
+            self.slots[instruction] = len(self.instructions)
+            self.instructions.append(instruction)
+            pending.extend(reversed(successors(instruction)))
+            if isinstance(instruction, compiler_base.Call):
+                pending.append(instruction.start_instruction)
+
+        self.opcodes = [opcode(i) for i in self.instructions]
+        self.operands = [
+            operand(i, op, self.slots)
+            for (i, op) in zip(self.instructions, self.opcodes)]
+        self.on_yes = [
+            slot(i.next_instruction(exit_status=True), self.slots)
+            for i in self.instructions]
+        self.on_no = [
+            slot(i.next_instruction(exit_status=False), self.slots)
+            for i in self.instructions]
+
+    def run(self, start_instruction, state):
+        opcodes = self.opcodes
+        operands = self.operands
+        on_yes = self.on_yes
+        on_no = self.on_no
+        max_call_depth = self.max_call_depth
+        call_stack = []
+        exit_status = self.exit_status
+
+        pc = self.slots[start_instruction]
+        while True:
+            op = opcodes[pc]
+            if op == RULE:
+                state.payload = operands[pc](state.payload)
+                pc = on_yes[pc]
+            elif op == BRANCH:
+                exit_status = operands[pc](state.payload)
+                pc = on_yes[pc] if exit_status else on_no[pc]
+            elif op == BRANCH_RULE:
+                output = operands[pc](state.payload)
+                exit_status = output is not HAVE_NOT_DONE_IT
+                if exit_status:
+                    state.payload = output
+                    pc = on_yes[pc]
+                else:
+                    pc = on_no[pc]
+            elif op == CALL:
+                if len(call_stack) >= max_call_depth:
+                    raise compiler_base.CallDepthExceededError(
+                        self.instructions[pc].label)
+                call_stack.append(pc)
+                pc = operands[pc]
+            elif op == RETURN:
+                if operands[pc] is not None:
+                    exit_status = operands[pc]
+                pc = NO_SLOT
+            elif op == INLINED_RETURN:
+                if operands[pc] is not None:
+                    exit_status = operands[pc]
+                pc = on_yes[pc] if exit_status else on_no[pc]
+            elif op == DISPATCH:
+                key, lookup, targets = operands[pc]
+                exit_status = lookup(key(state))
+                pc = targets[exit_status]
+            else:
+                self.exit_status = exit_status
+                state = operands[pc].run(self, state)
+                exit_status = self.exit_status
+                if op == BRANCHING_INSTRUCTION and not exit_status:
+                    pc = on_no[pc]
+                else:
+                    pc = on_yes[pc]
+
+            if pc == NO_SLOT:
+                if not call_stack:
+                    break
+                pc = call_stack.pop()
+                pc = on_yes[pc] if exit_status else on_no[pc]
+
+        self.exit_status = exit_status
+        return state
+
+
+class Program(compiler_base.Program):
+
+    def make_runner(self):
+        return FlatRunner(self.entry_instruction)
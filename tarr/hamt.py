@@ -0,0 +1,278 @@
+'''
+Persistent (immutable) hash map - a hash array mapped trie.
+
+Updates return a new map sharing all but O(log n) nodes with the old
+one, lookups walk at most HASH_BITS / BITS levels of 32 way nodes:
+
+>>> m1 = PersistentMap().set('a', 1)
+>>> m2 = m1.set('b', 2).remove('a')
+>>> sorted(m1.items()), sorted(m2.items())
+([('a', 1)], [('b', 2)])
+
+All operations are iterative or recursive only to the fixed trie depth.
+'''
+
+BITS = 5
+MASK = (1 << BITS) - 1
+HASH_BITS = 32
+HASH_MASK = (1 << HASH_BITS) - 1
+
+
+def bit_count(value):
+    return bin(value).count('1')
+
+
+class BitmapNode(object):
+
+    '''
+    Up to 32 entries at one level of the trie.
+
+    An entry is either a (hash, key, value) leaf or a child node,
+    entries are present for the set bits of bitmap, in bit order.
+    '''
+
+    __slots__ = ('bitmap', 'entries')
+
+    def __init__(self, bitmap, entries):
+        self.bitmap = bitmap
+        self.entries = entries
+
+
+class CollisionNode(object):
+
+    '''Leaves of keys with the same full hash'''
+
+    __slots__ = ('hash', 'entries')
+
+    def __init__(self, hash, entries):
+        self.hash = hash
+        self.entries = entries
+
+
+EMPTY_NODE = BitmapNode(0, ())
+
+
+def key_hash(key):
+    return hash(key) & HASH_MASK
+
+
+def make_node(shift, leaf1, leaf2):
+    '''Node holding two leaves with different keys'''
+    if leaf1[0] == leaf2[0] or shift >= HASH_BITS:
+        return CollisionNode(leaf1[0], (leaf1, leaf2))
+    position1 = (leaf1[0] >> shift) & MASK
+    position2 = (leaf2[0] >> shift) & MASK
+    if position1 == position2:
+        return BitmapNode(
+            1 << position1, (make_node(shift + BITS, leaf1, leaf2),))
+    if position1 > position2:
+        leaf1, leaf2 = leaf2, leaf1
+    return BitmapNode((1 << position1) | (1 << position2), (leaf1, leaf2))
+
+
+def node_set(node, shift, leaf):
+    '''(new node, whether the key is new)'''
+    h, key, value = leaf
+    if isinstance(node, CollisionNode):
+        if h != node.hash:
+            # split: the colliding keys go one level deeper
+            return node_set(
+                BitmapNode(1 << ((node.hash >> shift) & MASK), (node,)),
+                shift, leaf)
+        for (i, entry) in enumerate(node.entries):
+            if entry[1] == key:
+                if entry[2] is value:
+                    return node, False
+                entries = node.entries[:i] + (leaf,) + node.entries[i + 1:]
+                return CollisionNode(h, entries), False
+        return CollisionNode(h, node.entries + (leaf,)), True
+
+    bit = 1 << ((h >> shift) & MASK)
+    position = bit_count(node.bitmap & (bit - 1))
+    entries = node.entries
+    if not node.bitmap & bit:
+        return (
+            BitmapNode(
+                node.bitmap | bit,
+                entries[:position] + (leaf,) + entries[position:]),
+            True)
+
+    entry = entries[position]
+    if isinstance(entry, tuple):
+        if entry[1] == key:
+            if entry[2] is value:
+                return node, False
+            new_entry, is_new = leaf, False
+        else:
+            new_entry, is_new = make_node(shift + BITS, entry, leaf), True
+    else:
+        new_entry, is_new = node_set(entry, shift + BITS, leaf)
+        if new_entry is entry:
+            return node, False
+    return (
+        BitmapNode(
+            node.bitmap,
+            entries[:position] + (new_entry,) + entries[position + 1:]),
+        is_new)
+
+
+def node_remove(node, shift, h, key):
+    '''New node without key - node itself if key is not in it, None if
+    it would be empty'''
+    if isinstance(node, CollisionNode):
+        entries = tuple(entry for entry in node.entries if entry[1] != key)
+        if len(entries) == len(node.entries):
+            return node
+        if len(entries) == 1:
+            return entries[0]
+        return CollisionNode(node.hash, entries)
+
+    bit = 1 << ((h >> shift) & MASK)
+    if not node.bitmap & bit:
+        return node
+    position = bit_count(node.bitmap & (bit - 1))
+    entries = node.entries
+    entry = entries[position]
+    if isinstance(entry, tuple):
+        if entry[1] != key:
+            return node
+        new_entry = None
+    else:
+        new_entry = node_remove(entry, shift + BITS, h, key)
+        if new_entry is entry:
+            return node
+
+    if new_entry is None:
+        if node.bitmap == bit:
+            return None
+        entries = entries[:position] + entries[position + 1:]
+        if len(entries) == 1 and isinstance(entries[0], tuple):
+            # a single leaf is pulled up to the parent
+            return entries[0]
+        return BitmapNode(node.bitmap & ~bit, entries)
+    return BitmapNode(
+        node.bitmap,
+        entries[:position] + (new_entry,) + entries[position + 1:])
+
+
+class PersistentMap(object):
+
+    __slots__ = ('root', 'count')
+
+    def __init__(self, items=()):
+        self.root = EMPTY_NODE
+        self.count = 0
+        for (key, value) in items:
+            self.root, is_new = node_set(
+                self.root, 0, (key_hash(key), key, value))
+            self.count += is_new
+
+    @classmethod
+    def from_root(cls, root, count):
+        new_map = cls.__new__(cls)
+        new_map.root = root
+        new_map.count = count
+        return new_map
+
+    def __len__(self):
+        return self.count
+
+    # pickled as items, the trie depends on the hashes of the process
+
+    def __getstate__(self):
+        return dict(items=self.items())
+
+    def __setstate__(self, state):
+        new_map = PersistentMap(state['items'])
+        self.root = new_map.root
+        self.count = new_map.count
+
+    def __getitem__(self, key):
+        h = key_hash(key)
+        node = self.root
+        shift = 0
+        while True:
+            if isinstance(node, CollisionNode):
+                for entry in node.entries:
+                    if entry[1] == key:
+                        return entry[2]
+                raise KeyError(key)
+            bit = 1 << ((h >> shift) & MASK)
+            if not node.bitmap & bit:
+                raise KeyError(key)
+            node = node.entries[bit_count(node.bitmap & (bit - 1))]
+            if isinstance(node, tuple):
+                if node[1] == key:
+                    return node[2]
+                raise KeyError(key)
+            shift += BITS
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def set(self, key, value):
+        '''New map with key set to value'''
+        root, is_new = node_set(self.root, 0, (key_hash(key), key, value))
+        if root is self.root:
+            return self
+        return self.from_root(root, self.count + is_new)
+
+    def update(self, items):
+        '''New map with all the (key, value) items set'''
+        root = self.root
+        count = self.count
+        for (key, value) in items:
+            root, is_new = node_set(root, 0, (key_hash(key), key, value))
+            count += is_new
+        if root is self.root:
+            return self
+        return self.from_root(root, count)
+
+    def remove(self, key):
+        '''New map without key, the map itself if key is not in it'''
+        root = node_remove(self.root, 0, key_hash(key), key)
+        if root is self.root:
+            return self
+        if root is None:
+            root = EMPTY_NODE
+        elif isinstance(root, tuple):
+            root = BitmapNode(1 << (root[0] & MASK), (root,))
+        return self.from_root(root, self.count - 1)
+
+    def iterleaves(self):
+        stack = [iter(self.root.entries)]
+        while stack:
+            for entry in stack[-1]:
+                if isinstance(entry, tuple):
+                    yield entry
+                else:
+                    stack.append(iter(entry.entries))
+                    break
+            else:
+                stack.pop()
+
+    def __iter__(self):
+        for leaf in self.iterleaves():
+            yield leaf[1]
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [leaf[2] for leaf in self.iterleaves()]
+
+    def items(self):
+        return [(leaf[1], leaf[2]) for leaf in self.iterleaves()]
+
+
+EMPTY = PersistentMap()
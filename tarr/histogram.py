@@ -0,0 +1,138 @@
+'''
+Log bucketed latency histograms.
+
+Durations in nanoseconds are counted in buckets, whose width grows with
+the duration: every power of two range is split into SUB_BUCKETS
+buckets, so a bucket is at most 1/SUB_BUCKETS (12.5%) wide relative to
+its values. Durations below 2 * SUB_BUCKETS ns have their own buckets.
+
+Memory is constant: MAX_BITS limits the range to about 78 hours, longer
+durations are counted in the last bucket. The maximum is kept exactly.
+'''
+
+SUB_BUCKET_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_BITS = 48
+BUCKET_COUNT = (MAX_BITS - SUB_BUCKET_BITS + 1) * SUB_BUCKETS
+
+PERCENTILES = (50, 90, 99)
+
+
+def bucket_index(value):
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    if shift <= 0:
+        return value
+    index = (shift << SUB_BUCKET_BITS) + (value >> shift)
+    return min(index, BUCKET_COUNT - 1)
+
+
+def bucket_bounds(index):
+    '''The smallest and largest value counted in bucket index'''
+    if index < 2 * SUB_BUCKETS:
+        return index, index
+    shift = (index >> SUB_BUCKET_BITS) - 1
+    mantissa = index - (shift << SUB_BUCKET_BITS)
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+def format_duration(ns):
+    if ns < 1000:
+        return '{}ns'.format(int(ns))
+    if ns < 1000000:
+        return '{:.1f}us'.format(ns / 1e3)
+    if ns < 1000000000:
+        return '{:.1f}ms'.format(ns / 1e6)
+    return '{:.2f}s'.format(ns / 1e9)
+
+
+class LatencyHistogram(object):
+
+    '''
+    Counts of durations by bucket.
+
+    Bucket counts are allocated on the first recorded duration.
+    '''
+
+    counts = None
+    count = 0
+    max = 0
+
+    def record(self, value):
+        counts = self.counts
+        if counts is None:
+            counts = self.counts = [0] * BUCKET_COUNT
+        if value < 0:
+            # clock went backwards
+            value = 0
+        # bucket_index inlined, this is run for every timed instruction
+        shift = value.bit_length() - SUB_BUCKET_BITS - 1
+        if shift <= 0:
+            index = value
+        else:
+            index = min(
+                (shift << SUB_BUCKET_BITS) + (value >> shift),
+                BUCKET_COUNT - 1)
+        counts[index] += 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if not other.count:
+            return
+        if self.counts is None:
+            self.counts = [0] * BUCKET_COUNT
+        for (index, count) in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def pack(self):
+        '''Compact, picklable form: (count, max, ((index, count), ...))'''
+        if not self.count:
+            return (0, 0, ())
+        return (
+            self.count, self.max,
+            tuple(
+                (index, count)
+                for (index, count) in enumerate(self.counts) if count))
+
+    @classmethod
+    def unpack(cls, packed):
+        count, max_, bucket_counts = packed
+        histogram = cls()
+        if count:
+            histogram.counts = [0] * BUCKET_COUNT
+            for (index, bucket_count) in bucket_counts:
+                histogram.counts[index] = bucket_count
+            histogram.count = count
+            histogram.max = max_
+        return histogram
+
+    def percentile(self, percent):
+        '''
+        Upper estimate of the duration percent of the recorded durations
+        do not exceed, None if there is nothing recorded
+        '''
+        if not self.count:
+            return None
+        # rank of the value, rounded up
+        rank = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for (index, count) in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bucket_bounds(index)[1], self.max)
+        return self.max
+
+    def summary(self):
+        '''p50=... p90=... p99=... max=... text, None if empty'''
+        if not self.count:
+            return None
+        return ' '.join(
+            [
+                'p{}={}'.format(percent, format_duration(
+                    self.percentile(percent)))
+                for percent in PERCENTILES] +
+            ['max={}'.format(format_duration(self.max))])
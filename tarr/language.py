@@ -2,10 +2,10 @@ from tarr.compiler import (
     RETURN_TRUE, RETURN_FALSE,
     DEF,
     IF, ELIF, ELSE, ENDIF,
-    IF_NOT, ELIF_NOT)
+    IF_NOT, ELIF_NOT, EXCLUSIVE_IF)
 
 __all__ = (
     RETURN_TRUE, RETURN_FALSE,
     DEF,
     IF, ELIF, ELSE, ENDIF,
-    IF_NOT, ELIF_NOT)
+    IF_NOT, ELIF_NOT, EXCLUSIVE_IF)
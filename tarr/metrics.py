@@ -0,0 +1,319 @@
+'''
+Live metrics of long batch runs.
+
+Workers run a ProgressMonitor: a background thread sending the item count
+and a snapshot of the statistics of the file being processed every few
+seconds to a queue - the processing itself is not slowed down by checks
+or locks.
+
+In the main process MetricsReporter collects the Progress messages from
+the queue and periodically writes
+
+- throughput: items/sec in total and per worker
+- per file progress
+- the top instructions by cumulative run time
+
+into <prefix>.metrics.json and <prefix>.metrics.prom (Prometheus text
+exposition format). The files are replaced atomically.
+'''
+
+import collections
+import json
+import os
+import Queue
+import threading
+import time
+
+from tarr.compiler import StatisticsStore
+
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+
+
+class Progress(object):
+
+    '''Message from a worker about the file it processes'''
+
+    def __init__(self, worker, filename, item_count, statistics, done):
+        self.worker = worker
+        self.filename = filename
+        self.item_count = item_count
+        # StatisticsStore or None
+        self.statistics = statistics
+        self.done = done
+
+
+class ProgressMonitor(object):
+
+    '''
+    Sends Progress of batch processing filename to queue every interval
+    seconds from a background thread, and once more when stopped.
+
+    The item count of batch is read by the thread, it is not
+    synchronized with the processing at all.
+    '''
+
+    def __init__(self, queue, batch, filename, interval):
+        self.queue = queue
+        self.batch = batch
+        self.filename = filename
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def send(self, done=False):
+        self.queue.put(
+            Progress(
+                os.getpid(), self.filename, self.batch.processed_count,
+                self.batch.get_statistics(), done))
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.send()
+
+    def start(self):
+        self.send()
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.send(done=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class FileProgress(object):
+
+    state = PENDING
+    worker = None
+    item_count = 0
+    start_time = None
+    end_time = None
+    statistics = None
+
+
+class MetricsReporter(object):
+
+    '''
+    Collects Progress messages from queue and writes snapshots of the
+    metrics of the run every interval seconds, see snapshot().
+
+    instruction_names are the names of the instructions of the program
+    by index, for the top instructions.
+    '''
+
+    # time source, replaceable for tests
+    clock = staticmethod(time.time)
+
+    def __init__(
+            self, queue, filename_prefix, input_filenames,
+            instruction_names=(), interval=10.0, top=10):
+        self.queue = queue
+        self.filename_prefix = filename_prefix
+        self.instruction_names = list(instruction_names)
+        self.interval = interval
+        self.top = top
+        self.files = collections.OrderedDict(
+            (filename, FileProgress()) for filename in input_filenames)
+        self.start_time = self.clock()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def update(self, progress):
+        file_progress = self.files.setdefault(
+            progress.filename, FileProgress())
+        if file_progress.start_time is None:
+            file_progress.start_time = self.clock()
+        file_progress.state = DONE if progress.done else RUNNING
+        file_progress.worker = progress.worker
+        file_progress.item_count = progress.item_count
+        file_progress.statistics = progress.statistics
+        if progress.done:
+            file_progress.end_time = self.clock()
+
+    def top_instructions(self):
+        statistics = None
+        for file_progress in self.files.itervalues():
+            if file_progress.statistics is None:
+                continue
+            if statistics is None:
+                statistics = StatisticsStore(len(file_progress.statistics))
+            statistics.merge(file_progress.statistics)
+        if statistics is None:
+            return []
+
+        timed = [stat for stat in statistics if stat.timed_count]
+        timed.sort(key=lambda stat: -stat.estimated_run_time)
+        return [
+            dict(
+                index=stat.index,
+                name=self.instruction_name(stat.index),
+                item_count=stat.item_count,
+                run_time_seconds=stat.estimated_run_time / 1e9)
+            for stat in timed[:self.top]]
+
+    def instruction_name(self, index):
+        if index < len(self.instruction_names):
+            return self.instruction_names[index]
+        return str(index)
+
+    def snapshot(self):
+        now = self.clock()
+        elapsed = now - self.start_time
+        item_count = sum(f.item_count for f in self.files.itervalues())
+
+        workers = []
+        for (filename, f) in self.files.iteritems():
+            if f.state == RUNNING:
+                workers.append(
+                    dict(
+                        worker=f.worker,
+                        filename=filename,
+                        item_count=f.item_count,
+                        items_per_second=rate(
+                            f.item_count, now - f.start_time)))
+
+        files = [
+            dict(
+                filename=filename,
+                state=f.state,
+                item_count=f.item_count,
+                elapsed_seconds=(
+                    None if f.start_time is None
+                    else (f.end_time or now) - f.start_time))
+            for (filename, f) in self.files.iteritems()]
+
+        return dict(
+            time=now,
+            elapsed_seconds=elapsed,
+            item_count=item_count,
+            items_per_second=rate(item_count, elapsed),
+            file_counts=dict(
+                (state, sum(1 for f in self.files.itervalues()
+                            if f.state == state))
+                for state in (PENDING, RUNNING, DONE)),
+            workers=workers,
+            files=files,
+            top_instructions=self.top_instructions())
+
+    def write(self):
+        snapshot = self.snapshot()
+        write_atomically(
+            self.filename_prefix + '.metrics.json',
+            json.dumps(snapshot, indent=1, sort_keys=True))
+        write_atomically(
+            self.filename_prefix + '.metrics.prom',
+            to_prometheus(snapshot))
+
+    def run(self):
+        next_write = self.clock()
+        while True:
+            if self.clock() >= next_write:
+                self.write()
+                next_write = self.clock() + self.interval
+            try:
+                progress = self.queue.get(
+                    timeout=max(0, next_write - self.clock()))
+            except Queue.Empty:
+                continue
+            if progress is None:
+                break
+            self.update(progress)
+        self.write()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        '''Process the pending messages, write the final metrics'''
+        self.queue.put(None)
+        self.thread.join()
+
+
+def rate(count, seconds):
+    if seconds <= 0:
+        return 0.0
+    return count / float(seconds)
+
+
+def write_atomically(filename, text):
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'w') as f:
+        f.write(text)
+    os.rename(temp_filename, filename)
+
+
+# Prometheus text exposition format
+
+def escape_label_value(value):
+    return (
+        unicode(value)
+        .replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+
+
+def format_sample(name, value, labels=()):
+    if labels:
+        name = '{}{{{}}}'.format(
+            name,
+            ','.join(
+                '{}="{}"'.format(label, escape_label_value(label_value))
+                for (label, label_value) in labels))
+    return '{} {}'.format(name, repr(float(value)))
+
+
+def to_prometheus(snapshot):
+    lines = []
+
+    def metric(name, metric_type, help, samples):
+        lines.append('# HELP {} {}'.format(name, help))
+        lines.append('# TYPE {} {}'.format(name, metric_type))
+        for (labels, value) in samples:
+            lines.append(format_sample(name, value, labels))
+
+    metric(
+        'tarr_items_processed_total', 'counter', 'Items processed.',
+        [((), snapshot['item_count'])])
+    metric(
+        'tarr_items_per_second', 'gauge',
+        'Items processed per second since the start.',
+        [((), snapshot['items_per_second'])])
+    metric(
+        'tarr_worker_items_per_second', 'gauge',
+        'Items processed per second by workers on their current file.',
+        [
+            (
+                (('worker', w['worker']), ('filename', w['filename'])),
+                w['items_per_second'])
+            for w in snapshot['workers']])
+    metric(
+        'tarr_files', 'gauge', 'Number of input files by state.',
+        [
+            ((('state', state),), count)
+            for (state, count) in sorted(snapshot['file_counts'].items())])
+    metric(
+        'tarr_file_items_processed', 'gauge', 'Items processed by file.',
+        [
+            (
+                (('filename', f['filename']), ('state', f['state'])),
+                f['item_count'])
+            for f in snapshot['files']])
+    metric(
+        'tarr_instruction_run_time_seconds', 'gauge',
+        'Estimated cumulative run time of the top instructions.',
+        [
+            (
+                (('index', i['index']), ('name', i['name'])),
+                i['run_time_seconds'])
+            for i in snapshot['top_instructions']])
+    return '\n'.join(lines) + '\n'
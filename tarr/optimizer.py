@@ -0,0 +1,504 @@
+'''
+Optimizers transforming the executed instruction graph of a Program.
+
+An optimizer works on a copy of the compiled instructions: the copy is
+run, while Program.instructions keeps the compiled structure for
+sub_programs() and the visitors (to_text, to_dot).
+
+Every copied instruction keeps the index of the instruction it was
+copied from, so statistics collected while running the copy are
+reported on the original instructions:
+
+    program.instructions[copied_instruction.index]
+
+is the source of any instruction in the optimized graph.
+'''
+
+import re
+import sre_constants
+import sre_parse
+
+from tarr.compiler_base import (
+    Instruction, BranchingInstruction, Call, Return,
+    FieldEquals, FieldSearch, FieldInBucket)
+
+
+class InlinedReturn(BranchingInstruction):
+
+    '''
+    RETURN of an inlined subprogram.
+
+    Sets the exit status like RETURN, then continues on the true or false
+    path of the inlined CALL.
+    '''
+
+    return_value = None
+
+    def __init__(self, return_value=True):
+        self.return_value = return_value
+
+    def run(self, runner, state):
+        if self.return_value is not None:
+            runner.set_exit_status(self.return_value)
+
+        return state
+
+    def clone(self):
+        return self.__class__(self.return_value)
+
+    @property
+    def instruction_name(self):
+        return 'RETURN {0}'.format(self.return_value)
+
+
+class Dispatch(BranchingInstruction):
+
+    '''
+    Multiway branch replacing an ELIF chain of branches testing the same
+    key.
+
+    The exit status is the position of the first matching arm counted
+    from 1, or 0 if no arm matched - next_instruction() selects the target
+    by it.
+
+    Subclasses define arm_class and a faster lookup().
+    '''
+
+    # the class of the replaced branches
+    arm_class = None
+
+    def __init__(self, arms):
+        self.arms = list(arms)
+        self.indices = [arm.index for arm in self.arms]
+        self.key = self.arms[0].key
+        self.targets = [None] * (len(self.arms) + 1)
+
+    @classmethod
+    def can_join(cls, arms, instruction):
+        '''Can instruction be the next arm after arms?'''
+        return (
+            isinstance(instruction, cls.arm_class) and
+            (not arms or (
+                instruction.__class__ is arms[0].__class__ and
+                instruction.field == arms[0].field)))
+
+    def lookup(self, key):
+        '''Position of the first arm matching key'''
+        for (position, arm) in enumerate(self.arms, 1):
+            if arm.matches(key):
+                return position
+        return 0
+
+    def run(self, runner, state):
+        runner.set_exit_status(self.lookup(self.key(state)))
+        return state
+
+    def next_instruction(self, exit_status):
+        return self.targets[exit_status]
+
+    def chain_targets(self):
+        '''Targets of the replaced chain, in the order of self.targets'''
+        return (
+            [self.arms[-1].instruction_on_no] +
+            [arm.instruction_on_yes for arm in self.arms])
+
+    def count(self, statistics, position):
+        '''Update statistics of the arms as if the chain was run'''
+        item_count = statistics.item_count
+        for (arm_position, index) in enumerate(self.indices, 1):
+            item_count[index] += 1
+            if arm_position == position:
+                statistics.success_count[index] += 1
+                return
+            statistics.failure_count[index] += 1
+
+    def clone(self):
+        return self.__class__(self.arms)
+
+    @property
+    def instruction_name(self):
+        return 'DISPATCH {0}'.format(self.arms[0].field)
+
+
+class EqualityDispatch(Dispatch):
+
+    '''Replaces FieldEquals arms with a dict lookup'''
+
+    arm_class = FieldEquals
+
+    def __init__(self, arms):
+        super(EqualityDispatch, self).__init__(arms)
+        self.table = dict()
+        for (position, arm) in enumerate(self.arms, 1):
+            # the first matching arm wins
+            self.table.setdefault(arm.value, position)
+
+    @classmethod
+    def can_join(cls, arms, instruction):
+        if not super(EqualityDispatch, cls).can_join(arms, instruction):
+            return False
+        try:
+            hash(instruction.value)
+        except TypeError:
+            return False
+        return True
+
+    def lookup(self, key):
+        try:
+            return self.table.get(key, 0)
+        except TypeError:
+            # unhashable key, compare like the chain would
+            return super(EqualityDispatch, self).lookup(key)
+
+
+def has_group_reference(pattern, flags):
+    pending = [sre_parse.parse(pattern, flags)]
+    while pending:
+        item = pending.pop()
+        if isinstance(item, (sre_parse.SubPattern, list, tuple)):
+            if item and item[0] in (
+                    sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS):
+                return True
+            pending.extend(item)
+    return False
+
+
+class RegexDispatch(Dispatch):
+
+    r'''
+    Replaces FieldSearch arms with a single combined regular expression.
+
+    Every arm becomes a lookahead alternative at the start of the text
+
+        \A(?:(?P<tarr_arm1>(?=[\s\S]*?(?:pattern1)))|(?P<tarr_arm2>(?=...))...)
+
+    the alternatives are tried in the order of the arms, so the first
+    arm matching anywhere in the text wins, as in the chain.
+    It is a single re call, but each failing lookahead scans the text
+    again, so the cost is still up to one scan per arm.
+
+    Arms with back references are not joined, as the group numbers change
+    in the combined pattern, nor are arms with different or VERBOSE flags,
+    or arms reusing a group name of another arm or the tarr_arm prefix.
+    '''
+
+    arm_class = FieldSearch
+
+    # limit of the re module on the number of groups in a pattern
+    MAX_GROUPS = 99
+
+    def __init__(self, arms):
+        super(RegexDispatch, self).__init__(arms)
+        self.positions = dict()
+        alternatives = []
+        for (position, arm) in enumerate(self.arms, 1):
+            group = 'tarr_arm{0}'.format(position)
+            self.positions[group] = position
+            alternatives.append(
+                r'(?P<{0}>(?=[\s\S]*?(?:{1})))'.format(group, arm.pattern))
+        self.regex = re.compile(
+            r'\A(?:{0})'.format('|'.join(alternatives)),
+            self.arms[0].regex.flags)
+
+    @classmethod
+    def can_join(cls, arms, instruction):
+        if not super(RegexDispatch, cls).can_join(arms, instruction):
+            return False
+        flags = instruction.regex.flags
+        if flags & re.VERBOSE or arms and flags != arms[0].regex.flags:
+            return False
+        groups = sum(1 + arm.regex.groups for arm in arms)
+        return (
+            groups + 1 + instruction.regex.groups <= cls.MAX_GROUPS and
+            not has_group_reference(instruction.pattern, instruction.flags) and
+            not cls.has_group_name_collision(arms, instruction))
+
+    @staticmethod
+    def has_group_name_collision(arms, instruction):
+        names = set(instruction.regex.groupindex)
+        if any(name.startswith('tarr_arm') for name in names):
+            return True
+        return any(names.intersection(arm.regex.groupindex) for arm in arms)
+
+    def lookup(self, key):
+        match = self.regex.match(key)
+        if match is None:
+            return 0
+        return self.positions[match.lastgroup]
+
+
+class BucketDispatch(Dispatch):
+
+    '''Replaces FieldInBucket arms with a single bisect'''
+
+    arm_class = FieldInBucket
+
+    def __init__(self, arms):
+        super(BucketDispatch, self).__init__(arms)
+        self.bucket_of = self.arms[0].bucket_of
+        self.table = dict()
+        for (position, arm) in enumerate(self.arms, 1):
+            self.table.setdefault(arm.bucket, position)
+
+    @classmethod
+    def can_join(cls, arms, instruction):
+        return (
+            super(BucketDispatch, cls).can_join(arms, instruction) and
+            (not arms or instruction.thresholds == arms[0].thresholds))
+
+    def lookup(self, key):
+        return self.table.get(self.bucket_of(key), 0)
+
+
+DISPATCH_CLASSES = (EqualityDispatch, RegexDispatch, BucketDispatch)
+
+
+def successors(instruction):
+    if isinstance(instruction, Dispatch):
+        return [i for i in instruction.targets if i is not None]
+    on_success = instruction.next_instruction(exit_status=True)
+    on_failure = instruction.next_instruction(exit_status=False)
+    return [i for i in (on_success, on_failure) if i is not None]
+
+
+def body(entry):
+    '''Instructions of the subprogram starting at entry.
+
+    CALLs are not followed.
+    '''
+    instructions = set()
+    pending = [entry]
+    while pending:
+        instruction = pending.pop()
+        if instruction not in instructions:
+            instructions.add(instruction)
+            pending.extend(successors(instruction))
+    return instructions
+
+
+def reachable(start_instruction):
+    instructions = set()
+    pending = [start_instruction]
+    while pending:
+        instruction = pending.pop()
+        if instruction not in instructions:
+            instructions.add(instruction)
+            pending.extend(successors(instruction))
+            if isinstance(instruction, Call):
+                pending.append(instruction.start_instruction)
+    return instructions
+
+
+def copy_instruction(instruction):
+    instruction_copy = instruction.clone()
+    instruction_copy.index = instruction.index
+    return instruction_copy
+
+
+class InlineContext(object):
+
+    '''The CALL instruction an inlined subprogram returns to'''
+
+    def __init__(self, i_call, parent):
+        self.i_call = i_call
+        self.parent = parent
+
+
+class GraphCopier(object):
+
+    '''
+    Copies an instruction graph with CALLs inlined or turned into jumps.
+
+    A copy is made for each pair of (instruction, context), where context
+    is None for instructions of not inlined subprograms, and an
+    InlineContext for instructions inlined at a CALL.
+    '''
+
+    def __init__(self, inline, tail_call):
+        self.inline = inline
+        self.tail_call = tail_call
+        self.copies = dict()
+        self.contexts = dict()
+        self.links = []
+
+    def copy(self, start_instruction):
+        start_copy = self.copy_of(start_instruction, None)
+        while self.links:
+            instruction, context, instruction_copy = self.links.pop()
+            self.link(instruction, context, instruction_copy)
+        return start_copy
+
+    def copy_of(self, instruction, context):
+        if instruction is None:
+            return None
+
+        # inlined and tail CALLs are replaced by the copy of
+        # the first instruction of the called subprogram
+        keys = []
+        while (instruction, context) not in self.copies:
+            keys.append((instruction, context))
+            if isinstance(instruction, Call) and self.tail_call(instruction):
+                instruction = instruction.start_instruction
+            elif isinstance(instruction, Call) and self.inline(instruction):
+                context = self.inline_context(instruction, context)
+                instruction = instruction.start_instruction
+            else:
+                self.copies[(instruction, context)] = self.make_copy(
+                    instruction, context)
+
+        instruction_copy = self.copies[(instruction, context)]
+        for key in keys:
+            self.copies[key] = instruction_copy
+        return instruction_copy
+
+    def make_copy(self, instruction, context):
+        if context is not None and isinstance(instruction, Return):
+            instruction_copy = InlinedReturn(instruction.return_value)
+            instruction_copy.index = instruction.index
+        else:
+            instruction_copy = copy_instruction(instruction)
+
+        self.links.append((instruction, context, instruction_copy))
+        return instruction_copy
+
+    def inline_context(self, i_call, context):
+        key = (i_call, context)
+        if key not in self.contexts:
+            self.contexts[key] = InlineContext(i_call, context)
+        return self.contexts[key]
+
+    def link(self, instruction, context, instruction_copy):
+        if isinstance(instruction_copy, InlinedReturn):
+            # continue after the inlined CALL
+            i_call = context.i_call
+            instruction = i_call
+            context = context.parent
+
+        def copy_of_next(exit_status):
+            return self.copy_of(
+                instruction.next_instruction(exit_status), context)
+
+        if isinstance(instruction_copy, Dispatch):
+            instruction_copy.targets = [
+                copy_of_next(position)
+                for position in range(len(instruction_copy.targets))]
+        elif isinstance(instruction_copy, BranchingInstruction):
+            instruction_copy.set_instruction_on_yes(copy_of_next(True))
+            instruction_copy.set_instruction_on_no(copy_of_next(False))
+        elif isinstance(instruction_copy, Instruction):
+            instruction_copy.set_next_instruction(copy_of_next(True))
+
+        if isinstance(instruction_copy, Call):
+            instruction_copy.set_start_instruction(
+                self.copy_of(instruction.start_instruction, None))
+
+
+def is_return(instruction, return_value):
+    return (
+        isinstance(instruction, Return) and
+        instruction.return_value in (return_value, None))
+
+
+class Inliner(object):
+
+    '''
+    Inlines small or single-use subprograms at their CALLs
+    and turns tail CALLs into jumps.
+
+    A tail CALL is followed by RETURN True on its true path and RETURN
+    False on its false path - jumping into the subprogram and returning
+    from there directly to the caller has the same effect.
+
+    Inlined and tail CALLs are not run, so their statistics are not
+    updated, all other instructions - including the RETURNs of inlined
+    subprograms - are counted at their original index.
+    '''
+
+    def __init__(self, max_size=8, tail_calls=True):
+        self.max_size = max_size
+        self.tail_calls = tail_calls
+
+    def optimize(self, start_instruction):
+        call_counts = dict()
+        for instruction in reachable(start_instruction):
+            if isinstance(instruction, Call):
+                start = instruction.start_instruction
+                call_counts[start] = call_counts.get(start, 0) + 1
+
+        inlinable = set(
+            start
+            for (start, call_count) in call_counts.iteritems()
+            if self.is_inlinable(start, call_count))
+
+        def inline(i_call):
+            return i_call.start_instruction in inlinable
+
+        def tail_call(i_call):
+            return (
+                self.tail_calls and
+                is_return(i_call.next_instruction(True), True) and
+                is_return(i_call.next_instruction(False), False))
+
+        return GraphCopier(inline, tail_call).copy(start_instruction)
+
+    def is_inlinable(self, start_instruction, call_count):
+        instructions = body(start_instruction)
+        return call_count == 1 or len(instructions) <= self.max_size
+
+
+def dispatch_chain(instruction):
+    '''Dispatch class and arms of the chain on the no path of instruction'''
+    for dispatch_class in DISPATCH_CLASSES:
+        arms = []
+        while dispatch_class.can_join(arms, instruction):
+            arms.append(instruction)
+            instruction = instruction.instruction_on_no
+        if arms:
+            return dispatch_class, arms
+    return None, []
+
+
+class DispatchCopier(GraphCopier):
+
+    def __init__(self, min_arms):
+        super(DispatchCopier, self).__init__(
+            inline=lambda i_call: False, tail_call=lambda i_call: False)
+        self.min_arms = min_arms
+
+    def make_copy(self, instruction, context):
+        dispatch_class, arms = dispatch_chain(instruction)
+        if len(arms) < self.min_arms:
+            return super(DispatchCopier, self).make_copy(instruction, context)
+
+        dispatch = dispatch_class(arms)
+        dispatch.index = instruction.index
+        self.links.append((instruction, context, dispatch))
+        return dispatch
+
+    def link(self, instruction, context, instruction_copy):
+        if (isinstance(instruction_copy, Dispatch) and
+                not isinstance(instruction, Dispatch)):
+            instruction_copy.targets = [
+                self.copy_of(target, context)
+                for target in instruction_copy.chain_targets()]
+        else:
+            super(DispatchCopier, self).link(
+                instruction, context, instruction_copy)
+
+
+class Dispatcher(object):
+
+    '''
+    Replaces ELIF chains of at least min_arms FieldEquals, FieldSearch or
+    FieldInBucket branches on the same field with a Dispatch.
+
+    Statistics are reported on the FieldEquals arms as if the chain was
+    run: arms before the matching one count a failure, the matching arm a
+    success, the run time is reported on the first arm.
+    '''
+
+    def __init__(self, min_arms=3):
+        self.min_arms = min_arms
+
+    def optimize(self, start_instruction):
+        return DispatchCopier(self.min_arms).copy(start_instruction)
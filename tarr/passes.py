@@ -0,0 +1,180 @@
+'''
+Transformation passes rewriting compiled programs.
+
+Passes are run by compiler_base.PassManager before Program.init, when
+listed in Program.passes:
+
+    class Program(tarr.compiler.Program):
+        passes = tarr.passes.STANDARD_PASSES
+
+Unlike optimizers (see tarr.optimizer), passes change the program
+itself: removed instructions are not shown by to_text() and to_dot().
+'''
+
+from tarr.compiler_base import (
+    InstructionBase, Instruction, BranchingInstruction, Call)
+from tarr.optimizer import reachable
+
+
+def is_noop(instruction):
+    return (
+        isinstance(instruction, Instruction) and
+        instruction.__class__.run.im_func is InstructionBase.run.im_func)
+
+
+def redirect(instruction, target):
+    '''Replace every reference from instruction to other instructions
+    with target(referenced_instruction)
+    '''
+    on_success = instruction.next_instruction(exit_status=True)
+    on_failure = instruction.next_instruction(exit_status=False)
+    if isinstance(instruction, BranchingInstruction):
+        instruction.set_instruction_on_yes(target(on_success))
+        instruction.set_instruction_on_no(target(on_failure))
+    elif on_success is not None:
+        instruction.set_next_instruction(target(on_success))
+
+    if isinstance(instruction, Call):
+        instruction.set_start_instruction(
+            target(instruction.start_instruction))
+
+
+def all_instructions(sub_programs):
+    for sub_program in sub_programs:
+        for instruction in sub_program.instructions:
+            yield instruction
+
+
+class RemoveUnreachable(object):
+
+    '''Drops instructions and subprograms not reachable from the main
+    program
+    '''
+
+    def run(self, sub_programs):
+        main_program = sub_programs[0]
+        used = reachable(main_program.start_instruction)
+
+        for sub_program in sub_programs:
+            sub_program.instructions = [
+                i for i in sub_program.instructions if i in used]
+
+        sub_programs[1:] = [
+            sub_program
+            for sub_program in sub_programs[1:]
+            if sub_program.instructions]
+
+
+class ThreadJumps(object):
+
+    '''Jumps over instructions doing nothing and removes them'''
+
+    def run(self, sub_programs):
+        def target(instruction):
+            while is_noop(instruction):
+                next_instruction = instruction.next_instruction(True)
+                if next_instruction is None:
+                    break
+                instruction = next_instruction
+            return instruction
+
+        for instruction in all_instructions(sub_programs):
+            redirect(instruction, target)
+
+        for sub_program in sub_programs:
+            start_instruction = target(sub_program.start_instruction)
+            sub_program.instructions = [start_instruction] + [
+                i for i in sub_program.instructions
+                if i is not start_instruction and not is_noop(i)]
+
+
+# attributes linking instructions, not part of their identity
+LINK_ATTRIBUTES = frozenset([
+    'index',
+    '_next_instruction', 'instruction_on_yes', 'instruction_on_no',
+    'label', 'start_instruction'])
+
+
+class MergeIdenticalSubprograms(object):
+
+    '''
+    Subprograms with the same instructions in the same structure are
+    merged: CALLs of duplicates are redirected to the last definition,
+    so that CALLs still go forward.
+    '''
+
+    def run(self, sub_programs):
+        # CALLs go forward only, so the called subprograms are already
+        # processed, when processing from the end
+        representatives = dict()
+        sub_programs_by_key = dict()
+        for sub_program in reversed(sub_programs[1:]):
+            key = self.key(sub_program, representatives)
+            try:
+                representative = sub_programs_by_key.setdefault(
+                    key, sub_program)
+            except TypeError:
+                # unhashable instruction attribute, can not be compared
+                representative = sub_program
+            representatives[sub_program.start_instruction] = (
+                representative)
+
+        duplicates = set(
+            sub_program
+            for sub_program in sub_programs[1:]
+            if representatives[sub_program.start_instruction]
+            is not sub_program)
+
+        for instruction in all_instructions(sub_programs):
+            if isinstance(instruction, Call):
+                representative = representatives[
+                    instruction.start_instruction]
+                instruction.label = representative.label
+                instruction.set_start_instruction(
+                    representative.start_instruction)
+
+        sub_programs[:] = [
+            sub_program
+            for sub_program in sub_programs
+            if sub_program not in duplicates]
+
+    def key(self, sub_program, representatives):
+        # number instructions in depth first order
+        numbers = dict()
+        order = []
+        pending = [sub_program.start_instruction]
+        while pending:
+            instruction = pending.pop()
+            if instruction is None or instruction in numbers:
+                continue
+            numbers[instruction] = len(order)
+            order.append(instruction)
+            pending.append(instruction.next_instruction(exit_status=False))
+            pending.append(instruction.next_instruction(exit_status=True))
+
+        def number(instruction):
+            return numbers.get(instruction, -1)
+
+        def signature(instruction):
+            attributes = sorted(
+                (name, value)
+                for (name, value) in vars(instruction).iteritems()
+                if name not in LINK_ATTRIBUTES)
+            if isinstance(instruction, Call):
+                called = representatives[instruction.start_instruction]
+                attributes.append(('called', id(called)))
+            return (instruction.__class__, tuple(attributes))
+
+        return tuple(
+            (
+                signature(instruction),
+                number(instruction.next_instruction(exit_status=True)),
+                number(instruction.next_instruction(exit_status=False)))
+            for instruction in order)
+
+
+STANDARD_PASSES = (
+    ThreadJumps(),
+    MergeIdenticalSubprograms(),
+    RemoveUnreachable(),
+)
@@ -2,8 +2,9 @@
 Immutable data structure to hold the results and history of transformations.
 
 Functions/methods constructing new objects:
-    new(input)
+    new(input[, history_limit])
     payload.with_new_result(transform_name, key, value[, new_input])
+    payload.with_new_results(transform_name, mapping[, new_input])
     payload.with_new_input(transform_name, new_input)
     payload.with_key_removed(transform_name, key)
 
@@ -17,30 +18,130 @@ u' string'
 >>> list(p2.keys())
 [u'first word']
 >>> p2.transform_name, p2.parent.transform_name
-[u'demo1', u'START']
->>> # XXX: not yet
+(u'demo1', u'START')
 >>> p2.history()
 [u'demo1', u'START']
+
+By default every payload keeps its parent - the whole history - alive.
+With history_limit=N only the last N transform names are kept, and no
+parents, so the previous payloads can be garbage collected:
+
+>>> p3 = new(u'input', history_limit=2).with_new_input(u'demo1', u'x')
+>>> p3.with_new_input(u'demo2', u'y').history()
+[u'demo2', u'demo1']
+>>> p3.parent is None
+True
+
+Keys and transform names are interned, equal strings are shared by all
+the payloads - up to MAX_INTERNED different strings, later ones are
+kept as they are, so the table does not grow without bound.
+
+Chains longer than COMPACTION_DEPTH are compacted: the next payload has
+no parent, the transform names of the chain are kept in a compact side
+list, so history() is not changed, but the chain can be collected.
 '''
 
 
+from tarr.hamt import EMPTY
+
+
 NO_NEW_INPUT = object()
 
+# history_limit of keeping all the history
+HISTORY_ALL = None
+
+# maximum number of parents kept with HISTORY_ALL, see Step
+COMPACTION_DEPTH = 32
+
+# number of different strings shared by interned()
+MAX_INTERNED = 10000
+
+_interned = dict()
+
+
+def interned(value):
+    '''The first seen string equal to value and of the same type, or value
+    if not a string or MAX_INTERNED strings are already interned'''
+    if isinstance(value, basestring):
+        # str and unicode strings may be equal, the type is part of the key
+        key = (value.__class__, value)
+        try:
+            return _interned[key]
+        except KeyError:
+            if len(_interned) < MAX_INTERNED:
+                _interned[key] = value
+    return value
+
 
 class BasePayload(object):
 
+    '''
+    The results are held in a persistent map shared with the parent,
+    so keys are looked up in O(log n) independently of the number of
+    transformations. Keys are not ordered.
+    '''
+
+    __slots__ = ()
+
     input = object
+    results = EMPTY
+    parent = None
+    history_limit = HISTORY_ALL
+    # the last history_limit transform names, newest first -
+    # only if history_limit is not HISTORY_ALL
+    recent_history = ()
+    # with HISTORY_ALL: number of parents, and
+    # (transform names, older compacted_history) of compacted chains
+    depth = 0
+    compacted_history = ()
+
+    def __getstate__(self):
+        return dict(
+            (name, getattr(self, name))
+            for cls in self.__class__.__mro__
+            for name in getattr(cls, '__slots__', ())
+            if hasattr(self, name))
+
+    def __setstate__(self, state):
+        for (name, value) in state.iteritems():
+            setattr(self, name, value)
 
     def keys(self):
-        return list()
+        return self.results.keys()
 
     def __getitem__(self, key):
-        raise KeyError(key)
+        return self.results[key]
+
+    def history(self):
+        '''Transform names, newest first'''
+        if self.history_limit is not HISTORY_ALL:
+            return list(self.recent_history)
+
+        names = self.chain_history()
+        compacted_history = self.compacted_history
+        while compacted_history:
+            chain_names, compacted_history = compacted_history
+            names.extend(chain_names)
+        return names
+
+    def chain_history(self):
+        '''Transform names back to the first payload without parent'''
+        names = []
+        payload = self
+        while payload is not None:
+            names.append(payload.transform_name)
+            payload = payload.parent
+        return names
 
     def with_new_result(
             self, transform_name, key, value, new_input=NO_NEW_INPUT):
         return AddResult(self, transform_name, key, value, new_input)
 
+    def with_new_results(
+            self, transform_name, mapping, new_input=NO_NEW_INPUT):
+        '''Add all the key, value pairs of mapping as one step'''
+        return AddResults(self, transform_name, mapping, new_input)
+
     def with_key_removed(self, transform_name, key):
         return RemoveKey(self, transform_name, key)
 
@@ -50,66 +151,104 @@ class BasePayload(object):
 
 class New(BasePayload):
 
+    __slots__ = ('input', 'history_limit', 'recent_history')
+
     transform_name = u'START'
 
-    def __init__(self, input):
+    def __init__(self, input, history_limit=HISTORY_ALL):
         self.input = input
+        self.history_limit = history_limit
+        if history_limit is HISTORY_ALL:
+            self.recent_history = ()
+        else:
+            self.recent_history = (self.transform_name,)[:history_limit]
 
 
 new = New
 
 
-class AddResult(BasePayload):
+class Step(BasePayload):
 
-    def __init__(self, parent, transform_name, key, value, new_input):
+    '''Result of a transformation of parent'''
+
+    __slots__ = (
+        'transform_name', 'parent', 'input', 'results',
+        'history_limit', 'recent_history', 'depth', 'compacted_history')
+
+    def __init__(self, parent, transform_name, input, results):
+        transform_name = interned(transform_name)
         self.transform_name = transform_name
-        self.parent = parent
+        self.input = input
+        self.results = results
+        history_limit = parent.history_limit
+        self.history_limit = history_limit
+        if history_limit is HISTORY_ALL:
+            self.recent_history = ()
+            if parent.depth < COMPACTION_DEPTH:
+                self.parent = parent
+                self.depth = parent.depth + 1
+                self.compacted_history = parent.compacted_history
+            else:
+                self.parent = None
+                self.depth = 0
+                self.compacted_history = (
+                    tuple(parent.chain_history()), parent.compacted_history)
+        else:
+            self.parent = None
+            self.depth = 0
+            self.compacted_history = ()
+            self.recent_history = (
+                (transform_name,) + parent.recent_history)[:history_limit]
+
+
+class AddResult(Step):
+
+    __slots__ = ('key', 'value')
+
+    def __init__(self, parent, transform_name, key, value, new_input):
+        key = interned(key)
         self.key = key
         self.value = value
-        self.input = parent.input if new_input is NO_NEW_INPUT else new_input
+        super(AddResult, self).__init__(
+            parent, transform_name,
+            parent.input if new_input is NO_NEW_INPUT else new_input,
+            parent.results.set(key, value))
 
-    def keys(self):
-        yield self.key
-        for key in self.parent.keys():
-            if self.key != key:
-                yield key
 
-    def __getitem__(self, key):
-        return self.value if key == self.key else self.parent[key]
+class AddResults(Step):
 
+    __slots__ = ()
 
-class RemoveKey(BasePayload):
+    def __init__(self, parent, transform_name, mapping, new_input):
+        super(AddResults, self).__init__(
+            parent, transform_name,
+            parent.input if new_input is NO_NEW_INPUT else new_input,
+            parent.results.update(
+                (interned(key), value)
+                for (key, value) in mapping.iteritems()))
 
-    def __init__(self, parent, transform_name, key_to_remove):
-        self.transform_name = transform_name
-        self.parent = parent
-        self.key_to_remove = key_to_remove
 
-    def keys(self):
-        for key in self.parent.keys():
-            if key != self.key_to_remove:
-                yield key
+class RemoveKey(Step):
+
+    __slots__ = ('key_to_remove',)
 
-    @property
-    def input(self):
-        return self.parent.input
+    def __init__(self, parent, transform_name, key_to_remove):
+        key_to_remove = interned(key_to_remove)
+        self.key_to_remove = key_to_remove
+        super(RemoveKey, self).__init__(
+            parent, transform_name,
+            parent.input, parent.results.remove(key_to_remove))
 
     def __getitem__(self, key):
         if key == self.key_to_remove:
             raise KeyError(u'{} has been removed'.format(key))
-        else:
-            return self.parent[key]
+        return self.results[key]
 
 
-class NewInput(BasePayload):
+class NewInput(Step):
 
-    def __init__(self, parent, transform_name, new_input):
-        self.transform_name = transform_name
-        self.parent = parent
-        self.input = new_input
-
-    def keys(self):
-        return self.parent.keys()
+    __slots__ = ()
 
-    def __getitem__(self, key):
-        return self.parent[key]
+    def __init__(self, parent, transform_name, new_input):
+        super(NewInput, self).__init__(
+            parent, transform_name, new_input, parent.results)
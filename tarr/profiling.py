@@ -0,0 +1,169 @@
+'''
+Profile guided ordering of EXCLUSIVE_IF ladders.
+
+The conditions of an EXCLUSIVE_IF ... ELIF ... ENDIF ladder are mutually
+exclusive, so they can be tested in any order. A Profile of a previous
+run orders them to test as few (and as cheap) conditions per item as
+possible:
+
+    program = tarr.compiler.Program(spec)
+    ... run it on representative data ...
+    program.save_profile('classifier.profile')
+
+    program = tarr.compiler.Program(
+        spec, profile=Profile.load('classifier.profile'))
+
+The profile must be saved from the same program spec, it is keyed by
+instruction index. Only the executed copy of the instruction graph is
+reordered (see tarr.optimizer), indices and statistics stay the same, so
+a profile saved from a reordered program can be used as well.
+'''
+
+import json
+
+from tarr.compiler_base import Call
+from tarr.optimizer import GraphCopier, copy_instruction
+
+
+class BranchProfile(object):
+
+    '''Counts and total run time in seconds of an instruction'''
+
+    def __init__(self, item_count, success_count, failure_count, run_time):
+        self.item_count = item_count
+        self.success_count = success_count
+        self.failure_count = failure_count
+        self.run_time = run_time
+
+    def hits(self, negated):
+        if negated:
+            return self.failure_count
+        return self.success_count
+
+    @property
+    def cost(self):
+        '''Average run time of the instruction'''
+        return self.run_time / self.item_count
+
+
+class Profile(object):
+
+    '''BranchProfiles by instruction index'''
+
+    def __init__(self, branches=None):
+        self.branches = dict(branches or ())
+
+    @classmethod
+    def from_statistics(cls, statistics):
+        return cls(
+            (
+                stat.index,
+                BranchProfile(
+                    stat.item_count, stat.success_count, stat.failure_count,
+                    stat.estimated_run_time / 1e9))
+            for stat in statistics)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as f:
+            data = json.load(f)
+        return cls(
+            (int(index), BranchProfile(*counts))
+            for (index, counts) in data['branches'].iteritems())
+
+    def save(self, filename):
+        data = dict(
+            branches=dict(
+                (
+                    str(index),
+                    [
+                        branch.item_count, branch.success_count,
+                        branch.failure_count, branch.run_time])
+                for (index, branch) in self.branches.iteritems()))
+        with open(filename, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+
+    def order(self, arms):
+        '''
+        arms of a ladder in the order to test them.
+
+        Mutually exclusive conditions are best tested in increasing order
+        of cost / hits. Cost is ignored if there is no run time measured
+        for some of the arms, and arms never hit or never tested keep
+        their relative order at the end.
+        '''
+        branches = [self.branches.get(arm.index) for (arm, _) in arms]
+        tested = [
+            branch for branch in branches
+            if branch is not None and branch.item_count]
+        with_cost = all(branch.run_time > 0 for branch in tested)
+
+        def key(position):
+            branch = branches[position]
+            if branch is None or not branch.item_count:
+                return (2, 0, position)
+            cost = branch.cost if with_cost else 1.0
+            hits = branch.hits(arms[position][1])
+            if not hits:
+                return (1, cost, position)
+            return (0, cost / hits, position)
+
+        return [
+            arms[position] for position in sorted(range(len(arms)), key=key)]
+
+    def reorder(self, start_instruction, ladders):
+        '''Copy of the instruction graph, ladders tested in profile order'''
+        ordered = dict(
+            (ladder.head, (self.order(ladder.arms), ladder.tail))
+            for ladder in ladders)
+        return LadderCopier(ordered).copy(start_instruction)
+
+
+class LadderCopier(GraphCopier):
+
+    '''
+    Copies an instruction graph, ladders are linked in a new order.
+
+    ladders is a dict of head -> (ordered arms, tail), where the head
+    is the first condition in the source, and tail is the instruction
+    to continue with if none of the conditions hold.
+    '''
+
+    def __init__(self, ladders):
+        super(LadderCopier, self).__init__(
+            inline=lambda i_call: False, tail_call=lambda i_call: False)
+        self.ladders = ladders
+        self.arm_links = dict()
+
+    def make_copy(self, instruction, context):
+        if instruction not in self.ladders:
+            return super(LadderCopier, self).make_copy(instruction, context)
+
+        arms, tail = self.ladders[instruction]
+        copies = [copy_instruction(arm) for (arm, _) in arms]
+        for (arm, negated), arm_copy, next_arm in zip(
+                arms, copies, copies[1:] + [None]):
+            self.arm_links[arm_copy] = (arm, negated, next_arm, tail)
+            self.links.append((instruction, context, arm_copy))
+        return copies[0]
+
+    def link(self, instruction, context, instruction_copy):
+        if instruction_copy not in self.arm_links:
+            super(LadderCopier, self).link(
+                instruction, context, instruction_copy)
+            return
+
+        arm, negated, next_arm, tail = self.arm_links[instruction_copy]
+        on_hit = self.copy_of(arm.next_instruction(not negated), context)
+        if next_arm is None:
+            on_miss = self.copy_of(tail, context)
+        else:
+            on_miss = next_arm
+        if negated:
+            on_hit, on_miss = on_miss, on_hit
+        instruction_copy.set_instruction_on_yes(on_hit)
+        instruction_copy.set_instruction_on_no(on_miss)
+
+        if isinstance(instruction_copy, Call):
+            instruction_copy.set_start_instruction(
+                self.copy_of(arm.start_instruction, None))
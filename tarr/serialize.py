@@ -0,0 +1,344 @@
+'''
+Compact binary serialization of batches of Data objects.
+
+A batch is a flat, length-prefixed binary record instead of the pickled
+graph of payload nodes:
+
+    magic, flags
+    string table: count, (kind, length, utf-8 bytes)...
+    records: count, (length, record)...
+
+    record: id, input, [history limit, names], result count, results...
+
+Keys and transform names are stored once per batch in the string table,
+records refer to them by index. Named tuples - like the ids and inputs
+of the readers in tarr.batch_io - are stored as their field values and
+a reference to their class name and fields in the string table, they
+are loaded as instances of an equivalent namedtuple class. Other values
+are marshalled, or pickled if marshal can not handle them.
+
+>>> import tarr.payload
+>>> payload = tarr.payload.new(u'in').with_new_result(u'demo', u'key', 1)
+>>> [data] = loads_batch(dumps_batch([Data(u'id', payload)]))
+>>> data.id, data.payload.input, data.payload[u'key']
+(u'id', u'in', 1)
+
+History is dropped by default, with history=True the transform names
+are kept. Decoding of the results of a payload can be postponed to
+their first use with lazy=True.
+
+dump_batch() and iter_load() write and read files of batches, e.g.
+checkpoints.
+'''
+
+import collections
+import marshal
+import pickle
+import struct
+
+from tarr.data import Data
+from tarr.payload import BasePayload, HISTORY_ALL, EMPTY, interned
+from tarr.hamt import PersistentMap
+
+
+MAGIC = 'TRB1'
+
+# flags
+WITH_HISTORY = 1
+
+# string kinds
+UNICODE = 'u'
+BYTES = 'b'
+# class name and field names of a named tuple, separated by spaces
+TUPLE_CLASS = 't'
+
+# value encodings
+MARSHAL = 'M'
+PICKLE = 'P'
+NAMED_TUPLE = 'N'
+
+# key reference of keys that are not in the string table
+INLINE_KEY = -1
+
+# history limit of HISTORY_ALL
+ALL = -1
+
+U32 = struct.Struct('<I')
+I32 = struct.Struct('<i')
+STRING_HEADER = struct.Struct('<cI')
+VALUE_HEADER = struct.Struct('<cI')
+HEADER = struct.Struct('<4sB')
+HISTORY_HEADER = struct.Struct('<iI')
+TUPLE_HEADER = struct.Struct('<II')
+
+
+class FormatError(Exception):
+    pass
+
+
+def encode_value(value):
+    try:
+        encoded = marshal.dumps(value)
+        tag = MARSHAL
+    except ValueError:
+        encoded = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        tag = PICKLE
+    return VALUE_HEADER.pack(tag, len(encoded)) + encoded
+
+
+def is_named_tuple(value):
+    return isinstance(value, tuple) and hasattr(value, '_fields')
+
+
+def decode_value(buffer, offset, strings):
+    '''(value, offset after it)'''
+    tag, length = VALUE_HEADER.unpack_from(buffer, offset)
+    start = offset + VALUE_HEADER.size
+    end = start + length
+    if tag == MARSHAL:
+        return marshal.loads(buffer[start:end]), end
+    if tag == PICKLE:
+        return pickle.loads(buffer[start:end]), end
+    if tag == NAMED_TUPLE:
+        ref, count = TUPLE_HEADER.unpack_from(buffer, start)
+        offset = start + TUPLE_HEADER.size
+        values = []
+        for _ in xrange(count):
+            value, offset = decode_value(buffer, offset, strings)
+            values.append(value)
+        return tuple.__new__(strings[ref], values), end
+    raise FormatError('Unknown value encoding {!r}'.format(tag))
+
+
+class Encoder(object):
+
+    '''Encodes the records of a batch sharing one string table'''
+
+    def __init__(self, history=False):
+        self.history = history
+        self.strings = []
+        self.string_index = {}
+        self.records = []
+
+    def string_ref(self, string):
+        # str and unicode are equal for ascii, but not interchangeable
+        entry = (type(string), string)
+        try:
+            return self.string_index[entry]
+        except KeyError:
+            index = self.string_index[entry] = len(self.strings)
+            self.strings.append(string)
+            return index
+
+    def encode_value(self, value):
+        if not is_named_tuple(value):
+            return encode_value(value)
+        cls = value.__class__
+        ref = self.string_ref((cls.__name__,) + tuple(cls._fields))
+        encoded = ''.join(
+            [TUPLE_HEADER.pack(ref, len(value))] +
+            [self.encode_value(item) for item in value])
+        return VALUE_HEADER.pack(NAMED_TUPLE, len(encoded)) + encoded
+
+    def encode_key(self, key):
+        if isinstance(key, basestring):
+            return I32.pack(self.string_ref(key))
+        return I32.pack(INLINE_KEY) + self.encode_value(key)
+
+    def add(self, data):
+        payload = data.payload
+        parts = [self.encode_value(data.id), self.encode_value(payload.input)]
+        if self.history:
+            history_limit = payload.history_limit
+            names = payload.history()
+            parts.append(
+                HISTORY_HEADER.pack(
+                    ALL if history_limit is HISTORY_ALL else history_limit,
+                    len(names)))
+            parts.extend(U32.pack(self.string_ref(name)) for name in names)
+        items = payload.results.items()
+        parts.append(U32.pack(len(items)))
+        for (key, value) in items:
+            parts.append(self.encode_key(key))
+            parts.append(self.encode_value(value))
+        record = ''.join(parts)
+        self.records.append(U32.pack(len(record)) + record)
+
+    def getvalue(self):
+        parts = [
+            HEADER.pack(MAGIC, WITH_HISTORY if self.history else 0),
+            U32.pack(len(self.strings))]
+        for string in self.strings:
+            if isinstance(string, tuple):
+                # (class name, field names...) of a named tuple
+                encoded = ' '.join(string).encode('utf-8')
+                kind = TUPLE_CLASS
+            elif isinstance(string, unicode):
+                encoded = string.encode('utf-8')
+                kind = UNICODE
+            else:
+                encoded = string
+                kind = BYTES
+            parts.append(STRING_HEADER.pack(kind, len(encoded)))
+            parts.append(encoded)
+        parts.append(U32.pack(len(self.records)))
+        parts.extend(self.records)
+        return ''.join(parts)
+
+
+def decode_results(buffer, offset, strings):
+    count, = U32.unpack_from(buffer, offset)
+    offset += U32.size
+    items = []
+    for _ in xrange(count):
+        ref, = I32.unpack_from(buffer, offset)
+        offset += I32.size
+        if ref == INLINE_KEY:
+            key, offset = decode_value(buffer, offset, strings)
+        else:
+            key = strings[ref]
+        value, offset = decode_value(buffer, offset, strings)
+        items.append((key, value))
+    return PersistentMap(items)
+
+
+class Loaded(BasePayload):
+
+    '''
+    Decoded payload, without parent.
+
+    The transform names are restored as a compacted history, results are
+    decoded on first use if the payload was loaded lazily.
+    '''
+
+    __slots__ = (
+        'transform_name', 'input', 'history_limit', 'recent_history',
+        'compacted_history', '_results', '_encoded')
+
+    def __init__(self, input, history_limit, names, results, encoded=None):
+        self.input = input
+        self.history_limit = history_limit
+        self._results = results
+        # (buffer, offset, strings) of lazily decoded results
+        self._encoded = encoded
+        self.recent_history = ()
+        self.compacted_history = ()
+        if history_limit is not HISTORY_ALL:
+            self.transform_name = names[0] if names else u'LOAD'
+            self.recent_history = tuple(names)
+        elif names:
+            self.transform_name = names[0]
+            if len(names) > 1:
+                self.compacted_history = (tuple(names[1:]), ())
+        else:
+            self.transform_name = u'LOAD'
+
+    def __getstate__(self):
+        # without the buffer of the whole batch
+        self.results
+        return super(Loaded, self).__getstate__()
+
+    @property
+    def results(self):
+        if self._results is None:
+            self._results = decode_results(*self._encoded)
+            self._encoded = None
+        return self._results
+
+
+def decode_strings(buffer, offset):
+    count, = U32.unpack_from(buffer, offset)
+    offset += U32.size
+    strings = []
+    for _ in xrange(count):
+        kind, length = STRING_HEADER.unpack_from(buffer, offset)
+        offset += STRING_HEADER.size
+        string = buffer[offset:offset + length]
+        offset += length
+        if kind == TUPLE_CLASS:
+            name, _, fields = string.decode('utf-8').partition(' ')
+            strings.append(collections.namedtuple(name, fields.split()))
+            continue
+        if kind == UNICODE:
+            string = string.decode('utf-8')
+        elif kind != BYTES:
+            raise FormatError('Unknown string kind {!r}'.format(kind))
+        strings.append(interned(string))
+    return strings, offset
+
+
+def decode_record(buffer, offset, strings, with_history, lazy):
+    id, offset = decode_value(buffer, offset, strings)
+    input, offset = decode_value(buffer, offset, strings)
+    if with_history:
+        history_limit, count = HISTORY_HEADER.unpack_from(buffer, offset)
+        offset += HISTORY_HEADER.size
+        if history_limit == ALL:
+            history_limit = HISTORY_ALL
+        names = [
+            strings[U32.unpack_from(buffer, offset + i * U32.size)[0]]
+            for i in xrange(count)]
+        offset += count * U32.size
+    else:
+        # nothing to remember
+        history_limit = 0
+        names = ()
+    if lazy:
+        if U32.unpack_from(buffer, offset)[0]:
+            payload = Loaded(
+                input, history_limit, names, None, (buffer, offset, strings))
+        else:
+            payload = Loaded(input, history_limit, names, EMPTY)
+    else:
+        payload = Loaded(
+            input, history_limit, names,
+            decode_results(buffer, offset, strings))
+    return Data(id, payload)
+
+
+def dumps_batch(data_items, history=False):
+    '''Encode Data objects into a batch'''
+    encoder = Encoder(history)
+    for data in data_items:
+        encoder.add(data)
+    return encoder.getvalue()
+
+
+def loads_batch(buffer, lazy=False):
+    '''List of the Data objects of a batch'''
+    magic, flags = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise FormatError('Not a TARR batch')
+    strings, offset = decode_strings(buffer, HEADER.size)
+    count, = U32.unpack_from(buffer, offset)
+    offset += U32.size
+    data_items = []
+    for _ in xrange(count):
+        length, = U32.unpack_from(buffer, offset)
+        offset += U32.size
+        data_items.append(
+            decode_record(
+                buffer, offset, strings, flags & WITH_HISTORY, lazy))
+        offset += length
+    return data_items
+
+
+def dump_batch(data_items, file, history=False):
+    '''Append a length-prefixed batch to file'''
+    batch = dumps_batch(data_items, history)
+    file.write(U32.pack(len(batch)))
+    file.write(batch)
+
+
+def iter_load(file, lazy=False):
+    '''Data objects of all the batches in file'''
+    while True:
+        prefix = file.read(U32.size)
+        if not prefix:
+            return
+        length, = U32.unpack(prefix)
+        batch = file.read(length)
+        if len(batch) != length:
+            raise FormatError('Truncated batch')
+        for data in loads_batch(batch, lazy):
+            yield data
@@ -0,0 +1,44 @@
+import unittest
+import tarr.aho_corasick as m
+
+
+class Test_Automaton(unittest.TestCase):
+
+    def test_keyword_is_found(self):
+        automaton = m.Automaton(['dog', 'cat'])
+
+        self.assertEqual('cat', automaton.search('a cat and a dog'))
+        self.assertTrue(automaton.contains_any('hotdog'))
+
+    def test_no_keyword_found(self):
+        automaton = m.Automaton(['dog', 'cat'])
+
+        self.assertIsNone(automaton.search('do ca'))
+        self.assertFalse(automaton.contains_any(''))
+
+    def test_keyword_found_through_failure_link(self):
+        automaton = m.Automaton(['he', 'hers', 'his', 'she'])
+
+        self.assertEqual('she', automaton.search('ushers'))
+        self.assertEqual('he', m.Automaton(['he', 'xshey']).search('xshe'))
+
+    def test_partial_match_is_restarted(self):
+        automaton = m.Automaton(['aab'])
+
+        self.assertEqual('aab', automaton.search('aaab'))
+
+    def test_empty_keyword_is_always_found(self):
+        automaton = m.Automaton(['', 'x'])
+
+        self.assertEqual('', automaton.search('abc'))
+
+    def test_unicode(self):
+        automaton = m.Automaton([u'\xe1rv\xedz'])
+
+        self.assertTrue(automaton.contains_any(u't\xfck\xf6r\xe1rv\xedz'))
+
+    def test_many_keywords(self):
+        automaton = m.Automaton('k{}x'.format(i) for i in xrange(50000))
+
+        self.assertEqual('k12345x', automaton.search('... k12345x ...'))
+        self.assertFalse(automaton.contains_any('k12345 x'))
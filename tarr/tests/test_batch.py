@@ -1,7 +1,23 @@
+import itertools
+import os.path
 import unittest
 import mock
+import tempdir
 
 import tarr.batch as m
+import tarr.compiler
+from tarr.compiler import RETURN_TRUE as RETURN
+from tarr.data import Data, DataBatch
+from tarr.tests.test_compiler import die
+
+
+@tarr.compiler.rule
+def duplicate(x):
+    return (x, x)
+
+
+class StopWriting(Exception):
+    pass
 
 
 class TestBatchTransform_process(unittest.TestCase):
@@ -81,20 +97,257 @@ class TestTarrBatchTransform_process(TestBatchTransform_process):
 
     BATCH_CLASS = m.TarrBatchTransform
 
-    def test_exception_in_tarr_transform_is_handled(self):
-        self.batch.transformation = mock.Mock(spec=self.batch.transformation)
-        self.batch.transformation.run = mock.Mock(side_effect=[Exception])
+    def setUp(self):
+        super(TestTarrBatchTransform_process, self).setUp()
+        # data is run through the program
+        data = [Data(1, self.data1), Data(2, self.data2), Data(3, self.data3)]
+        self.reader.__iter__.return_value = iter(data)
+
+        def store_data(data):
+            if len(self.written) == 3:
+                raise StopWriting
+            self.written.append(
+                data.payload if isinstance(data, Data) else data)
+
+        self.writer.write.side_effect = store_data
+
+    def test_data_written_is_transformed_by_program(self):
+        self.batch.transformation = tarr.compiler.Program([duplicate, RETURN])
 
         self.batch.process(u'input', u'output')
 
         self.assertEqual(
-            3, self.batch.transformation.run.call_count)
+            [
+                (mock.sentinel.a, mock.sentinel.a),
+                (mock.sentinel.b, mock.sentinel.b),
+                (mock.sentinel.c, mock.sentinel.c)],
+            self.written)
+
+    def test_exception_in_tarr_transform_is_handled(self):
+        self.batch.transformation = tarr.compiler.Program([die, RETURN])
+
+        self.batch.process(u'input', u'output')
+
         self.assertEqual(
             [self.data1, self.data2, self.data3],
             self.written)
 
+    def test_data_is_streamed(self):
+        self.batch.transformation = tarr.compiler.Program([RETURN])
+        self.reader.__iter__.return_value = itertools.count()
+
+        with self.assertRaises(StopWriting):
+            self.batch.process(u'input', u'output')
+
+        self.assertEqual([0, 1, 2], self.written)
+
+    def test_overridden_transform_is_used(self):
+        class Transform(m.TarrBatchTransform):
+            def transform(self, data):
+                data = super(Transform, self).transform(data)
+                return Data(data.id, (data.payload, 'transformed'))
+
+        batch = Transform()
+        batch.get_reader = self.batch.get_reader
+        batch.get_writer = self.batch.get_writer
+        batch.transformation = tarr.compiler.Program([duplicate, RETURN])
+
+        batch.process(u'input', u'output')
+
+        self.assertEqual(
+            [
+                ((mock.sentinel.a, mock.sentinel.a), 'transformed'),
+                ((mock.sentinel.b, mock.sentinel.b), 'transformed'),
+                ((mock.sentinel.c, mock.sentinel.c), 'transformed')],
+            self.written)
+
+
+class LineReader(m.Reader):
+
+    def __init__(self, input_filename):
+        self.file = open(input_filename)
+
+    def __iter__(self):
+        for (i, line) in enumerate(self.file):
+            yield Data(i, int(line))
+
+    def close(self):
+        self.file.close()
+
+
+class LineWriter(m.Writer):
+
+    def __init__(self, output_filename):
+        self.file = open(output_filename, 'w')
+
+    def write(self, data):
+        self.file.write('{}\n'.format(data.payload))
+
+    def close(self):
+        self.file.close()
+
+
+@tarr.compiler.branch
+def is_odd(x):
+    return x % 2 == 1
+
+
+@tarr.compiler.rule
+def add1(x):
+    return x + 1
+
+
+class IncreaseOdd(m.TarrBatchTransform):
+
+    # must be top-level to be usable by multiprocessing
+
+    def get_reader(self, filename):
+        return LineReader(filename)
+
+    def get_writer(self, filename):
+        return LineWriter(filename)
+
+    def get_tarr_transform(self):
+        return [
+            tarr.compiler.IF (is_odd),
+                add1,
+            tarr.compiler.ENDIF,
+            RETURN]
+
+
+def write_lines(filename, values):
+    with open(filename, 'w') as f:
+        f.writelines('{}\n'.format(value) for value in values)
+
+
+def read(filename):
+    with open(filename) as f:
+        return f.read()
+
+
+class Test_statistics(unittest.TestCase):
+
+    def test_transform_batch_returns_statistics(self):
+        with tempdir.TempDir() as d:
+            input = os.path.join(d.name, 'input')
+            write_lines(input, [1, 2, 3])
+
+            statistics = m.transform_batch(
+                (IncreaseOdd, input, os.path.join(d.name, 'output')))
+
+        batch = IncreaseOdd()
+        batch.add_statistics(statistics)
+        [is_odd_stat] = batch.transformation.statistics[:1]
+        self.assertEqual(3, is_odd_stat.item_count)
+        self.assertEqual(2, is_odd_stat.success_count)
+
+    def test_statistics_of_plain_transform_are_ignored(self):
+        self.assertIsNone(m.BatchTransform().get_statistics())
+
+    def test_write_statistics_merges_them(self):
+        batches = [IncreaseOdd(), IncreaseOdd()]
+        batches[0].transformation.run(Data(0, 1))
+        batches[1].transformation.run(Data(0, 2))
+        batches[1].transformation.run(Data(0, 3))
+
+        with tempdir.TempDir() as d:
+            prefix = os.path.join(d.name, 'output')
+            m.write_statistics(
+                IncreaseOdd,
+                [batch.get_statistics() for batch in batches] + [None],
+                prefix)
+
+            text = read(prefix + '.statistics.txt')
+            dot = read(prefix + '.statistics.dot')
+            saved = tarr.compiler.load_statistics(prefix + '.statistics')
+
+        self.assertIn('True  -> 1   (*2)', text)
+        self.assertIn('False -> 2   (*1)', text)
+        self.assertIn('RETURN True   (*3)', text)
+        self.assertIn('[label="True: 2"]', dot)
+        self.assertEqual(3, saved[0].item_count)
+
+
+class Test_main(unittest.TestCase):
+
+    def test_single_input(self):
+        with tempdir.TempDir() as d:
+            input = os.path.join(d.name, 'input')
+            output = os.path.join(d.name, 'output')
+            write_lines(input, [1, 2, 3])
+
+            m.main(IncreaseOdd, [input, output])
+
+            self.assertEqual('2\n2\n4\n', read(output))
+            self.assertIn(
+                'RETURN True   (*3)', read(output + '.statistics.txt'))
+
+    def test_multiple_inputs_statistics_are_merged(self):
+        with tempdir.TempDir() as d:
+            input = os.path.join(d.name, 'input')
+            output = os.path.join(d.name, 'output')
+            write_lines(input + '0', [1, 2])
+            write_lines(input + '1', [3])
+            write_lines(input + '2', [4, 5, 6])
+
+            m.main(IncreaseOdd, [input, output])
+
+            self.assertEqual('2\n2\n', read(output + '0'))
+            self.assertEqual('4\n', read(output + '1'))
+            self.assertEqual('4\n6\n6\n', read(output + '2'))
+            text = read(output + '.statistics.txt')
+
+        self.assertIn('True  -> 1   (*3)', text)
+        self.assertIn('False -> 2   (*3)', text)
+        self.assertIn('RETURN True   (*6)', text)
+
+
+class BatchedIncreaseOdd(IncreaseOdd):
+
+    batch_size = 2
+
+
+class Test_batches(unittest.TestCase):
+
+    def test_main(self):
+        with tempdir.TempDir() as d:
+            input = os.path.join(d.name, 'input')
+            output = os.path.join(d.name, 'output')
+            write_lines(input, [1, 2, 3, 4, 5])
+
+            m.main(BatchedIncreaseOdd, [input, output])
+
+            self.assertEqual('2\n2\n4\n4\n6\n', read(output))
+            self.assertIn(
+                'RETURN True   (*5)', read(output + '.statistics.txt'))
+
+    def test_reader_batches(self):
+        with tempdir.TempDir() as d:
+            input = os.path.join(d.name, 'input')
+            write_lines(input, [1, 2, 3])
+
+            reader = LineReader(input)
+            batches = list(reader.batches(2))
+            reader.close()
+
+        self.assertEqual([[1, 2], [3]], [b.payloads for b in batches])
+        self.assertEqual([[0, 1], [2]], [b.ids for b in batches])
+
+    def test_processed_count(self):
+        with tempdir.TempDir() as d:
+            input = os.path.join(d.name, 'input')
+            write_lines(input, [1, 2, 3])
+
+            batch = BatchedIncreaseOdd()
+            batch.process(input, os.path.join(d.name, 'output'))
+
+        self.assertEqual(3, batch.processed_count)
+
+    def test_exception_in_tarr_transform_is_handled(self):
+        batch = BatchedIncreaseOdd()
+        batch.transformation = tarr.compiler.Program([die, RETURN])
+        data_batch = DataBatch([0, 1], [1, 2])
+
+        batch.transform_data_batch(data_batch)
 
-# TODO: test main - also the parallel version
-# plan:
-# 1. use @in_temp_dir
-# 2. use a special BatchTransform class the writes its parameters into file
+        self.assertEqual([1, 2], data_batch.payloads)
@@ -0,0 +1,168 @@
+# coding: utf-8
+import os.path
+import unittest
+import tempdir
+
+import tarr.batch_io as m
+import tarr.serialize
+from tarr.data import DataBatch
+
+
+CSV = (
+    u'id,name,ignored,city\n'
+    u'1,Árvíztűrő,x,Budapest\n'
+    u'2,"Comma, inside",y,\n'
+    u'3,"Quoted ""name""",z,Pécs\n').encode('utf-8')
+
+ROWS = [
+    ((u'1',), (u'Árvíztűrő', u'Budapest')),
+    ((u'2',), (u'Comma, inside', u'')),
+    ((u'3',), (u'Quoted "name"', u'Pécs'))]
+
+
+class ReaderTests(object):
+
+    def reader(self, id_fields=(u'id',), payload_fields=(u'name', u'city')):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.tempdir = tempdir.TempDir()
+        self.filename = os.path.join(self.tempdir.name, 'input.csv')
+        with open(self.filename, 'wb') as f:
+            f.write(CSV)
+
+    def tearDown(self):
+        self.tempdir.dissolve()
+
+    def read(self, reader):
+        try:
+            return [(data.id, data.payload.input) for data in reader]
+        finally:
+            reader.close()
+
+    def test_rows(self):
+        self.assertEqual(ROWS, self.read(self.reader()))
+
+    def test_fields_are_named(self):
+        [data] = list(self.reader())[:1]
+
+        self.assertEqual(u'1', data.id.id)
+        self.assertEqual(u'Budapest', data.payload.input.city)
+
+    def test_fields_are_unicode(self):
+        [data] = list(self.reader())[:1]
+
+        self.assertIsInstance(data.payload.input.city, unicode)
+
+    def test_data_can_be_serialized(self):
+        data_items = list(self.reader())
+
+        loaded = tarr.serialize.loads_batch(
+            tarr.serialize.dumps_batch(data_items))
+
+        self.assertEqual(
+            ROWS, [(data.id, data.payload.input) for data in loaded])
+        self.assertEqual(u'Budapest', loaded[0].payload.input.city)
+
+    def test_single_field(self):
+        self.assertEqual(
+            [((u'1',), (u'x',)), ((u'2',), (u'y',)), ((u'3',), (u'z',))],
+            self.read(self.reader(payload_fields=[u'ignored'])))
+
+    def test_no_fields(self):
+        self.assertEqual(
+            [((), ())] * 3,
+            self.read(self.reader(id_fields=(), payload_fields=())))
+
+    def test_batches_of_no_fields(self):
+        reader = self.reader(id_fields=(), payload_fields=())
+
+        batches = list(reader.batches(2))
+        reader.close()
+
+        self.assertEqual([2, 1], map(len, batches))
+        self.assertEqual(
+            [((), ())] * 3,
+            [
+                (row.id, row.payload.input)
+                for batch in batches for row in batch])
+
+    def test_batches(self):
+        reader = self.reader()
+
+        batches = list(reader.batches(2))
+        reader.close()
+
+        self.assertEqual([2, 1], map(len, batches))
+        self.assertIsInstance(batches[0], DataBatch)
+        self.assertEqual(
+            ROWS,
+            [
+                (row.id, row.payload.input)
+                for batch in batches for row in batch])
+
+    def test_batches_of_single_field(self):
+        reader = self.reader(id_fields=(), payload_fields=[u'city'])
+
+        batches = list(reader.batches(2))
+        reader.close()
+
+        self.assertEqual(
+            [((), (u'Budapest',)), ((), (u'',)), ((), (u'Pécs',))],
+            [
+                (row.id, row.payload.input)
+                for batch in batches for row in batch])
+        self.assertEqual(u'Pécs', batches[1][0].payload.input.city)
+
+
+class Test_TarrCsvReader(ReaderTests, unittest.TestCase):
+
+    def reader(self, id_fields=(u'id',), payload_fields=(u'name', u'city')):
+        return m.TarrCsvReader(id_fields, payload_fields, self.filename)
+
+
+class Test_ChunkedCsvReader(ReaderTests, unittest.TestCase):
+
+    def reader(self, id_fields=(u'id',), payload_fields=(u'name', u'city')):
+        return m.ChunkedCsvReader(
+            id_fields, payload_fields, self.filename, chunk_size=2)
+
+    def test_empty_fields_only(self):
+        self.assertEqual(
+            [((), (u'Budapest',)), ((), (u'',)), ((), (u'Pécs',))],
+            self.read(self.reader(id_fields=(), payload_fields=[u'city'])))
+
+    def test_encoding(self):
+        with open(self.filename, 'wb') as f:
+            f.write(CSV.decode('utf-8').encode('latin2'))
+
+        reader = m.ChunkedCsvReader(
+            [u'id'], [u'name', u'city'], self.filename, encoding='latin2')
+
+        self.assertEqual(ROWS, self.read(reader))
+
+    def test_empty_file(self):
+        with open(self.filename, 'wb') as f:
+            f.write('id,name,city\n')
+
+        self.assertEqual([], self.read(self.reader()))
+
+
+class Test_CsvWriter(unittest.TestCase):
+
+    def test_write_batch(self):
+        with tempdir.TempDir() as d:
+            filename = os.path.join(d.name, 'output.csv')
+            writer = m.CsvWriter(
+                [
+                    (u'id', lambda data: data.id),
+                    (u'name', lambda data: data.payload)],
+                filename)
+            writer.write_batch(DataBatch([1, 2], [u'Árvíztűrő', u'a,b']))
+            writer.close()
+
+            with open(filename, 'rb') as f:
+                content = f.read().decode('utf-8')
+
+        self.assertEqual(
+            u'id,name\r\n1,Árvíztűrő\r\n2,"a,b"\r\n', content)
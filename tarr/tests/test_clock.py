@@ -0,0 +1,13 @@
+import unittest
+import tarr.clock as m
+
+
+class Test_now_ns(unittest.TestCase):
+
+    def test_is_integer(self):
+        self.assertIsInstance(m.now_ns(), (int, long))
+
+    def test_does_not_go_backwards(self):
+        times = [m.now_ns() for i in range(1000)]
+
+        self.assertEqual(sorted(times), times)
@@ -0,0 +1,149 @@
+import gc
+import linecache
+import sys
+import unittest
+import tarr.codegen as m
+import tarr.compiler
+from tarr.data import Data
+import tarr.tests.test_compiler_base
+import tarr.tests.test_compiler
+from tarr.tests.test_compiler import add1, odd, increase_if_odd
+from tarr.compiler import (
+    RETURN_TRUE, RETURN_FALSE, DEF, IF, ELIF, ELSE, ENDIF)
+
+
+class ProgramWithoutStatistics(m.Program):
+
+    with_statistics = False
+
+
+class Test_Program(tarr.tests.test_compiler_base.Test_Program):
+
+    PROGRAM_CLASS = m.Program
+
+
+class Test_Program_without_statistics(
+        tarr.tests.test_compiler_base.Test_Program):
+
+    PROGRAM_CLASS = ProgramWithoutStatistics
+
+
+class Test_Program_visualization(
+        tarr.tests.test_compiler.Test_Program_visualization):
+
+    # statistics are collected by the generated code, without run times
+
+    TO_TEXT_WITH_STATISTICS = tarr.tests.test_compiler.TEST_TO_TEXT_WITH_COUNTS
+
+    def program(self):
+        return m.Program(self.visualized_program_spec)
+
+
+def const(value):
+    @tarr.compiler.rule
+    def const(any):
+        return value
+    return const
+
+
+def equals(value):
+    @tarr.compiler.branch
+    def equals(n):
+        return n == value
+    return equals
+
+
+class Test_generated_code(unittest.TestCase):
+
+    def test_subprograms_are_functions(self):
+        prog = ProgramWithoutStatistics(
+            [
+            'x', RETURN_TRUE,
+            DEF ('x'), add1, RETURN_TRUE,
+            ])
+
+        self.assertIn('# DEF ("x")', prog.source)
+        self.assertEqual(2, prog.source.count('\ndef '))
+
+    def test_ELIF_chain_is_if_elif_else(self):
+        prog = ProgramWithoutStatistics(
+            [
+            IF (equals(1)),
+                const('one'),
+            ELIF (equals(2)),
+                const('two'),
+            ELSE,
+                const('many'),
+            ENDIF,
+            RETURN_TRUE
+            ])
+
+        self.assertIn('\n    elif ', prog.source)
+        self.assertEqual('one', prog.run(Data(id, 1)).payload)
+        self.assertEqual('two', prog.run(Data(id, 2)).payload)
+        self.assertEqual('many', prog.run(Data(id, 3)).payload)
+
+    def test_long_ELIF_chain_with_statistics_is_compilable(self):
+        spec = [IF (equals(0)), const(0)]
+        for i in range(1, 300):
+            spec.extend([ELIF (equals(i)), const(i)])
+        spec.extend([ENDIF, RETURN_TRUE])
+
+        prog = m.Program(spec)
+
+        self.assertEqual(299, prog.run(Data(id, 299)).payload)
+        self.assertEqual(1, prog.statistics[2 * 299].success_count)
+
+    def test_long_program_is_not_limited_by_recursion_limit(self):
+        spec = []
+        for i in range(sys.getrecursionlimit() + 100):
+            spec.extend([IF (odd), add1, ENDIF])
+        spec.append(RETURN_TRUE)
+
+        prog = m.Program(spec)
+
+        self.assertEqual(2, prog.run(Data(id, 1)).payload)
+        self.assertEqual(2, prog.run(Data(id, 2)).payload)
+
+    def test_generated_source_is_in_linecache_while_in_use(self):
+        prog = ProgramWithoutStatistics([add1, RETURN_TRUE])
+        filename = prog.runner.filename
+        self.assertIn(filename, linecache.cache)
+
+        del prog
+        gc.collect()
+
+        self.assertNotIn(filename, linecache.cache)
+        self.assertNotIn(filename, m._cached_sources)
+
+    def test_branch_rule(self):
+        prog = m.Program(
+            [
+            IF (increase_if_odd),
+                add1,
+            ENDIF,
+            RETURN_TRUE,
+            ])
+
+        self.assertEqual(0, prog.run(Data(id, 0)).payload)
+        self.assertEqual(3, prog.run(Data(id, 1)).payload)
+
+    def test_exit_status(self):
+        prog = m.Program(
+            [
+            IF ('odd?'),
+                add1,
+            ENDIF,
+            'odd?',
+            RETURN_TRUE,
+
+            DEF ('odd?'),
+                IF (odd),
+                    RETURN_TRUE,
+                ENDIF,
+                RETURN_FALSE,
+            ])
+
+        self.assertEqual(2, prog.run(Data(id, 1)).payload)
+        self.assertIs(True, prog.runner.exit_status)
+        self.assertEqual([1, 1], [s.item_count for s in prog.statistics[:2]])
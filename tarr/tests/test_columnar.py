@@ -0,0 +1,207 @@
+import unittest
+import tarr.columnar as m
+import tarr.compiler
+from tarr.data import Data
+import tarr.tests.test_compiler_base
+import tarr.tests.test_compiler
+from tarr.tests.test_compiler import add1, odd, increase_if_odd
+from tarr.compiler import (
+    RETURN_TRUE, RETURN_FALSE, DEF, IF, ELIF, ELSE, ENDIF, FieldEquals)
+import tarr.optimizer
+
+
+class Test_Program(tarr.tests.test_compiler_base.Test_Program):
+
+    PROGRAM_CLASS = m.Program
+
+
+class Test_Runner_call_stack(
+        tarr.tests.test_compiler_base.Test_Runner_call_stack):
+
+    PROGRAM_CLASS = m.Program
+
+
+class BatchCalls(object):
+
+    def __init__(self):
+        self.batches = []
+
+    def record(self, payloads):
+        self.batches.append(list(payloads))
+
+
+def batch_functions():
+    calls = BatchCalls()
+
+    @m.rule_batch
+    def add2(numbers):
+        calls.record(numbers)
+        return [n + 2 for n in numbers]
+
+    @m.branch_batch
+    def is_odd(numbers):
+        calls.record(numbers)
+        return [n % 2 == 1 for n in numbers]
+
+    return calls, add2, is_odd
+
+
+def payloads(states):
+    return [state.payload for state in states]
+
+
+def batch(*payloads):
+    return [Data(i, payload) for (i, payload) in enumerate(payloads)]
+
+
+class Test_run_batch(unittest.TestCase):
+
+    PROGRAM_CLASS = m.Program
+
+    def program(self, program_spec):
+        return self.PROGRAM_CLASS(program_spec)
+
+    def test_results_are_in_input_order(self):
+        prog = self.program(
+            [
+            IF (odd),
+                add1,
+            ELSE,
+                IF (increase_if_odd),
+                ELSE,
+                    add1, add1,
+                ENDIF,
+            ENDIF,
+            RETURN_TRUE
+            ])
+
+        self.assertEqual(
+            [2, 4, 4, 6, 6], payloads(prog.run_batch(batch(1, 2, 3, 4, 5))))
+
+    def test_batch_instructions_are_run_once_per_batch(self):
+        calls, add2, is_odd = batch_functions()
+        prog = self.program([is_odd, add2, RETURN_TRUE])
+
+        prog.run_batch(batch(1, 2, 3))
+
+        self.assertEqual([[1, 2, 3], [1, 2, 3]], calls.batches)
+
+    def test_branches_partition_the_batch(self):
+        calls, add2, is_odd = batch_functions()
+        prog = self.program(
+            [
+            IF (is_odd),
+                add2,
+            ELSE,
+                add1,
+            ENDIF,
+            add2,
+            RETURN_TRUE
+            ])
+
+        results = prog.run_batch(batch(1, 2, 3, 4))
+
+        self.assertEqual([5, 5, 7, 7], payloads(results))
+        # is_odd, add2 on the odd ones, add2 after the join
+        self.assertEqual([[1, 2, 3, 4], [1, 3], [3, 3, 5, 5]], calls.batches)
+
+    def test_subprograms_are_run_on_the_selection(self):
+        calls, add2, is_odd = batch_functions()
+        prog = self.program(
+            [
+            IF ('odd?'),
+                'add2',
+            ENDIF,
+            RETURN_TRUE,
+
+            DEF ('odd?'),
+                IF (is_odd),
+                    RETURN_TRUE,
+                ENDIF,
+                RETURN_FALSE,
+
+            DEF ('add2'),
+                add2,
+                RETURN_TRUE,
+            ])
+
+        self.assertEqual(
+            [3, 2, 5, 4], payloads(prog.run_batch(batch(1, 2, 3, 4))))
+        self.assertEqual([[1, 2, 3, 4], [1, 3]], calls.batches)
+
+    def test_exit_statuses(self):
+        prog = self.program(
+            [
+            IF (odd),
+                RETURN_TRUE,
+            ENDIF,
+            RETURN_FALSE
+            ])
+
+        prog.run_batch(batch(1, 2, 3))
+
+        self.assertEqual([True, False, True], prog.runner.exit_statuses)
+
+    def test_empty_batch(self):
+        calls, add2, is_odd = batch_functions()
+        prog = self.program([add2, RETURN_TRUE])
+
+        self.assertEqual([], prog.run_batch([]))
+        self.assertEqual([], calls.batches)
+
+    def test_dispatch(self):
+        class Program(self.PROGRAM_CLASS):
+            optimizers = (tarr.optimizer.Dispatcher(),)
+
+        prog = Program(
+            [
+            IF (FieldEquals('n', 1)),
+                tarr.tests.test_compiler.const_odd,
+            ELIF (FieldEquals('n', 2)),
+                tarr.tests.test_compiler.const_even,
+            ELIF (FieldEquals('n', 3)),
+                tarr.tests.test_compiler.const_odd,
+            ENDIF,
+            RETURN_TRUE
+            ])
+
+        results = prog.run_batch(batch(dict(n=3), dict(n=2), dict(n=4)))
+
+        self.assertEqual(['odd', 'even', dict(n=4)], payloads(results))
+
+
+class Test_batch_decorators(unittest.TestCase):
+
+    def test_work_with_other_runners(self):
+        calls, add2, is_odd = batch_functions()
+        prog = tarr.compiler.Program(
+            [
+            IF (is_odd),
+                add2,
+            ENDIF,
+            RETURN_TRUE
+            ])
+
+        self.assertEqual([3, 2], payloads(prog.run_batch(batch(1, 2))))
+        self.assertEqual([[1], [1], [2]], calls.batches)
+
+
+class Test_make_column(unittest.TestCase):
+
+    def test_column(self):
+        column = m.make_column([1, 2, 3])
+
+        self.assertEqual([1, 2, 3], list(column))
+
+    @unittest.skipIf(m.numpy is None, 'requires NumPy')
+    def test_numpy_column(self):
+        column = m.make_column([1, 2, 3])
+
+        self.assertEqual([False, True, False], list(column % 2 == 0))
+
+    @unittest.skipIf(m.numpy is None, 'requires NumPy')
+    def test_numpy_column_of_sequences(self):
+        column = m.make_column([(1, 2), (3, 4)])
+
+        self.assertEqual((2,), column.shape)
+        self.assertEqual((3, 4), column[1])
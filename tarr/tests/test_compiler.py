@@ -1,5 +1,11 @@
+import itertools
+import os.path
+import pickle
 import unittest
+import mock
+import tempdir
 import tarr.compiler as m
+import tarr.histogram
 from tarr.data import Data
 import tarr.tests.test_compiler_base
 
@@ -61,20 +67,32 @@ END # su"bprogram''')
 
 TEST_TO_TEXT_WITH_STATISTICS = (
 '''   0 CALL "su"bprogram"    (*3)
+       # latency: p50=5.1us p90=7.0us p99=7.0us max=7.0us
        # True  -> 1   (*2)
        # False -> 1   (*1)
    1 RETURN True   (*3)
+       # latency: p50=1.0us p90=1.0us p99=1.0us max=1.0us
 END OF MAIN PROGRAM
 
 DEF ("su"bprogram")
+       # latency: p50=5.1us p90=7.0us p99=7.0us max=7.0us
    2 odd
+       # latency: p50=1.0us p90=1.0us p99=1.0us max=1.0us
        # True  -> 3   (*1)
        # False -> 5   (*2)
    3 add1
+       # latency: p50=1.0us p90=1.0us p99=1.0us max=1.0us
    4 RETURN False   (*1)
+       # latency: p50=1.0us p90=1.0us p99=1.0us max=1.0us
    5 RETURN True   (*2)
+       # latency: p50=1.0us p90=1.0us p99=1.0us max=1.0us
 END # su"bprogram''')
 
+# run times are not measured
+TEST_TO_TEXT_WITH_COUNTS = '\n'.join(
+    line for line in TEST_TO_TEXT_WITH_STATISTICS.splitlines()
+    if '# latency:' not in line)
+
 TEST_TO_DOT_WITHOUT_STATISTICS = (
 r'''digraph {
 
@@ -144,6 +162,111 @@ class Test_Program(tarr.tests.test_compiler_base.Test_Program):
     PROGRAM_CLASS = m.Program
 
 
+class Test_Runner_call_stack(
+        tarr.tests.test_compiler_base.Test_Runner_call_stack):
+
+    PROGRAM_CLASS = m.Program
+
+
+class CountingProgram(m.Program):
+
+    statistics_level = m.STATISTICS_COUNTS
+
+
+class SampledProgram(m.Program):
+
+    statistics_level = m.STATISTICS_SAMPLED
+    timing_interval = 3
+
+
+class NoStatisticsProgram(m.Program):
+
+    statistics_level = m.STATISTICS_OFF
+
+
+class Test_Program_counting(Test_Program):
+
+    PROGRAM_CLASS = CountingProgram
+
+
+class Test_Program_sampled(Test_Program):
+
+    PROGRAM_CLASS = SampledProgram
+
+
+class Test_Program_without_statistics(Test_Program):
+
+    PROGRAM_CLASS = NoStatisticsProgram
+
+
+class Test_statistics_levels(unittest.TestCase):
+
+    spec = [
+        'x', add1, m.RETURN_TRUE,
+        m.DEF ('x'), add1, m.RETURN_FALSE]
+
+    def run_program(self, program_class, count):
+        prog = program_class(self.spec)
+        for i in range(count):
+            self.assertEqual(i + 2, prog.run(Data(i, i)).payload)
+        return prog
+
+    def counts(self, prog):
+        return [
+            (stat.item_count, stat.success_count, stat.failure_count)
+            for stat in prog.statistics]
+
+    def timed_counts(self, prog):
+        return [stat.timed_count for stat in prog.statistics]
+
+    def test_off(self):
+        prog = self.run_program(NoStatisticsProgram, 7)
+
+        self.assertEqual([(0, 0, 0)] * 5, self.counts(prog))
+        self.assertEqual([0] * 5, self.timed_counts(prog))
+
+    def test_counts(self):
+        prog = self.run_program(CountingProgram, 7)
+
+        self.assertEqual(
+            [(7, 0, 7), (7, 0, 7), (7, 7, 0), (7, 0, 7), (7, 0, 7)],
+            self.counts(prog))
+        self.assertEqual([0] * 5, self.timed_counts(prog))
+        self.assertEqual([0] * 5, [stat.run_time for stat in prog.statistics])
+
+    def test_sampled(self):
+        prog = self.run_program(SampledProgram, 7)
+
+        self.assertEqual(
+            self.counts(self.run_program(m.Program, 7)), self.counts(prog))
+        # items 0, 3 and 6 are timed
+        self.assertEqual([3] * 5, self.timed_counts(prog))
+        for stat in prog.statistics:
+            self.assertGreater(stat.run_time, 0)
+            self.assertAlmostEqual(
+                stat.run_time * 7 / 3.0, stat.estimated_run_time)
+
+    def test_full(self):
+        prog = self.run_program(m.Program, 7)
+
+        self.assertEqual([7] * 5, self.timed_counts(prog))
+        for stat in prog.statistics:
+            self.assertIsInstance(stat.run_time, (int, long))
+            self.assertEqual(stat.run_time, stat.estimated_run_time)
+
+    def test_unknown_level(self):
+        class Program(m.Program):
+            statistics_level = 'unknown'
+
+        with self.assertRaises(ValueError):
+            Program(self.spec)
+
+    def test_estimated_run_time_without_timing_is_0(self):
+        prog = self.run_program(CountingProgram, 1)
+
+        self.assertEqual(0, prog.statistics[0].estimated_run_time)
+
+
 class Test_Program_visualization(unittest.TestCase):
 
     visualized_program_spec = [
@@ -158,6 +281,8 @@ class Test_Program_visualization(unittest.TestCase):
         m.RETURN_TRUE
     ]
 
+    TO_TEXT_WITH_STATISTICS = TEST_TO_TEXT_WITH_STATISTICS
+
     def program(self):
         return m.Program(self.visualized_program_spec)
 
@@ -179,12 +304,14 @@ class Test_Program_visualization(unittest.TestCase):
     def test_to_text_with_statistics(self):
         prog = self.program()
 
-        prog.run(Data(id, 1))
-        prog.run(Data(id, 2))
-        prog.run(Data(id, 2))
+        # every reading of the clock is 1us later
+        with mock.patch.object(m, 'now_ns', itertools.count(0, 1000).next):
+            prog.run(Data(id, 1))
+            prog.run(Data(id, 2))
+            prog.run(Data(id, 2))
         text = prog.to_text(with_statistics=True)
 
-        self.assertEqualText(TEST_TO_TEXT_WITH_STATISTICS, text)
+        self.assertEqualText(self.TO_TEXT_WITH_STATISTICS, text)
 
     def test_to_dot_without_statistics(self):
         prog = self.program()
@@ -204,6 +331,111 @@ class Test_Program_visualization(unittest.TestCase):
         self.assertEqualText(TEST_TO_DOT_WITH_STATISTICS, text)
 
 
+class Test_Program_visualization_counting(Test_Program_visualization):
+
+    TO_TEXT_WITH_STATISTICS = TEST_TO_TEXT_WITH_COUNTS
+
+    def program(self):
+        return CountingProgram(self.visualized_program_spec)
+
+
+class Test_Program_heat_map(unittest.TestCase):
+
+    def program(self, program_class=m.Program):
+        prog = program_class(
+            Test_Program_visualization.visualized_program_spec)
+        # every clock read advances the clock by 1us
+        with mock.patch.object(m, 'now_ns', itertools.count(0, 1000).next):
+            for value in (1, 2, 2):
+                prog.run(Data(id, value))
+        return prog
+
+    def lines(self, text):
+        return [line.strip() for line in text.splitlines()]
+
+    def test_nodes_are_coloured_by_run_time_share(self):
+        lines = self.lines(self.program().to_heat_map_dot())
+
+        # total time of non-CALL instructions: 10us, odd: 3us
+        self.assertIn(
+            'node_2 [label="odd\\n30.0%",style=filled,'
+            'fillcolor="0.000 1.000 1.000",fontsize=30];', lines)
+        self.assertIn(
+            'node_3 [label="add1\\n10.0%",style=filled,'
+            'fillcolor="0.000 0.333 1.000",fontsize=17];', lines)
+
+    def test_call_share_includes_the_subprogram(self):
+        text = self.program().to_heat_map_dot()
+
+        self.assertIn(
+            'node_0 [label="CALL su\\"bprogram\\n70.0% incl.",'
+            'style=filled,fillcolor="0.000 1.000 1.000"', text)
+
+    def test_call_share_is_divided_among_the_calls(self):
+        prog = CountingProgram(
+            [
+            'sub', 'sub', 'outer', m.RETURN_TRUE,
+            m.DEF ('outer'), 'sub', m.RETURN_TRUE,
+            m.DEF ('sub'), add1, m.RETURN_TRUE,
+            ])
+        prog.run(Data(id, 1))
+        lines = self.lines(prog.to_heat_map_dot())
+
+        shares = [
+            line.split('\\n')[1].split('"')[0]
+            for line in lines if 'CALL' in line and '[label=' in line]
+        # 8 items run by non-CALL instructions, 2 by each run of sub
+        self.assertEqual(
+            ['25.0% incl.', '25.0% incl.', '37.5% incl.', '25.0% incl.'],
+            shares)
+
+    def test_edges_are_weighted_by_count(self):
+        lines = self.lines(self.program().to_heat_map_dot())
+
+        self.assertIn('node_2 -> node_3 [label="1",penwidth=3.3];', lines)
+        self.assertIn('node_2 -> node_5 [label="2",penwidth=5.7];', lines)
+        self.assertIn('node_0 -> node_2 [label="3",penwidth=8.0];', lines)
+
+    def test_shares_of_item_counts_without_run_times(self):
+        lines = self.lines(self.program(CountingProgram).to_heat_map_dot())
+
+        # 10 items run by non-CALL instructions, 3 by odd
+        self.assertIn(
+            'node_2 [label="odd\\n30.0%",style=filled,'
+            'fillcolor="0.000 1.000 1.000",fontsize=30];', lines)
+
+    def test_cold_subprogram_is_collapsed(self):
+        text = self.program().to_heat_map_dot(cold_threshold=0.8)
+
+        self.assertIn(
+            'collapsed_2 [label="DEF su\\"bprogram\\n70.0% (collapsed)",',
+            text)
+        self.assertIn(
+            'node_0 -> collapsed_2 [label="3",penwidth=8.0];', text)
+        self.assertNotIn('node_3', text)
+        self.assertNotIn('cluster_su', text)
+        self.assertIn('node_1 [label="RETURN True', text)
+
+    def test_hot_subprogram_is_not_collapsed(self):
+        text = self.program().to_heat_map_dot(cold_threshold=0.5)
+
+        self.assertNotIn('collapsed', text)
+        self.assertIn('node_3', text)
+
+    def test_saved_statistics(self):
+        prog = self.program()
+
+        with tempdir.TempDir() as d:
+            filename = os.path.join(d.name, 'statistics')
+            prog.save_statistics(filename)
+            statistics = m.load_statistics(filename)
+
+        self.assertEqual(
+            list(prog.statistics.item_count), list(statistics.item_count))
+        self.assertEqual(
+            list(prog.statistics.run_time), list(statistics.run_time))
+
+
 class Test_Program_statistics(unittest.TestCase):
 
     def prog(self, condition=None):
@@ -217,11 +449,12 @@ class Test_Program_statistics(unittest.TestCase):
         prog.runner.ensure_statistics(1)
         return prog
 
-    def test_statistics_created(self):
+    def test_statistics_are_preallocated(self):
         prog = m.Program([Noop, m.RETURN_TRUE, Noop, Noop, m.RETURN_TRUE])
-        prog.run(None)
 
-        self.assertEqual(2, len(prog.statistics))
+        self.assertEqual(5, len(prog.statistics))
+        self.assertEqual(
+            range(5), [stat.index for stat in prog.statistics])
 
     COUNT_SENTINEL = -98
 
@@ -267,6 +500,24 @@ class Test_Program_statistics(unittest.TestCase):
 
         self.assertLess(run_time2, run_time3)
 
+    def test_call_statistics_include_the_called_subprogram(self):
+        prog = m.Program(
+            [
+            'x', 'x', m.RETURN_TRUE,
+            m.DEF ('x'), Noop, m.RETURN_FALSE
+            ])
+
+        prog.run(None)
+
+        call_stat = prog.statistics[0]
+        self.assertEqual(1, call_stat.item_count)
+        self.assertEqual(0, call_stat.success_count)
+        self.assertEqual(1, call_stat.failure_count)
+        self.assertEqual(2, prog.statistics[3].item_count)
+        self.assertLessEqual(
+            prog.statistics[3].run_time + prog.statistics[4].run_time,
+            call_stat.run_time + prog.statistics[1].run_time)
+
     def die_prog(self):
         prog = m.Program([die, m.RETURN_TRUE])
         prog.runner.ensure_statistics(1)
@@ -316,7 +567,7 @@ class Test_Program_statistics(unittest.TestCase):
         self.assert_exception_raised_attribute_is_untouched('failure_count', 3)
 
     def test_on_exception_run_time_is_not_touched(self):
-        self.assert_exception_raised_attribute_is_untouched('run_time', '')
+        self.assert_exception_raised_attribute_is_untouched('run_time', 4)
 
     def test_on_exception_statistics_had_exception(self):
         prog = self.die_prog()
@@ -327,6 +578,176 @@ class Test_Program_statistics(unittest.TestCase):
         self.assertTrue(prog.statistics[0].had_exception)
 
 
+class Test_StatisticsStore(unittest.TestCase):
+
+    def prog(self, *values):
+        prog = m.Program([odd, m.RETURN_TRUE])
+        for value in values:
+            prog.run(Data(value, value))
+        return prog
+
+    def counters(self, statistics):
+        return [
+            (
+                stat.index, stat.item_count, stat.success_count,
+                stat.failure_count, stat.timed_count)
+            for stat in statistics]
+
+    def test_view_and_arrays_share_data(self):
+        store = m.StatisticsStore(3)
+
+        store[1].item_count += 5
+        store.failure_count[1] += 2
+
+        self.assertEqual([0, 5, 0], list(store.item_count))
+        self.assertEqual(2, store[1].failure_count)
+        self.assertEqual(1, store[-2].index)
+
+    def test_index_out_of_range(self):
+        with self.assertRaises(IndexError):
+            m.StatisticsStore(3)[3]
+
+    def test_slice_of_views(self):
+        self.assertEqual(
+            [1, 3], [stat.index for stat in m.StatisticsStore(5)[1:5:2]])
+
+    def test_extend_to_keeps_arrays(self):
+        store = m.StatisticsStore(1)
+        item_count = store.item_count
+        store[0].item_count = 3
+
+        store.extend_to(4)
+
+        self.assertIs(item_count, store.item_count)
+        self.assertEqual([3, 0, 0, 0], list(store.item_count))
+        self.assertEqual(4, len(store.latency))
+
+    def test_add_run_time(self):
+        store = m.StatisticsStore(2)
+
+        store.add_run_time(1, 300)
+        store[1].add_run_time(500)
+
+        self.assertEqual(800, store[1].run_time)
+        self.assertEqual(2, store[1].timed_count)
+        self.assertEqual(2, store[1].latency.count)
+
+    def test_snapshot_is_a_copy(self):
+        prog = self.prog(1, 2, 3)
+
+        snapshot = prog.statistics.snapshot()
+        prog.run(Data(4, 4))
+
+        self.assertEqual(
+            self.counters(self.prog(1, 2, 3).statistics),
+            self.counters(snapshot))
+        self.assertEqual(3, snapshot[0].latency.count)
+        self.assertEqual(4, prog.statistics[0].latency.count)
+
+    def test_snapshot_copies_latency_arrays(self):
+        prog = self.prog(1, 2, 3)
+
+        snapshot = prog.statistics.snapshot()
+        counts = snapshot[0].latency.counts
+        prog.run(Data(4, 4))
+
+        self.assertEqual(3, sum(counts))
+        self.assertEqual(counts, snapshot[0].latency.counts)
+        self.assertNotEqual(counts, prog.statistics[0].latency.counts)
+
+    def test_latency_counts_are_allocated_on_first_run_time(self):
+        store = m.StatisticsStore(2)
+        self.assertEqual({}, store.latency_counts)
+
+        store.add_run_time(1, 300)
+        store.extend_to(3)
+
+        self.assertEqual([1], store.latency_counts.keys())
+        self.assertEqual(
+            tarr.histogram.BUCKET_COUNT, len(store.latency_counts[1]))
+        self.assertEqual(300, store[1].latency.max)
+        self.assertEqual(0, store[2].latency.count)
+
+    def test_counts_only_store_allocates_no_histograms(self):
+        store = m.StatisticsStore(50000)
+        store.item_count[7] += 1
+        other = m.StatisticsStore(50000)
+        other.success_count[3] += 1
+
+        store.merge(other)
+        snapshot = store.snapshot()
+        copy = pickle.loads(pickle.dumps(store, 2))
+
+        for statistics in (store, snapshot, copy):
+            self.assertEqual({}, statistics.latency_counts)
+
+    def test_only_timed_instructions_have_histograms(self):
+        store = m.StatisticsStore(50000)
+        store.add_run_time(10, 300)
+        other = m.StatisticsStore(50000)
+        other.add_run_time(20, 500)
+
+        store.merge(other)
+        snapshot = store.snapshot()
+        copy = pickle.loads(pickle.dumps(store, 2))
+
+        for statistics in (store, snapshot, copy):
+            self.assertEqual(
+                [10, 20], sorted(statistics.latency_counts.keys()))
+        self.assertEqual(500, copy[20].latency.max)
+
+    def test_pickle(self):
+        prog = self.prog(1, 2, 3)
+
+        copy = pickle.loads(pickle.dumps(prog.statistics, 2))
+
+        self.assertEqual(
+            self.counters(prog.statistics), self.counters(copy))
+        self.assertEqual(
+            list(prog.statistics.run_time), list(copy.run_time))
+        self.assertEqual(
+            [stat.latency.counts for stat in prog.statistics],
+            [stat.latency.counts for stat in copy])
+
+    def test_pickled_counters_are_compact(self):
+        store = m.StatisticsStore(10000)
+
+        self.assertLess(
+            len(pickle.dumps(store, 2)),
+            10000 * len(m.COUNTERS) * store.item_count.itemsize + 50000)
+
+    def test_merge_statistics(self):
+        prog = self.prog(1, 2)
+        packed = m.pack_statistics(self.prog(3, 5, 6).statistics)
+
+        m.merge_statistics(prog.statistics, packed)
+
+        self.assertEqual(
+            self.counters(self.prog(1, 2, 3, 5, 6).statistics),
+            self.counters(prog.statistics))
+        self.assertEqual(5, prog.statistics[0].latency.count)
+
+    def test_merge_statistics_of_other_program_is_an_error(self):
+        packed = m.pack_statistics(m.Program([m.RETURN_TRUE]).statistics)
+
+        with self.assertRaises(ValueError):
+            m.merge_statistics(self.prog().statistics, packed)
+
+    def test_merge_instruction_statistic(self):
+        stat1, = m.make_statistics(1)
+        stat2, = m.make_statistics(1)
+        stat1.item_count, stat1.success_count = 2, 1
+        stat2.item_count, stat2.failure_count = 3, 3
+        stat2.add_run_time(5)
+
+        stat1.merge(stat2)
+
+        self.assertEqual(
+            [(0, 5, 1, 3, 1)], self.counters([stat1]))
+        self.assertEqual(5, stat1.run_time)
+        self.assertEqual(1, stat1.latency.count)
+
+
 class Test_decorators(unittest.TestCase):
 
     def assertEqualData(self, expected, actual):
@@ -366,6 +787,37 @@ class Test_decorators(unittest.TestCase):
         self.assertEqualData(Data(id, 0), prog.run(Data(id, 0)))
         self.assertEqualData(Data(id, 3), prog.run(Data(id, 1)))
 
+    def test_FieldEquals(self):
+        prog = m.Program([
+            m.IF (m.FieldEquals('n', 1)),
+                const_odd,
+            m.ELSE,
+                const_even,
+            m.ENDIF,
+            m.RETURN_TRUE])
+
+        self.assertEqualData(Data(id, 'odd'), prog.run(Data(id, dict(n=1))))
+        self.assertEqualData(Data(id, 'even'), prog.run(Data(id, dict(n=2))))
+
+    def test_FieldContainsKeyword(self):
+        prog = m.Program([
+            m.IF (m.FieldContainsKeyword('text', ['cat'])),
+                const_odd,
+            m.ENDIF,
+            m.RETURN_TRUE])
+
+        self.assertEqualData(
+            Data(id, 'odd'), prog.run(Data(id, dict(text='a cat'))))
+
+    def test_FieldInBucket(self):
+        prog = m.Program([
+            m.IF (m.FieldInBucket('n', [10], 1)),
+                const_odd,
+            m.ENDIF,
+            m.RETURN_TRUE])
+
+        self.assertEqualData(Data(id, 'odd'), prog.run(Data(id, dict(n=10))))
+
     def test_multiple_use_of_instructions(self):
         # program: convert an odd number to string 'odd',
         # an even number to 'even'
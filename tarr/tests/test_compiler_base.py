@@ -1,13 +1,15 @@
+import itertools
+import re
 import unittest
 import tarr.compiler_base as m
 from tarr.compiler_base import (
     Instruction, BranchingInstruction,
     RETURN_TRUE, RETURN_FALSE,
     DEF, IF, ELSE, ELIF, ENDIF,
-    IF_NOT, ELIF_NOT,
+    IF_NOT, ELIF_NOT, EXCLUSIVE_IF,
     DuplicateLabelError, UndefinedLabelError, BackwardReferenceError,
     FallOverOnDefineError, UnclosedProgramError, MissingEndIfError,
-    MultipleElseError, ElIfAfterElseError)
+    MultipleElseError, ElIfAfterElseError, CallDepthExceededError)
 
 
 class Div2(Instruction):
@@ -255,6 +257,82 @@ class Test_Compiler(unittest.TestCase):
         self.assertEqual([(label1, 4), (label2, 10)], c.labels_with_indices)
 
 
+class Test_Compiler_exclusive_ladders(unittest.TestCase):
+
+    def compile(self, program_spec):
+        c = m.Compiler()
+        c.compile(program_spec)
+        return c
+
+    def arms(self, ladder):
+        return [
+            (instruction.index, negated)
+            for (instruction, negated) in ladder.arms]
+
+    def test_ladder_is_recorded(self):
+        c = self.compile([
+            EXCLUSIVE_IF (Eq(1)),
+                Noop,
+            ELIF (Eq(2)),
+                Noop,
+            ELIF_NOT (Eq(3)),
+                Noop,
+            ELSE,
+                Const(4),
+            ENDIF,
+            RETURN_TRUE])
+
+        [ladder] = c.exclusive_ladders
+        self.assertEqual(
+            [(0, False), (2, False), (4, True)], self.arms(ladder))
+        self.assertIs(c.instructions[0], ladder.head)
+        self.assertIs(c.instructions[6], ladder.tail)
+
+    def test_tail_without_else_is_after_endif(self):
+        c = self.compile([
+            EXCLUSIVE_IF (Eq(1)),
+                Noop,
+            ELIF (Eq(2)),
+                Noop,
+            ENDIF,
+            RETURN_TRUE])
+
+        [ladder] = c.exclusive_ladders
+        self.assertIs(c.instructions[4], ladder.tail)
+
+    def test_IF_is_not_a_ladder(self):
+        c = self.compile([
+            IF (Eq(1)),
+                Noop,
+            ELIF (Eq(2)),
+                Noop,
+            ENDIF,
+            RETURN_TRUE])
+
+        self.assertEqual([], c.exclusive_ladders)
+
+    def test_nested_ladders(self):
+        c = self.compile([
+            EXCLUSIVE_IF (Eq(1)),
+                IF (Eq(2)),
+                    Noop,
+                ELIF (Eq(3)),
+                    Noop,
+                ENDIF,
+            ELIF (Eq(4)),
+                EXCLUSIVE_IF (Eq(5)),
+                    Noop,
+                ELIF (Eq(6)),
+                    Noop,
+                ENDIF,
+            ENDIF,
+            RETURN_TRUE])
+
+        inner, outer = c.exclusive_ladders
+        self.assertEqual([(0, False), (5, False)], self.arms(outer))
+        self.assertEqual([(6, False), (8, False)], self.arms(inner))
+
+
 class Test_Program(unittest.TestCase):
 
     PROGRAM_CLASS = m.Program
@@ -443,6 +521,25 @@ class Test_Program(unittest.TestCase):
         self.assertEqual('ELIF_NOT.', prog.run('not_variant'))
         self.assertEqual('ELSE.', prog.run('variant'))
 
+    def test_EXCLUSIVE_IF_ELIF_ELSE(self):
+        prog = self.program([
+            EXCLUSIVE_IF (Eq('value')),
+                Const('IF'),
+            ELIF (Eq('variant1')),
+                Const('ELIF1'),
+            ELIF_NOT (Eq('variant2')),
+                Const('ELIF_NOT'),
+            ELSE,
+                Const('ELSE'),
+            ENDIF,
+            Add('.'),
+            RETURN_TRUE])
+
+        self.assertEqual('IF.', prog.run('value'))
+        self.assertEqual('ELIF1.', prog.run('variant1'))
+        self.assertEqual('ELIF_NOT.', prog.run('unknown'))
+        self.assertEqual('ELSE.', prog.run('variant2'))
+
     def test_IF_NOT_ELSE(self):
         prog = self.program([
             IF_NOT (Eq('value')),
@@ -553,6 +650,56 @@ class Test_Program(unittest.TestCase):
         indices = [i.index for i in prog.instructions]
         self.assertEqual(range(len(prog.instructions)), indices)
 
+    def test_run_batch(self):
+        prog = self.program([IF (IsOdd), Add1, ENDIF, RETURN_TRUE])
+
+        self.assertEqual([2, 2, 4], prog.run_batch([1, 2, 3]))
+
+    def test_run_many(self):
+        prog = self.program(
+            [
+            IF (IsOdd),
+                Add1,
+                RETURN_TRUE,
+            ENDIF,
+            RETURN_FALSE])
+
+        self.assertEqual(
+            [(2, True), (2, False), (4, True)],
+            list(prog.run_many([1, 2, 3])))
+
+    def test_run_many_resets_exit_status(self):
+        statuses = []
+
+        class RecordExitStatus(Instruction):
+            def run(self, runner, state):
+                statuses.append(runner.exit_status)
+                return state
+
+        prog = self.program([RecordExitStatus(), RETURN_TRUE])
+
+        list(prog.run_many([1, 2]))
+
+        self.assertEqual([None, None], statuses)
+
+    def test_run_many_is_lazy(self):
+        prog = self.program([Add1, RETURN_TRUE])
+
+        results = prog.run_many(itertools.count())
+
+        self.assertEqual(
+            [(1, True), (2, True)], list(itertools.islice(results, 2)))
+
+    def test_run_many_exceptions(self):
+        prog = self.program([Div2, RETURN_TRUE])
+
+        self.assertEqual(
+            [(1, True), ('x', None), (2, True)],
+            list(prog.run_many([2, 'x', 4], exceptions=(TypeError,))))
+
+        with self.assertRaises(TypeError):
+            list(prog.run_many(['x']))
+
     def test_joining_into_a_closed_path_reopens_it(self):
         with self.assertRaises(UnclosedProgramError):
             self.program(
@@ -639,6 +786,142 @@ class Test_Program(unittest.TestCase):
             ], remembering_visitor.calls)
 
 
+def nested_calls_spec(depth):
+    spec = ['level0', RETURN_TRUE]
+    for i in range(depth):
+        spec.extend([DEF('level{}'.format(i)), 'level{}'.format(i + 1)])
+        spec.append(RETURN_TRUE)
+    spec.extend([DEF('level{}'.format(depth)), Add1, RETURN_FALSE])
+    return spec
+
+
+class Test_Runner_call_stack(unittest.TestCase):
+
+    PROGRAM_CLASS = m.Program
+
+    def program(self, program_spec):
+        return self.PROGRAM_CLASS(program_spec)
+
+    def test_call_depth_is_not_limited_by_python_recursion(self):
+        prog = self.program(nested_calls_spec(3000))
+        prog.runner.max_call_depth = 5000
+
+        self.assertEqual(1, prog.run(0))
+
+    def test_exceeding_max_call_depth_is_an_error(self):
+        prog = self.program(nested_calls_spec(10))
+        prog.runner.max_call_depth = 10
+
+        with self.assertRaises(CallDepthExceededError):
+            prog.run(0)
+
+    def test_max_call_depth_is_not_exceeded(self):
+        prog = self.program(nested_calls_spec(10))
+        prog.runner.max_call_depth = 11
+
+        self.assertEqual(1, prog.run(0))
+
+
+class Test_FieldEquals(unittest.TestCase):
+
+    def test_branches_on_field_value(self):
+        prog = m.Program(
+            [
+            IF (m.FieldEquals('kind', 'dog')),
+                RETURN_TRUE,
+            ENDIF,
+            RETURN_FALSE])
+
+        prog.run(dict(kind='dog'))
+        self.assertTrue(prog.runner.exit_status)
+        prog.run(dict(kind='cat'))
+        self.assertFalse(prog.runner.exit_status)
+
+    def test_clone(self):
+        instruction = m.FieldEquals('kind', 'dog').clone()
+
+        self.assertEqual('kind', instruction.field)
+        self.assertEqual('dog', instruction.value)
+
+    def test_instruction_name(self):
+        self.assertEqual(
+            "kind == 'dog'", m.FieldEquals('kind', 'dog').instruction_name)
+
+
+class Test_FieldSearch(unittest.TestCase):
+
+    def test_branches_on_pattern_found(self):
+        prog = m.Program(
+            [
+            IF (m.FieldSearch('text', 'dogs?')),
+                RETURN_TRUE,
+            ENDIF,
+            RETURN_FALSE])
+
+        prog.run(dict(text='hot dog'))
+        self.assertTrue(prog.runner.exit_status)
+        prog.run(dict(text='cat'))
+        self.assertFalse(prog.runner.exit_status)
+
+    def test_clone(self):
+        instruction = m.FieldSearch('text', 'DOG', re.IGNORECASE).clone()
+
+        self.assertEqual('text', instruction.field)
+        self.assertIsNotNone(instruction.regex.search('hot dog'))
+
+
+class Test_FieldContainsKeyword(unittest.TestCase):
+
+    def test_branches_on_keyword_found(self):
+        prog = m.Program(
+            [
+            IF (m.FieldContainsKeyword('text', ['dog', 'cat'])),
+                RETURN_TRUE,
+            ENDIF,
+            RETURN_FALSE])
+
+        prog.run(dict(text='hot dog'))
+        self.assertTrue(prog.runner.exit_status)
+        prog.run(dict(text='fish'))
+        self.assertFalse(prog.runner.exit_status)
+
+    def test_clones_share_the_automaton(self):
+        instruction = m.FieldContainsKeyword('text', ['dog'])
+
+        self.assertIs(instruction.automaton, instruction.clone().automaton)
+
+
+class Test_FieldInBucket(unittest.TestCase):
+
+    def bucket_program(self, bucket):
+        return m.Program(
+            [
+            IF (m.FieldInBucket('n', [100, 10], bucket)),
+                RETURN_TRUE,
+            ENDIF,
+            RETURN_FALSE])
+
+    def buckets(self, values):
+        programs = [self.bucket_program(bucket) for bucket in range(3)]
+        buckets = []
+        for value in values:
+            for (bucket, prog) in enumerate(programs):
+                prog.run(dict(n=value))
+                if prog.runner.exit_status:
+                    buckets.append(bucket)
+        return buckets
+
+    def test_buckets(self):
+        self.assertEqual(
+            [0, 1, 1, 2, 2], self.buckets([9, 10, 99, 100, 1000]))
+
+    def test_clone(self):
+        instruction = m.FieldInBucket('n', [100, 10], 1).clone()
+
+        self.assertEqual((10, 100), instruction.thresholds)
+        self.assertEqual(1, instruction.bucket)
+
+
 class RememberingVisitor(m.ProgramVisitor):
 
     calls = None
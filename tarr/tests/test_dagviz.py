@@ -0,0 +1,75 @@
+import os.path
+import unittest
+import tempdir
+
+import tarr.dagviz as m
+import tarr.compiler
+from tarr.compiler import RETURN_TRUE, DEF
+from tarr.data import Data
+from tarr.tests.test_compiler import add1
+
+
+# the program drawn by the tests
+TARR_PROGRAM = [
+    'hot',
+    'cold',
+    RETURN_TRUE,
+
+    DEF ('hot'),
+        add1,
+        add1,
+        add1,
+        RETURN_TRUE,
+
+    DEF ('cold'),
+        RETURN_TRUE]
+
+
+class Test_to_dot(unittest.TestCase):
+
+    def test_without_statistics(self):
+        self.assertEqual(
+            tarr.compiler.Program(TARR_PROGRAM).to_dot(),
+            m.to_dot(__name__))
+
+    def heat_map(self, cold_threshold):
+        prog = tarr.compiler.Program(TARR_PROGRAM)
+        for i in range(10):
+            prog.run(Data(i, i))
+
+        with tempdir.TempDir() as d:
+            filename = os.path.join(d.name, 'statistics')
+            prog.save_statistics(filename)
+            return m.to_dot(__name__, filename, cold_threshold)
+
+    def test_heat_map(self):
+        text = self.heat_map(cold_threshold=None)
+
+        self.assertIn('style=filled', text)
+        self.assertIn('[label="10",', text)
+        self.assertNotIn('collapsed', text)
+
+    def test_hot_subgraph(self):
+        # the cold subprogram runs 1 of the 4 instructions of the
+        # subprograms, so it takes much less than 50%
+        text = self.heat_map(cold_threshold=50)
+
+        self.assertIn('collapsed_7 [label="DEF cold', text)
+        self.assertIn('cluster_hot', text)
+
+
+class Test_parse_args(unittest.TestCase):
+
+    def test_module_only(self):
+        args = m.parse_args(['module'])
+
+        self.assertEqual('module', args.module)
+        self.assertIsNone(args.statistics)
+        self.assertIsNone(args.cold_threshold)
+
+    def test_statistics(self):
+        args = m.parse_args(
+            ['module', '--statistics', 'file', '--cold-threshold', '2.5'])
+
+        self.assertEqual('file', args.statistics)
+        self.assertEqual(2.5, args.cold_threshold)
@@ -0,0 +1,91 @@
+import unittest
+
+import tarr.data as m
+import tarr.columnar
+import tarr.compiler
+from tarr.compiler import RETURN_TRUE, IF, ENDIF
+from tarr.tests.test_compiler import add1, odd
+
+
+def batch(*payloads):
+    return m.DataBatch(range(len(payloads)), list(payloads))
+
+
+class Test_DataBatch(unittest.TestCase):
+
+    def test_rows_are_views(self):
+        data_batch = batch(u'a', u'b')
+
+        row = data_batch[1]
+        row.payload = u'B'
+
+        self.assertEqual((1, u'B'), (row.id, row.payload))
+        self.assertEqual([u'a', u'B'], data_batch.payloads)
+
+    def test_iter(self):
+        self.assertEqual(
+            [(0, u'a'), (1, u'b')],
+            [(row.id, row.payload) for row in batch(u'a', u'b')])
+
+    def test_scan_moves_a_single_view(self):
+        data_batch = batch(u'a', u'b')
+
+        rows = []
+        for row in data_batch.scan():
+            rows.append(row)
+            row.payload = row.payload.upper()
+            self.assertEqual(len(rows) - 1, row.id)
+
+        self.assertIs(rows[0], rows[1])
+        self.assertEqual([u'A', u'B'], data_batch.payloads)
+
+    def test_negative_index(self):
+        self.assertEqual(u'b', batch(u'a', u'b')[-1].payload)
+
+    def test_index_out_of_range(self):
+        with self.assertRaises(IndexError):
+            batch(u'a')[1]
+
+    def test_from_data(self):
+        data_batch = m.DataBatch.from_data(
+            [m.Data(u'id1', 1), m.Data(u'id2', 2)])
+
+        self.assertEqual(2, len(data_batch))
+        self.assertEqual([u'id1', u'id2'], data_batch.ids)
+        self.assertEqual([1, 2], data_batch.payloads)
+
+    def test_setitem_stores_data(self):
+        data_batch = batch(u'a', u'b')
+
+        data_batch[0] = m.Data(u'id', u'x')
+
+        self.assertEqual([u'id', 1], data_batch.ids)
+        self.assertEqual([u'x', u'b'], data_batch.payloads)
+
+    def test_rows_have_no_dict(self):
+        self.assertFalse(hasattr(batch(1)[0], '__dict__'))
+
+
+class Test_DataBatch_run(unittest.TestCase):
+
+    PROGRAM_CLASS = tarr.compiler.Program
+    SPEC = [IF (odd), add1, ENDIF, RETURN_TRUE]
+
+    def test_run_many(self):
+        data_batch = batch(1, 2, 3)
+
+        list(self.PROGRAM_CLASS(self.SPEC).run_many(data_batch))
+
+        self.assertEqual([2, 2, 4], data_batch.payloads)
+
+    def test_run_batch(self):
+        data_batch = batch(1, 2, 3)
+
+        self.PROGRAM_CLASS(self.SPEC).run_batch(data_batch)
+
+        self.assertEqual([2, 2, 4], data_batch.payloads)
+
+
+class Test_DataBatch_run_columnar(Test_DataBatch_run):
+
+    PROGRAM_CLASS = tarr.columnar.Program
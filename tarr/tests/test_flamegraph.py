@@ -0,0 +1,159 @@
+import itertools
+import json
+import unittest
+import mock
+
+import tarr.flamegraph as m
+from tarr.compiler import RETURN_TRUE, RETURN_FALSE, DEF, IF, ENDIF
+from tarr.data import Data
+import tarr.tests.test_compiler
+from tarr.tests.test_compiler import add1, odd, die, WellKnownException
+
+
+class Test_Program(tarr.tests.test_compiler.Test_Program):
+
+    PROGRAM_CLASS = m.Program
+
+
+class Test_Runner_call_stack(tarr.tests.test_compiler.Test_Runner_call_stack):
+
+    PROGRAM_CLASS = m.Program
+
+
+SPEC = [
+    'classify',
+    RETURN_TRUE,
+
+    DEF ('classify'),
+        IF (odd),
+            'normalize',
+        ENDIF,
+        RETURN_TRUE,
+
+    DEF ('normalize'),
+        add1,
+        RETURN_FALSE]
+
+
+def run(prog, *values):
+    # every call to now_ns advances the clock by 1us
+    clock = itertools.count(0, 1000)
+    with mock.patch.object(m, 'now_ns', clock.next):
+        for value in values:
+            try:
+                prog.run(Data(value, value))
+            except WellKnownException:
+                pass
+    return clock
+
+
+def folded(prog):
+    return dict(
+        line.rsplit(' ', 1) for line in prog.to_folded().splitlines())
+
+
+class Test_to_folded(unittest.TestCase):
+
+    def test_stacks(self):
+        prog = m.Program(SPEC)
+
+        run(prog, 0, 1)
+
+        times = folded(prog)
+        self.assertEqual(
+            ['main', 'main;classify', 'main;classify;normalize'],
+            sorted(times))
+        for time in times.values():
+            self.assertGreater(int(time), 0)
+
+    def test_only_the_running_stack_is_accounted(self):
+        prog = m.Program(SPEC)
+
+        run(prog, 0)
+
+        self.assertEqual(['main', 'main;classify'], sorted(folded(prog)))
+
+    def test_total_time_is_the_time_of_the_run(self):
+        prog = m.Program(SPEC)
+
+        clock = run(prog, 1)
+
+        # the first and last clock reads are by run
+        total_time = sum(int(time) for time in folded(prog).values())
+        self.assertEqual(next(clock) - 1000, total_time)
+
+    def test_stack_is_reset_after_exception(self):
+        prog = m.Program(['die', RETURN_TRUE, DEF ('die'), die, RETURN_TRUE])
+
+        run(prog, 1, 2)
+
+        self.assertEqual(['main', 'main;die'], sorted(folded(prog)))
+
+    def test_frame_separator_in_label_is_replaced(self):
+        prog = m.Program(['a;b', RETURN_TRUE, DEF ('a;b'), RETURN_TRUE])
+
+        run(prog, 1)
+
+        self.assertIn('main;a:b', folded(prog))
+
+
+class Test_to_chrome_trace(unittest.TestCase):
+
+    def events(self, prog):
+        return [
+            (event['ph'], event['name'])
+            for event in json.loads(prog.to_chrome_trace())['traceEvents']]
+
+    def test_events_of_an_item(self):
+        prog = m.Program(SPEC)
+
+        run(prog, 1)
+
+        self.assertEqual(
+            [
+                ('B', 'main'), ('B', 'classify'), ('B', 'normalize'),
+                ('E', 'normalize'), ('E', 'classify'), ('E', 'main')],
+            self.events(prog))
+
+    def test_timestamps_are_microseconds(self):
+        prog = m.Program(SPEC)
+
+        run(prog, 0)
+
+        trace = json.loads(prog.to_chrome_trace())
+        timestamps = [event['ts'] for event in trace['traceEvents']]
+        self.assertEqual(sorted(timestamps), timestamps)
+        self.assertEqual(
+            dict(item_number=0), trace['traceEvents'][0]['args'])
+        self.assertEqual(1.0, timestamps[1] - timestamps[0])
+
+    def test_every_trace_interval_th_item_is_traced(self):
+        class Program(m.Program):
+            trace_interval = 2
+
+        prog = Program(SPEC)
+
+        run(prog, 0, 0, 0, 0, 0)
+
+        self.assertEqual([('B', 'main'), ('B', 'classify')] * 3, [
+            event for event in self.events(prog) if event[0] == 'B'])
+
+    def test_max_traced_items(self):
+        class Program(m.Program):
+            trace_interval = 1
+            max_traced_items = 2
+
+        prog = Program(SPEC)
+
+        run(prog, 0, 0, 0)
+
+        self.assertEqual(2, self.events(prog).count(('B', 'main')))
+
+    def test_frames_are_closed_after_exception(self):
+        prog = m.Program(['die', RETURN_TRUE, DEF ('die'), die, RETURN_TRUE])
+
+        run(prog, 1)
+
+        self.assertEqual(
+            [('B', 'main'), ('B', 'die'), ('E', 'die'), ('E', 'main')],
+            self.events(prog))
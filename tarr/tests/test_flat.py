@@ -0,0 +1,107 @@
+import unittest
+import tarr.flat as m
+from tarr.data import Data
+import tarr.tests.test_compiler_base
+from tarr.tests.test_compiler import add1, odd, increase_if_odd
+from tarr.compiler import (
+    RETURN_TRUE, RETURN_FALSE, DEF, IF, ELSE, ENDIF)
+
+
+class Test_Program(tarr.tests.test_compiler_base.Test_Program):
+
+    # generic instructions are run through their .run() method
+
+    PROGRAM_CLASS = m.Program
+
+
+class Test_Runner_call_stack(
+        tarr.tests.test_compiler_base.Test_Runner_call_stack):
+
+    PROGRAM_CLASS = m.Program
+
+
+class Test_FlatRunner(unittest.TestCase):
+
+    def test_tables_have_an_entry_for_each_reachable_instruction(self):
+        prog = m.Program(['x', RETURN_TRUE, DEF('x'), add1, RETURN_FALSE])
+        runner = prog.runner
+
+        self.assertEqual(4, len(runner.opcodes))
+        self.assertEqual(4, len(runner.operands))
+        self.assertEqual(4, len(runner.on_yes))
+        self.assertEqual(4, len(runner.on_no))
+
+    def test_opcodes(self):
+        prog = m.Program(
+            [
+            IF (odd),
+                'x',
+            ENDIF,
+            RETURN_TRUE,
+
+            DEF ('x'),
+                IF (increase_if_odd),
+                    add1,
+                ENDIF,
+                RETURN_TRUE
+            ])
+        runner = prog.runner
+
+        opcodes = [
+            runner.opcodes[runner.slots[i]] for i in prog.instructions]
+        self.assertEqual(
+            [m.BRANCH, m.CALL, m.RETURN, m.BRANCH_RULE, m.RULE, m.RETURN],
+            opcodes)
+
+    def test_rule_branch_and_branch_rule(self):
+        prog = m.Program(
+            [
+            IF (odd),
+                add1,
+            ELSE,
+                IF (increase_if_odd),
+                ELSE,
+                    add1, add1,
+                ENDIF,
+            ENDIF,
+            RETURN_TRUE
+            ])
+
+        self.assertEqual(2, prog.run(Data(id, 1)).payload)
+        self.assertEqual(4, prog.run(Data(id, 2)).payload)
+
+    def test_exit_status_is_set_by_return_of_main_program(self):
+        prog = m.Program(
+            [
+            'odd?',
+            RETURN_FALSE,
+
+            DEF ('odd?'),
+                IF (odd),
+                    RETURN_TRUE,
+                ENDIF,
+                RETURN_FALSE,
+            ])
+
+        prog.run(Data(id, 1))
+        self.assertIs(False, prog.runner.exit_status)
+
+    def test_call_returns_to_branch_of_caller(self):
+        prog = m.Program(
+            [
+            IF ('odd?'),
+                add1,
+            ENDIF,
+            'odd?',
+            RETURN_TRUE,
+
+            DEF ('odd?'),
+                IF (odd),
+                    RETURN_TRUE,
+                ENDIF,
+                RETURN_FALSE,
+            ])
+
+        self.assertEqual(2, prog.run(Data(id, 1)).payload)
+        self.assertEqual(2, prog.run(Data(id, 2)).payload)
+        self.assertIs(True, prog.runner.exit_status)
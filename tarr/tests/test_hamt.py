@@ -0,0 +1,168 @@
+import cPickle
+import pickle
+import random
+import unittest
+import tarr.hamt as m
+
+
+class Key(object):
+
+    '''Key with a chosen hash'''
+
+    def __init__(self, name, hash):
+        self.name = name
+        self.hash = hash
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        return isinstance(other, Key) and self.name == other.name
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'Key({!r}, {})'.format(self.name, self.hash)
+
+
+class Test_PersistentMap(unittest.TestCase):
+
+    def assertMapEqual(self, expected_dict, pmap):
+        self.assertEqual(len(expected_dict), len(pmap))
+        self.assertEqual(len(pmap), len(pmap.items()))
+        self.assertEqual(expected_dict, dict(pmap.items()))
+        for (key, value) in expected_dict.iteritems():
+            self.assertIs(value, pmap[key])
+            self.assertIn(key, pmap)
+
+    def test_empty(self):
+        self.assertEqual(0, len(m.EMPTY))
+        self.assertEqual([], m.EMPTY.keys())
+        with self.assertRaises(KeyError):
+            m.EMPTY['a']
+
+    def test_set_does_not_change_the_original(self):
+        m1 = m.EMPTY.set('a', 1)
+        m2 = m1.set('a', 2).set('b', 3)
+
+        self.assertMapEqual(dict(a=1), m1)
+        self.assertMapEqual(dict(a=2, b=3), m2)
+
+    def test_remove_does_not_change_the_original(self):
+        m1 = m.PersistentMap(dict(a=1, b=2).items())
+        m2 = m1.remove('a')
+
+        self.assertMapEqual(dict(a=1, b=2), m1)
+        self.assertMapEqual(dict(b=2), m2)
+
+    def test_remove_missing_key_returns_the_same_map(self):
+        m1 = m.EMPTY.set('a', 1)
+
+        self.assertIs(m1, m1.remove('b'))
+
+    def test_set_same_value_returns_the_same_map(self):
+        value = object()
+        m1 = m.EMPTY.set('a', value)
+
+        self.assertIs(m1, m1.set('a', value))
+
+    def test_get(self):
+        m1 = m.EMPTY.set('a', 1)
+
+        self.assertEqual(1, m1.get('a'))
+        self.assertIsNone(m1.get('b'))
+        self.assertEqual(2, m1.get('b', 2))
+
+    def test_update(self):
+        m1 = m.EMPTY.set('a', 1)
+
+        self.assertMapEqual(
+            dict(a=3, b=2), m1.update([('b', 2), ('a', 3)]))
+
+    def test_colliding_keys(self):
+        keys = [Key(name, 42) for name in 'abc']
+        pmap = m.PersistentMap((key, key.name) for key in keys)
+
+        self.assertMapEqual(dict((key, key.name) for key in keys), pmap)
+        self.assertMapEqual(
+            dict((key, key.name) for key in keys[1:]), pmap.remove(keys[0]))
+        self.assertMapEqual(
+            dict([(keys[2], 'c')]), pmap.remove(keys[0]).remove(keys[1]))
+        with self.assertRaises(KeyError):
+            pmap[Key('d', 42)]
+
+    def test_colliding_and_other_keys(self):
+        colliding = [Key(name, 42) for name in 'ab']
+        # same lowest bits, then differing
+        other = Key('c', 42 + (1 << 20))
+        pmap = m.EMPTY
+        for key in colliding + [other]:
+            pmap = pmap.set(key, key.name)
+
+        self.assertMapEqual(
+            dict((key, key.name) for key in colliding + [other]), pmap)
+        self.assertMapEqual(
+            dict([(other, 'c')]),
+            pmap.remove(colliding[0]).remove(colliding[1]))
+
+    def test_hashes_differing_in_highest_bits(self):
+        keys = [Key('a', 1), Key('b', 1 + (1 << 31))]
+        pmap = m.PersistentMap((key, key.name) for key in keys)
+
+        self.assertMapEqual(dict((key, key.name) for key in keys), pmap)
+
+    def test_random_operations_match_dict(self):
+        rnd = random.Random(7)
+        expected = dict()
+        pmap = m.EMPTY
+        snapshots = []
+        for i in range(3000):
+            # keys collide, and small hashes share their low bits
+            name = rnd.randrange(500)
+            key = Key(name, name % 61)
+            if rnd.random() < 0.3:
+                expected.pop(key, None)
+                pmap = pmap.remove(key)
+            else:
+                expected[key] = i
+                pmap = pmap.set(key, i)
+            if i % 500 == 0:
+                snapshots.append((dict(expected), pmap))
+
+        self.assertMapEqual(expected, pmap)
+        for (snapshot, snapshot_map) in snapshots:
+            self.assertMapEqual(snapshot, snapshot_map)
+
+    def test_removing_all_keys(self):
+        keys = range(1000)
+        pmap = m.PersistentMap((key, key) for key in keys)
+
+        for key in keys:
+            pmap = pmap.remove(key)
+
+        self.assertEqual(0, len(pmap))
+        self.assertEqual([], pmap.items())
+
+
+def pickle_roundtrips(value):
+    for pickle_module in (pickle, cPickle):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            yield pickle_module.loads(pickle_module.dumps(value, protocol))
+
+
+class Test_pickle(unittest.TestCase):
+
+    def test_all_protocols(self):
+        pmap = m.PersistentMap((i, str(i)) for i in range(100))
+        pmap = pmap.set(Key('a', 1), 'a').set(Key('b', 1), 'b')
+
+        for copy in pickle_roundtrips(pmap):
+            self.assertEqual(dict(pmap.items()), dict(copy.items()))
+            self.assertEqual(102, len(copy))
+            self.assertEqual('b', copy[Key('b', 1)])
+
+    def test_empty(self):
+        for copy in pickle_roundtrips(m.EMPTY):
+            self.assertEqual(0, len(copy))
+            self.assertEqual(1, len(copy.set('a', 1)))
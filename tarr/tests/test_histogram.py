@@ -0,0 +1,115 @@
+import unittest
+import tarr.histogram as m
+
+
+def histogram(*values):
+    h = m.LatencyHistogram()
+    for value in values:
+        h.record(value)
+    return h
+
+
+class Test_buckets(unittest.TestCase):
+
+    def test_small_values_have_own_buckets(self):
+        for value in range(2 * m.SUB_BUCKETS):
+            self.assertEqual((value, value), m.bucket_bounds(value))
+            self.assertEqual(value, m.bucket_index(value))
+
+    def test_value_is_within_bounds_of_its_bucket(self):
+        for value in [16, 17, 100, 1000, 12345, 10 ** 6, 2 ** 48 - 1]:
+            low, high = m.bucket_bounds(m.bucket_index(value))
+            self.assertLessEqual(low, value)
+            self.assertLessEqual(value, high)
+
+    def test_relative_bucket_width(self):
+        for index in range(2 * m.SUB_BUCKETS, m.BUCKET_COUNT):
+            low, high = m.bucket_bounds(index)
+            self.assertLessEqual(high + 1 - low, low / m.SUB_BUCKETS)
+
+    def test_buckets_are_contiguous(self):
+        for index in range(1, m.BUCKET_COUNT):
+            self.assertEqual(
+                m.bucket_bounds(index - 1)[1] + 1, m.bucket_bounds(index)[0])
+
+    def test_large_values_are_in_last_bucket(self):
+        self.assertEqual(m.BUCKET_COUNT - 1, m.bucket_index(2 ** 60))
+
+
+class Test_LatencyHistogram(unittest.TestCase):
+
+    def test_empty(self):
+        h = histogram()
+
+        self.assertIsNone(h.percentile(50))
+        self.assertIsNone(h.summary())
+
+    def test_percentiles(self):
+        h = histogram(*([1000] * 90 + [5000] * 9 + [10 ** 6]))
+
+        self.assertEqual(100, h.count)
+        self.assertEqual(10 ** 6, h.max)
+        self.assertEqual(1023, h.percentile(50))
+        self.assertEqual(1023, h.percentile(90))
+        self.assertEqual(5119, h.percentile(99))
+        self.assertEqual(10 ** 6, h.percentile(100))
+
+    def test_percentile_is_at_most_max(self):
+        self.assertEqual(1000, histogram(1000).percentile(50))
+
+    def test_negative_values_are_counted_as_0(self):
+        h = histogram(-5, -1000)
+
+        self.assertEqual(2, h.count)
+        self.assertEqual(0, h.percentile(100))
+
+    def test_merge(self):
+        h1 = histogram(1000, 2000)
+        h2 = histogram(3000)
+
+        h1.merge(h2)
+        h1.merge(histogram())
+
+        self.assertEqual(3, h1.count)
+        self.assertEqual(3000, h1.max)
+        self.assertEqual(
+            histogram(1000, 2000, 3000).counts, h1.counts)
+
+    def test_merge_into_empty(self):
+        h = histogram()
+
+        h.merge(histogram(7))
+
+        self.assertEqual(histogram(7).counts, h.counts)
+
+    def test_pack_unpack(self):
+        h = histogram(3, 1000, 1000, 10 ** 6)
+
+        copy = m.LatencyHistogram.unpack(h.pack())
+
+        self.assertEqual(h.counts, copy.counts)
+        self.assertEqual(4, copy.count)
+        self.assertEqual(10 ** 6, copy.max)
+
+    def test_packed_form_has_only_used_buckets(self):
+        self.assertEqual(3, len(histogram(3, 1000, 1000, 10 ** 6).pack()[2]))
+
+    def test_pack_unpack_empty(self):
+        copy = m.LatencyHistogram.unpack(histogram().pack())
+
+        self.assertEqual(0, copy.count)
+        self.assertIsNone(copy.summary())
+
+    def test_summary(self):
+        self.assertEqual(
+            'p50=1.0us p90=1.0us p99=1.0us max=2.0ms',
+            histogram(*([1000] * 99 + [2 * 10 ** 6])).summary())
+
+
+class Test_format_duration(unittest.TestCase):
+
+    def test_units(self):
+        self.assertEqual('999ns', m.format_duration(999))
+        self.assertEqual('1.5us', m.format_duration(1500))
+        self.assertEqual('2.5ms', m.format_duration(2500000))
+        self.assertEqual('3.25s', m.format_duration(3250000000))
@@ -0,0 +1,219 @@
+import json
+import os.path
+import Queue
+import unittest
+import tempdir
+
+import tarr.metrics as m
+import tarr.batch
+import tarr.compiler
+from tarr.tests.test_batch import IncreaseOdd
+
+
+class Clock(object):
+
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Batch(object):
+
+    processed_count = 0
+
+    def get_statistics(self):
+        return None
+
+
+def statistics(*run_times):
+    store = tarr.compiler.StatisticsStore(len(run_times))
+    for (index, run_time) in enumerate(run_times):
+        if run_time:
+            store.item_count[index] += 1
+            store.add_run_time(index, run_time)
+    return store
+
+
+class Test_MetricsReporter(unittest.TestCase):
+
+    def reporter(self, *input_filenames, **kwargs):
+        reporter = m.MetricsReporter(
+            Queue.Queue(), 'out', input_filenames, ['first', 'second'],
+            **kwargs)
+        reporter.clock = Clock()
+        reporter.start_time = reporter.clock()
+        return reporter
+
+    def test_initial_snapshot(self):
+        snapshot = self.reporter('in0', 'in1').snapshot()
+
+        self.assertEqual(0, snapshot['item_count'])
+        self.assertEqual(0.0, snapshot['items_per_second'])
+        self.assertEqual(
+            dict(pending=2, running=0, done=0), snapshot['file_counts'])
+        self.assertEqual([], snapshot['workers'])
+        self.assertEqual([], snapshot['top_instructions'])
+
+    def test_throughput(self):
+        reporter = self.reporter('in0', 'in1', 'in2')
+        reporter.update(m.Progress(1, 'in0', 0, None, False))
+        reporter.clock.now += 10
+        reporter.update(m.Progress(1, 'in0', 100, None, True))
+        reporter.update(m.Progress(2, 'in1', 0, None, False))
+        reporter.clock.now += 5
+        reporter.update(m.Progress(2, 'in1', 20, None, False))
+
+        snapshot = reporter.snapshot()
+
+        self.assertEqual(120, snapshot['item_count'])
+        self.assertEqual(8.0, snapshot['items_per_second'])
+        self.assertEqual(
+            [
+                dict(
+                    worker=2, filename='in1', item_count=20,
+                    items_per_second=4.0)],
+            snapshot['workers'])
+        self.assertEqual(
+            dict(pending=1, running=1, done=1), snapshot['file_counts'])
+        self.assertEqual(
+            [
+                ('in0', 'done', 100, 10),
+                ('in1', 'running', 20, 5),
+                ('in2', 'pending', 0, None)],
+            [
+                (f['filename'], f['state'], f['item_count'],
+                 f['elapsed_seconds'])
+                for f in snapshot['files']])
+
+    def test_top_instructions_are_merged_from_all_files(self):
+        reporter = self.reporter('in0', 'in1', top=1)
+        reporter.update(m.Progress(1, 'in0', 1, statistics(300, 200), True))
+        reporter.update(m.Progress(1, 'in1', 1, statistics(0, 200), False))
+
+        [top] = reporter.snapshot()['top_instructions']
+
+        self.assertEqual(
+            dict(
+                index=1, name='second', item_count=2,
+                run_time_seconds=400e-9),
+            top)
+
+    def test_write_and_stop(self):
+        with tempdir.TempDir() as d:
+            prefix = os.path.join(d.name, 'out')
+            reporter = m.MetricsReporter(Queue.Queue(), prefix, ['in0'])
+            reporter.start()
+            reporter.queue.put(m.Progress(1, 'in0', 3, None, True))
+            reporter.stop()
+
+            with open(prefix + '.metrics.json') as f:
+                snapshot = json.load(f)
+            with open(prefix + '.metrics.prom') as f:
+                prometheus = f.read()
+
+        self.assertEqual(3, snapshot['item_count'])
+        self.assertIn('tarr_items_processed_total 3.0\n', prometheus)
+
+
+class Test_ProgressMonitor(unittest.TestCase):
+
+    def test_sends_progress_at_start_and_stop(self):
+        queue = Queue.Queue()
+        batch = Batch()
+
+        with m.ProgressMonitor(queue, batch, 'in0', interval=3600):
+            batch.processed_count = 5
+
+        first, last = queue.get_nowait(), queue.get_nowait()
+        self.assertTrue(queue.empty())
+        self.assertEqual((0, False), (first.item_count, first.done))
+        self.assertEqual((5, True), (last.item_count, last.done))
+        self.assertEqual('in0', last.filename)
+        self.assertEqual(os.getpid(), last.worker)
+
+    def test_sends_progress_periodically(self):
+        queue = Queue.Queue()
+
+        with m.ProgressMonitor(queue, Batch(), 'in0', interval=0.001):
+            queue.get(timeout=1)
+            queue.get(timeout=1)
+            progress = queue.get(timeout=1)
+
+        self.assertFalse(progress.done)
+
+
+class Test_to_prometheus(unittest.TestCase):
+
+    def test_format(self):
+        snapshot = dict(
+            item_count=120, items_per_second=8.0,
+            workers=[
+                dict(worker=2, filename='in1', items_per_second=4.0)],
+            file_counts=dict(pending=1, running=1, done=1),
+            files=[dict(filename='in1', state='running', item_count=20)],
+            top_instructions=[
+                dict(index=3, name='CALL "x"', run_time_seconds=0.5)])
+
+        text = m.to_prometheus(snapshot)
+
+        self.assertIn(
+            '# HELP tarr_items_processed_total Items processed.\n'
+            '# TYPE tarr_items_processed_total counter\n'
+            'tarr_items_processed_total 120.0\n', text)
+        self.assertIn(
+            'tarr_worker_items_per_second{worker="2",filename="in1"} 4.0\n',
+            text)
+        self.assertIn('tarr_files{state="done"} 1.0\n', text)
+        self.assertIn(
+            'tarr_file_items_processed{filename="in1",state="running"} 20.0',
+            text)
+        self.assertIn(
+            'tarr_instruction_run_time_seconds{index="3",name="CALL \\"x\\""}'
+            ' 0.5\n', text)
+
+    def test_label_values_are_escaped(self):
+        self.assertEqual(
+            'a\\\\b\\"c\\nd', m.escape_label_value('a\\b"c\nd'))
+
+
+class MonitoredIncreaseOdd(IncreaseOdd):
+
+    metrics_interval = 0.01
+
+
+class Test_batch_main_metrics(unittest.TestCase):
+
+    def test_final_metrics_of_multiple_inputs(self):
+        with tempdir.TempDir() as d:
+            input = os.path.join(d.name, 'input')
+            output = os.path.join(d.name, 'output')
+            for (i, values) in enumerate([[1, 2], [3], [4, 5, 6]]):
+                with open(input + str(i), 'w') as f:
+                    f.writelines('{}\n'.format(value) for value in values)
+
+            tarr.batch.main(MonitoredIncreaseOdd, [input, output])
+
+            with open(output + '.metrics.json') as f:
+                snapshot = json.load(f)
+
+        self.assertEqual(6, snapshot['item_count'])
+        self.assertEqual(
+            dict(pending=0, running=0, done=3), snapshot['file_counts'])
+        self.assertEqual(
+            [2, 1, 3], [file['item_count'] for file in snapshot['files']])
+        names = [i['name'] for i in snapshot['top_instructions']]
+        self.assertEqual(
+            sorted(['is_odd', 'add1', 'RETURN True']), sorted(names))
+
+    def test_no_metrics_by_default(self):
+        with tempdir.TempDir() as d:
+            input = os.path.join(d.name, 'input')
+            output = os.path.join(d.name, 'output')
+            with open(input, 'w') as f:
+                f.write('1\n')
+
+            tarr.batch.main(IncreaseOdd, [input, output])
+
+            self.assertFalse(os.path.exists(output + '.metrics.json'))
@@ -0,0 +1,545 @@
+import re
+import unittest
+import tarr.optimizer as m
+import tarr.compiler_base
+import tarr.compiler
+import tarr.flat
+import tarr.codegen
+from tarr.data import Data
+import tarr.tests.test_compiler_base
+from tarr.tests.test_compiler_base import Add1, IsOdd
+from tarr.tests.test_compiler import add1, odd, const_odd, const_even
+from tarr.compiler import (
+    RETURN_TRUE, RETURN_FALSE, DEF, IF, ELIF, ELSE, ENDIF,
+    FieldEquals, FieldSearch, FieldInBucket)
+
+
+class InliningProgram(tarr.compiler.Program):
+
+    optimizers = (m.Inliner(),)
+
+
+class Test_Program(tarr.tests.test_compiler_base.Test_Program):
+
+    PROGRAM_CLASS = InliningProgram
+
+
+class InliningFlatProgram(tarr.flat.Program):
+
+    optimizers = (m.Inliner(),)
+
+
+class Test_FlatProgram(tarr.tests.test_compiler_base.Test_Program):
+
+    PROGRAM_CLASS = InliningFlatProgram
+
+
+class InliningCodegenProgram(tarr.codegen.Program):
+
+    optimizers = (m.Inliner(),)
+
+
+class Test_CodegenProgram(tarr.tests.test_compiler_base.Test_Program):
+
+    PROGRAM_CLASS = InliningCodegenProgram
+
+
+def executed_instructions(program):
+    return m.reachable(program.entry_instruction)
+
+
+def executed_calls(program):
+    return [
+        i for i in executed_instructions(program)
+        if isinstance(i, tarr.compiler_base.Call)]
+
+
+class Test_Inliner(unittest.TestCase):
+
+    def program(self, program_spec, **inliner_args):
+        class Program(tarr.compiler.Program):
+            optimizers = (m.Inliner(**inliner_args),)
+        return Program(program_spec)
+
+    def test_single_use_subprogram_is_inlined(self):
+        prog = self.program(
+            [
+            IF ('odd?'),
+                add1,
+            ENDIF,
+            RETURN_TRUE,
+
+            DEF ('odd?'),
+                IF (odd),
+                    RETURN_TRUE,
+                ENDIF,
+                RETURN_FALSE,
+            ], max_size=0)
+
+        self.assertEqual([], executed_calls(prog))
+        self.assertEqual(2, prog.run(Data(id, 1)).payload)
+        self.assertEqual(2, prog.run(Data(id, 2)).payload)
+
+    def test_small_subprogram_is_inlined_at_all_calls(self):
+        prog = self.program(
+            [
+            'add2', 'add2', RETURN_TRUE,
+            DEF ('add2'), add1, add1, RETURN_TRUE,
+            ], max_size=3)
+
+        self.assertEqual([], executed_calls(prog))
+        self.assertEqual(4, prog.run(Data(id, 0)).payload)
+
+    def test_large_subprogram_used_multiple_times_is_called(self):
+        prog = self.program(
+            [
+            'add2', add1, 'add2', RETURN_TRUE,
+            DEF ('add2'), add1, add1, RETURN_TRUE,
+            ], max_size=2)
+
+        self.assertEqual(2, len(executed_calls(prog)))
+        self.assertEqual(5, prog.run(Data(id, 0)).payload)
+
+    def test_tail_call_is_a_jump(self):
+        prog = self.program(
+            [
+            add1,
+            IF ('odd?'),
+                RETURN_TRUE,
+            ELSE,
+                RETURN_FALSE,
+            ENDIF,
+
+            DEF ('odd?'),
+                IF (odd),
+                    RETURN_TRUE,
+                ENDIF,
+                RETURN_FALSE,
+            ], max_size=0)
+
+        # the inlined RETURNs would be InlinedReturns
+        self.assertEqual(
+            [],
+            [i for i in executed_instructions(prog)
+             if isinstance(i, m.InlinedReturn)])
+        self.assertEqual([], executed_calls(prog))
+
+        prog.run(Data(id, 0))
+        self.assertTrue(prog.runner.exit_status)
+        prog.run(Data(id, 1))
+        self.assertFalse(prog.runner.exit_status)
+
+    def test_inlined_return_sets_exit_status(self):
+        prog = self.program(
+            [
+            'odd?', RETURN_TRUE,
+
+            DEF ('odd?'),
+                IF (odd),
+                    RETURN_TRUE,
+                ENDIF,
+                RETURN_FALSE,
+            ])
+
+        prog.run(Data(id, 1))
+        self.assertTrue(prog.runner.exit_status)
+
+    def test_copies_keep_original_index(self):
+        prog = self.program(
+            [
+            'x', 'x', RETURN_TRUE,
+            DEF ('x'), add1, RETURN_TRUE,
+            ])
+
+        indices = sorted(i.index for i in executed_instructions(prog))
+
+        self.assertEqual([2, 3, 3, 4, 4], indices)
+
+    def test_original_structure_is_kept(self):
+        spec = [
+            'x', 'x', RETURN_TRUE,
+            DEF ('x'), add1, RETURN_TRUE,
+        ]
+
+        self.assertEqual(
+            tarr.compiler.Program(spec).to_text(),
+            self.program(spec).to_text())
+
+    def test_statistics_are_reported_on_source_instructions(self):
+        prog = self.program(
+            [
+            'x', 'x', RETURN_TRUE,
+            DEF ('x'), add1, RETURN_TRUE,
+            ])
+
+        prog.run(Data(id, 0))
+
+        self.assertEqual(2, prog.statistics[3].item_count)
+        self.assertEqual(2, prog.statistics[4].item_count)
+
+    def test_deeply_nested_calls_are_inlined(self):
+        prog = self.program(
+            tarr.tests.test_compiler_base.nested_calls_spec(3000))
+
+        self.assertEqual([], executed_calls(prog))
+        self.assertEqual(1, prog.run(0))
+
+    def test_generic_instructions_are_inlined(self):
+        prog = self.program(
+            [
+            IF ('odd?'),
+                Add1,
+            ENDIF,
+            RETURN_TRUE,
+
+            DEF ('odd?'),
+                IF (IsOdd),
+                    RETURN_TRUE,
+                ENDIF,
+                RETURN_FALSE,
+            ])
+
+        self.assertEqual(4, prog.run(3))
+        self.assertEqual(4, prog.run(4))
+
+
+def classifier_spec():
+    return [
+        IF (FieldEquals('object', 'dog')),
+            const_odd,
+        ELIF (FieldEquals('object', 'cat')),
+            add1,
+        ELIF (FieldEquals('object', 'cat')),
+            RETURN_FALSE,
+        ELIF (FieldEquals('object', 'tree')),
+            const_even,
+        ELSE,
+            RETURN_FALSE,
+        ENDIF,
+        RETURN_TRUE,
+    ]
+
+
+def const(value):
+    @tarr.compiler.rule
+    def const(any):
+        return value
+    return const
+
+
+def regex_classifier_spec():
+    return [
+        IF (FieldSearch('object', r'\bdogs?\b')),
+            const('dog'),
+        ELIF (FieldSearch('object', 'cat|kitten')),
+            const('cat'),
+        ELIF (FieldSearch('object', '^(fish)$')),
+            const('fish'),
+        ELIF (FieldSearch('object', 'TREE', re.IGNORECASE)),
+            const('tree'),
+        ELSE,
+            RETURN_FALSE,
+        ENDIF,
+        RETURN_TRUE,
+    ]
+
+
+THRESHOLDS = [10, 100, 1000]
+
+
+def bucket_spec():
+    return [
+        IF (FieldInBucket('object', THRESHOLDS, 3)),
+            const('huge'),
+        ELIF (FieldInBucket('object', THRESHOLDS, 0)),
+            const('small'),
+        ELIF (FieldInBucket('object', THRESHOLDS, 1)),
+            const('medium'),
+        ELIF (FieldInBucket('object', THRESHOLDS, 0)),
+            RETURN_FALSE,
+        ENDIF,
+        RETURN_TRUE,
+    ]
+
+
+def long_regex_spec(arm_count):
+    spec = [IF (FieldSearch('object', '^0$')), const(0)]
+    for i in range(1, arm_count):
+        pattern = '^({})$'.format(i)
+        spec.extend([ELIF (FieldSearch('object', pattern)), const(i)])
+    spec.extend([ENDIF, RETURN_TRUE])
+    return spec
+
+
+class DispatcherProgram(tarr.compiler.Program):
+
+    optimizers = (m.Dispatcher(),)
+
+
+class Test_Dispatcher(unittest.TestCase):
+
+    PROGRAM_CLASS = DispatcherProgram
+
+    def program(self, program_spec):
+        return self.PROGRAM_CLASS(program_spec)
+
+    def run_program(self, prog, what):
+        data = prog.run(Data(id, {'object': what}))
+        return data.payload, prog.runner.exit_status
+
+    def test_chain_is_replaced_by_dispatch(self):
+        prog = self.program(classifier_spec())
+
+        self.assertIsInstance(prog.entry_instruction, m.Dispatch)
+        self.assertEqual(
+            [],
+            [i for i in executed_instructions(prog)
+             if isinstance(i, tarr.compiler_base.FieldEquals)])
+
+    def test_arms(self):
+        prog = self.program(classifier_spec())
+
+        self.assertEqual(
+            ('odd', True), self.run_program(prog, 'dog'))
+        self.assertEqual('even', self.run_program(prog, 'tree')[0])
+        self.assertFalse(self.run_program(prog, 'fish')[1])
+
+    def test_first_matching_arm_wins(self):
+        prog = self.program(classifier_spec())
+
+        with self.assertRaises(TypeError):
+            # add1 on a dict
+            self.run_program(prog, 'cat')
+
+    def test_unhashable_key(self):
+        prog = self.program(classifier_spec())
+
+        self.assertFalse(self.run_program(prog, ['dog'])[1])
+
+    def test_short_chain_is_kept(self):
+        prog = self.program(
+            [
+            IF (FieldEquals('object', 'dog')),
+                RETURN_TRUE,
+            ELIF (FieldEquals('object', 'cat')),
+                RETURN_TRUE,
+            ENDIF,
+            RETURN_FALSE,
+            ])
+
+        self.assertIsInstance(
+            prog.entry_instruction, tarr.compiler.FieldEquals)
+        self.assertTrue(self.run_program(prog, 'cat')[1])
+
+    def test_chain_stops_at_other_field(self):
+        prog = self.program(
+            [
+            IF (FieldEquals('object', 'dog')),
+                RETURN_TRUE,
+            ELIF (FieldEquals('object', 'cat')),
+                RETURN_TRUE,
+            ELIF (FieldEquals('object', 'fish')),
+                RETURN_TRUE,
+            ELIF (FieldEquals('class', 'ANIMAL')),
+                RETURN_TRUE,
+            ENDIF,
+            RETURN_FALSE,
+            ])
+
+        self.assertEqual(3, len(prog.entry_instruction.arms))
+        prog.run(Data(id, {'object': 'bird', 'class': 'ANIMAL'}))
+        self.assertTrue(prog.runner.exit_status)
+
+    def test_regex_chain_is_replaced_by_dispatch(self):
+        prog = self.program(regex_classifier_spec())
+
+        self.assertIsInstance(prog.entry_instruction, m.RegexDispatch)
+        self.assertEqual(3, len(prog.entry_instruction.arms))
+
+    def test_regex_arms(self):
+        prog = self.program(regex_classifier_spec())
+
+        self.assertEqual(('dog', True), self.run_program(prog, 'big dogs'))
+        self.assertEqual('cat', self.run_program(prog, 'kitten')[0])
+        self.assertEqual('fish', self.run_program(prog, 'fish')[0])
+        self.assertEqual('tree', self.run_program(prog, 'a tree')[0])
+        self.assertFalse(self.run_program(prog, 'a fish')[1])
+
+    def test_first_matching_regex_arm_wins(self):
+        prog = self.program(regex_classifier_spec())
+
+        self.assertEqual('dog', self.run_program(prog, 'cat\nand dog')[0])
+
+    def test_long_regex_chain(self):
+        prog = self.program(long_regex_spec(150))
+
+        self.assertEqual(0, self.run_program(prog, '0')[0])
+        self.assertEqual(120, self.run_program(prog, '120')[0])
+        self.assertEqual(149, self.run_program(prog, '149')[0])
+
+    def test_bucket_chain_is_replaced_by_dispatch(self):
+        prog = self.program(bucket_spec())
+
+        self.assertIsInstance(prog.entry_instruction, m.BucketDispatch)
+
+    def test_bucket_arms(self):
+        prog = self.program(bucket_spec())
+
+        self.assertEqual('small', self.run_program(prog, 9)[0])
+        self.assertEqual('medium', self.run_program(prog, 10)[0])
+        self.assertEqual('huge', self.run_program(prog, 1000)[0])
+        self.assertEqual(
+            ({'object': 100}, True), self.run_program(prog, 100))
+
+    def test_bucket_arms_with_different_thresholds_are_not_joined(self):
+        arms = [FieldInBucket('object', [1, 2], 0)]
+
+        self.assertTrue(
+            m.BucketDispatch.can_join(
+                arms, FieldInBucket('object', [2, 1], 1)))
+        self.assertFalse(
+            m.BucketDispatch.can_join(
+                arms, FieldInBucket('object', [1, 3], 1)))
+
+
+class Test_Dispatcher_flat(Test_Dispatcher):
+
+    class PROGRAM_CLASS(tarr.flat.Program):
+        optimizers = (m.Dispatcher(),)
+
+
+class Test_Dispatcher_codegen(Test_Dispatcher):
+
+    class PROGRAM_CLASS(tarr.codegen.Program):
+        optimizers = (m.Dispatcher(),)
+
+
+class Test_Dispatcher_statistics(unittest.TestCase):
+
+    def counts(self, prog):
+        return [
+            (stat.item_count, stat.success_count, stat.failure_count)
+            for stat in prog.statistics[:7:2]]
+
+    def run_program(self, prog, *whats):
+        for what in whats:
+            prog.run(Data(id, {'object': what}))
+
+    def assert_statistics_are_reported_on_arms(self, prog):
+        self.run_program(prog, 'dog', 'tree', 'tree', 'fish')
+
+        self.assertEqual(
+            [(4, 1, 3), (3, 0, 3), (3, 0, 3), (3, 2, 1)],
+            self.counts(prog))
+
+    def test_statistics_are_reported_on_arms(self):
+        self.assert_statistics_are_reported_on_arms(
+            DispatcherProgram(classifier_spec()))
+
+    def test_generated_code_reports_statistics_on_arms(self):
+        class Program(tarr.codegen.Program):
+            optimizers = (m.Dispatcher(),)
+
+        self.assert_statistics_are_reported_on_arms(
+            Program(classifier_spec()))
+
+    def test_regex_statistics_are_reported_on_arms(self):
+        prog = DispatcherProgram(regex_classifier_spec())
+
+        self.run_program(prog, 'dog', 'cat', 'cat', 'fish')
+
+        self.assertEqual(
+            [(4, 1, 3), (3, 2, 1), (1, 1, 0), (0, 0, 0)],
+            self.counts(prog))
+
+    def test_statistics_are_the_same_as_without_dispatch(self):
+        prog = tarr.compiler.Program(classifier_spec())
+
+        self.assert_statistics_are_reported_on_arms(prog)
+
+    def test_sampled_dispatch_is_timed_on_sampled_items_only(self):
+        class Program(DispatcherProgram):
+            statistics_level = tarr.compiler.STATISTICS_SAMPLED
+            timing_interval = 100
+
+        prog = Program(classifier_spec())
+        dispatch = prog.entry_instruction
+        self.assertIsInstance(dispatch, m.Dispatch)
+
+        self.run_program(prog, *['tree'] * 1000)
+
+        self.assertEqual(1000, prog.statistics[dispatch.index].item_count)
+        self.assertEqual(10, prog.statistics[dispatch.index].timed_count)
+
+
+class Test_RegexDispatch(unittest.TestCase):
+
+    def test_arms_with_back_reference_are_not_joined(self):
+        self.assertFalse(
+            m.RegexDispatch.can_join([], FieldSearch('object', r'(a)\1')))
+        self.assertFalse(
+            m.RegexDispatch.can_join(
+                [], FieldSearch('object', r'(?P<a>a)(?P=a)')))
+
+    def test_arms_with_different_flags_are_not_joined(self):
+        arms = [FieldSearch('object', 'a')]
+
+        self.assertTrue(
+            m.RegexDispatch.can_join(arms, FieldSearch('object', 'b')))
+        self.assertFalse(
+            m.RegexDispatch.can_join(
+                arms, FieldSearch('object', 'b', re.IGNORECASE)))
+        self.assertFalse(
+            m.RegexDispatch.can_join(arms, FieldSearch('object', '(?i)b')))
+
+    def test_arms_on_different_fields_are_not_joined(self):
+        arms = [FieldSearch('object', 'a')]
+
+        self.assertFalse(
+            m.RegexDispatch.can_join(arms, FieldSearch('class', 'b')))
+
+    def test_arms_with_same_group_name_are_not_joined(self):
+        arms = [FieldSearch('object', r'(?P<n>\d+)x')]
+
+        self.assertFalse(
+            m.RegexDispatch.can_join(
+                arms, FieldSearch('object', r'(?P<n>\d+)y')))
+        self.assertTrue(
+            m.RegexDispatch.can_join(
+                arms, FieldSearch('object', r'(?P<m>\d+)y')))
+        self.assertFalse(
+            m.RegexDispatch.can_join(
+                [], FieldSearch('object', r'(?P<tarr_arm1>a)')))
+
+    def test_chain_with_same_group_names(self):
+        prog = DispatcherProgram(
+            [
+            IF (FieldSearch('object', r'(?P<n>\d+)x')),
+                const('x'),
+            ELIF (FieldSearch('object', r'(?P<n>\d+)y')),
+                const('y'),
+            ELIF (FieldSearch('object', r'(?P<n>\d+)z')),
+                const('z'),
+            ENDIF,
+            RETURN_TRUE,
+            ])
+
+        self.assertEqual('y', prog.run(Data(id, {'object': '12y'})).payload)
+        self.assertEqual('z', prog.run(Data(id, {'object': '1z'})).payload)
+
+    def test_default_lookup_runs_the_arms_in_order(self):
+        dispatch = m.RegexDispatch(
+            [FieldSearch('object', 'a'), FieldSearch('object', 'b'),
+             FieldSearch('object', 'ab')])
+
+        for text in ('ab', 'b', 'c', 'xba'):
+            self.assertEqual(
+                dispatch.lookup(text), m.Dispatch.lookup(dispatch, text))
+
+    def test_group_limit(self):
+        arms = [FieldSearch('object', '(a)') for i in range(50)]
+
+        self.assertTrue(
+            m.RegexDispatch.can_join(arms[:-1], FieldSearch('object', 'a')))
+        self.assertFalse(
+            m.RegexDispatch.can_join(arms, FieldSearch('object', 'a')))
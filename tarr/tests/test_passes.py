@@ -0,0 +1,185 @@
+import unittest
+import tarr.passes as m
+import tarr.compiler_base
+from tarr.compiler_base import (
+    Program, RETURN_TRUE, RETURN_FALSE, DEF, IF, ELSE, ENDIF)
+from tarr.tests.test_compiler_base import Add1, Div2, IsOdd, Noop
+
+
+def program(program_spec, *passes):
+    class PassProgram(Program):
+        pass
+    PassProgram.passes = passes
+    return PassProgram(program_spec)
+
+
+class Test_PassManager(unittest.TestCase):
+
+    def test_split_join(self):
+        prog = Program(
+            [
+            Add1, RETURN_TRUE,
+            DEF('x'), RETURN_TRUE,
+            DEF('y'), Add1, RETURN_TRUE])
+        pass_manager = tarr.compiler_base.PassManager([])
+
+        sub_programs = pass_manager.split(
+            prog.instructions, prog.labels_with_indices)
+
+        self.assertEqual(
+            [None, 'x', 'y'], [sp.label for sp in sub_programs])
+        self.assertEqual(
+            (prog.instructions, prog.labels_with_indices),
+            pass_manager.join(sub_programs))
+
+    def test_instructions_are_renumbered(self):
+        class DropFirstSubprogram(object):
+            def run(self, sub_programs):
+                del sub_programs[1]
+
+        prog = program(
+            [
+            Add1, RETURN_TRUE,
+            DEF('x'), RETURN_TRUE,
+            DEF('y'), Add1, RETURN_TRUE],
+            DropFirstSubprogram())
+
+        self.assertEqual(
+            range(4), [i.index for i in prog.instructions])
+        self.assertEqual([('y', 2)], prog.labels_with_indices)
+
+
+class Test_RemoveUnreachable(unittest.TestCase):
+
+    def test_unused_subprograms_are_removed(self):
+        prog = program(
+            [
+            'used', RETURN_TRUE,
+            DEF('unused'), Add1, RETURN_TRUE,
+            DEF('used'), Add1, RETURN_TRUE],
+            m.RemoveUnreachable())
+
+        self.assertEqual([('used', 2)], prog.labels_with_indices)
+        self.assertEqual(4, len(prog.instructions))
+        self.assertEqual(1, prog.run(0))
+
+    def test_unreachable_instructions_are_removed(self):
+        prog = program(
+            [
+            'x', RETURN_TRUE,
+            DEF('x'),
+                IF (IsOdd),
+                    RETURN_TRUE,
+                ELSE,
+                    RETURN_FALSE,
+                ENDIF,
+                # never reached
+                Add1,
+                RETURN_TRUE],
+            m.RemoveUnreachable())
+
+        self.assertEqual(5, len(prog.instructions))
+
+
+class Test_ThreadJumps(unittest.TestCase):
+
+    def test_noops_are_removed(self):
+        prog = program(
+            [
+            Noop, 'x', Noop, RETURN_TRUE,
+            DEF('x'), Noop, Noop, Add1, RETURN_TRUE],
+            m.ThreadJumps())
+
+        self.assertEqual(4, len(prog.instructions))
+        self.assertEqual([('x', 2)], prog.labels_with_indices)
+        self.assertEqual(1, prog.run(0))
+
+    def test_branches_jump_over_noops(self):
+        prog = program(
+            [
+            IF (IsOdd),
+                Noop,
+            ELSE,
+                Div2,
+                Noop,
+            ENDIF,
+            Noop,
+            RETURN_TRUE],
+            m.ThreadJumps())
+
+        self.assertEqual(3, len(prog.instructions))
+        self.assertEqual(3, prog.run(3))
+        self.assertEqual(2, prog.run(4))
+
+
+class Test_MergeIdenticalSubprograms(unittest.TestCase):
+
+    def test_identical_subprograms_are_merged(self):
+        prog = program(
+            [
+            'a', 'b', RETURN_TRUE,
+            DEF('a'), Add1, RETURN_TRUE,
+            DEF('b'), Add1, RETURN_TRUE],
+            m.MergeIdenticalSubprograms())
+
+        self.assertEqual([('b', 3)], prog.labels_with_indices)
+        self.assertEqual(
+            [prog.instructions[3]] * 2,
+            [i.start_instruction for i in prog.instructions[:2]])
+        self.assertEqual(2, prog.run(0))
+
+    def test_subprograms_calling_merged_subprograms_are_merged(self):
+        prog = program(
+            [
+            'a', 'b', RETURN_TRUE,
+            DEF('a'), 'c', RETURN_TRUE,
+            DEF('b'), 'd', RETURN_TRUE,
+            DEF('c'), Add1, RETURN_TRUE,
+            DEF('d'), Add1, RETURN_TRUE],
+            m.MergeIdenticalSubprograms())
+
+        self.assertEqual(
+            [('b', 3), ('d', 5)], prog.labels_with_indices)
+        self.assertEqual(2, prog.run(0))
+
+    def test_different_subprograms_are_kept(self):
+        prog = program(
+            [
+            'a', 'b', RETURN_TRUE,
+            DEF('a'), Add1, RETURN_TRUE,
+            DEF('b'), Add1, RETURN_FALSE],
+            m.MergeIdenticalSubprograms())
+
+        self.assertEqual([('a', 3), ('b', 5)], prog.labels_with_indices)
+
+
+class Test_STANDARD_PASSES(unittest.TestCase):
+
+    def test_program_works(self):
+        prog = program(
+            [
+            IF ('odd?'),
+                Noop,
+                'inc',
+            ELSE,
+                'inc2',
+            ENDIF,
+            RETURN_TRUE,
+
+            DEF ('odd?'),
+                IF (IsOdd),
+                    RETURN_TRUE,
+                ELSE,
+                    RETURN_FALSE,
+                ENDIF,
+
+            DEF ('unused'), Add1, RETURN_TRUE,
+            DEF ('inc2'), Noop, 'inc', RETURN_TRUE,
+            DEF ('inc'), Add1, RETURN_TRUE,
+            ], *m.STANDARD_PASSES)
+
+        self.assertEqual(
+            ['odd?', 'inc2', 'inc'],
+            [label for (label, index) in prog.labels_with_indices])
+        self.assertEqual(4, prog.run(3))
+        self.assertEqual(5, prog.run(4))
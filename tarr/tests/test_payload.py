@@ -1,5 +1,9 @@
+import cPickle
+import pickle
 import unittest
+import mock
 import tarr.payload as m
+from tarr.data import Data
 
 
 class PayloadTests(object):
@@ -82,6 +86,32 @@ class Test_with_new_result(PayloadTestsWithExistingKey, unittest.TestCase):
             sorted(overwritten_payload.keys()))
 
 
+class Test_with_new_results(PayloadTests, unittest.TestCase):
+
+    KEYS = [u'a', u'b']
+
+    def setUp(self):
+        self.payload = (
+            m.new(self.INPUT)
+            .with_new_results(u'WNRS', {u'a': 1, u'b': 2}))
+
+    def test_keys(self):
+        self.assertEqual(self.KEYS, sorted(self.payload.keys()))
+
+    def test_values(self):
+        self.assertEqual((1, 2), (self.payload[u'a'], self.payload[u'b']))
+
+    def test_is_one_step(self):
+        self.assertEqual([u'WNRS', u'START'], self.payload.history())
+
+    def test_optional_parameter_new_input_sets_input(self):
+        payload = self.payload.with_new_results(
+            u'WNRS2', {u'a': 3}, new_input=u'NEW INPUT')
+
+        self.assertEqual(u'NEW INPUT', payload.input)
+        self.assertEqual((3, 2), (payload[u'a'], payload[u'b']))
+
+
 class Test_with_key_removed(PayloadTestsWithExistingKey, unittest.TestCase):
 
     def setUp(self):
@@ -107,3 +137,243 @@ class Test_new_input(PayloadTestsWithExistingKey, unittest.TestCase):
             m.new(OLD_INPUT)
             .with_new_result(u'WNR', self.EXISTING_KEY, self.EXISTING_VALUE)
             .with_new_input(u'WNI', self.INPUT))
+
+
+class Test_long_history(unittest.TestCase):
+
+    def test_many_transformations(self):
+        payload = m.new(u'input')
+        for i in range(5000):
+            payload = payload.with_new_result(u'add', i % 100, i)
+            payload = payload.with_new_input(u'input', i)
+            if i % 7 == 0:
+                payload = payload.with_key_removed(u'remove', (i + 1) % 100)
+
+        # no recursion
+        self.assertEqual(4999, payload[99])
+        self.assertEqual(4999, payload.input)
+        self.assertEqual(100, len(set(payload.keys())))
+        with self.assertRaises(KeyError):
+            payload[100]
+
+    def test_removed_key(self):
+        payload = (
+            m.new(u'input')
+            .with_new_result(u'add', u'key', 1)
+            .with_key_removed(u'remove', u'key'))
+
+        self.assertEqual([], list(payload.keys()))
+        with self.assertRaises(KeyError):
+            payload[u'key']
+        self.assertEqual(u'input', payload.input)
+
+    def test_parents_are_not_changed(self):
+        p1 = m.new(u'input').with_new_result(u'add', u'a', 1)
+        p2 = p1.with_new_result(u'add', u'a', 2).with_key_removed(u'rm', u'b')
+
+        self.assertEqual(1, p1[u'a'])
+        self.assertEqual(2, p2[u'a'])
+
+
+def transformed(history_limit=m.HISTORY_ALL):
+    return (
+        m.new(u'input', history_limit)
+        .with_new_result(u'add', u'key', 1)
+        .with_new_input(u'new input', u'input2')
+        .with_key_removed(u'remove', u'key'))
+
+
+class Test_history(unittest.TestCase):
+
+    def test_all(self):
+        payload = transformed()
+
+        self.assertEqual(
+            [u'remove', u'new input', u'add', u'START'], payload.history())
+        self.assertEqual(u'new input', payload.parent.transform_name)
+
+    def test_new(self):
+        self.assertEqual([u'START'], m.new(u'input').history())
+
+    def test_limited(self):
+        payload = transformed(history_limit=2)
+
+        self.assertEqual([u'remove', u'new input'], payload.history())
+        self.assertIsNone(payload.parent)
+
+    def test_limit_longer_than_history(self):
+        self.assertEqual(
+            [u'remove', u'new input', u'add', u'START'],
+            transformed(history_limit=10).history())
+
+    def test_no_history(self):
+        payload = transformed(history_limit=0)
+
+        self.assertEqual([], payload.history())
+        self.assertIsNone(payload.parent)
+        self.assertEqual(u'remove', payload.transform_name)
+
+    def test_results_do_not_depend_on_history(self):
+        payload = transformed(history_limit=0).with_new_result(u'a', 1, 2)
+
+        self.assertEqual(u'input2', payload.input)
+        self.assertEqual([1], list(payload.keys()))
+        self.assertEqual(2, payload[1])
+
+
+class Test_compact_nodes(unittest.TestCase):
+
+    def test_nodes_have_no_dict(self):
+        payload = m.new(u'input')
+        for node in (
+                payload,
+                payload.with_new_result(u'add', u'key', 1),
+                payload.with_new_input(u'new input', u'input2'),
+                payload.with_key_removed(u'remove', u'key')):
+            self.assertFalse(hasattr(node, '__dict__'), node)
+
+    def test_keys_and_transform_names_are_interned(self):
+        # equal, but not identical strings
+        key1, key2 = u''.join([u'k', u'ey']), u''.join([u'ke', u'y'])
+        name1, name2 = u''.join([u'n', u'ame']), u''.join([u'na', u'me'])
+        self.assertIsNot(key1, key2)
+
+        p1 = m.new(u'input').with_new_result(name1, key1, 1)
+        p2 = m.new(u'input').with_new_result(name2, key2, 2)
+
+        self.assertIs(p1.key, p2.key)
+        self.assertIs(list(p1.keys())[0], list(p2.keys())[0])
+        self.assertIs(p1.transform_name, p2.transform_name)
+
+    def test_removed_key_is_interned(self):
+        key = u''.join([u'k', u'ey'])
+
+        payload = m.new(u'input').with_key_removed(u'remove', key)
+
+        self.assertIs(m.interned(u'key'), payload.key_to_remove)
+
+    def test_number_of_interned_strings_is_limited(self):
+        with mock.patch.object(m, '_interned', dict()):
+            with mock.patch.object(m, 'MAX_INTERNED', 2):
+                first = m.interned(u''.join([u'fir', u'st']))
+                m.interned(u'second')
+                third = u''.join([u'thi', u'rd'])
+
+                self.assertIs(third, m.interned(third))
+                self.assertIsNot(third, m.interned(u'third'))
+                self.assertIs(first, m.interned(u'first'))
+                self.assertEqual(2, len(m._interned))
+
+    def test_interning_keeps_the_string_type(self):
+        with mock.patch.object(m, '_interned', dict()):
+            m.interned(u'key')
+
+            self.assertIsInstance(m.interned('key'), str)
+            self.assertIsInstance(m.interned(u'key'), unicode)
+            payload = m.new(u'input').with_new_result('name', 'key', 1)
+            self.assertIsInstance(payload.key, str)
+            self.assertIsInstance(payload.transform_name, str)
+
+    def test_non_string_keys_are_not_interned(self):
+        key = (1, 2)
+
+        self.assertIs(key, m.new(u'input').with_new_result(u'a', key, 1).key)
+
+
+class Test_compaction(unittest.TestCase):
+
+    def chain(self, length):
+        payload = m.new(u'input')
+        for i in range(length):
+            payload = payload.with_new_result(u't{}'.format(i), i, i)
+        return payload
+
+    def test_chain_is_compacted_after_COMPACTION_DEPTH(self):
+        with mock.patch.object(m, 'COMPACTION_DEPTH', 3):
+            payload = self.chain(4)
+
+        self.assertIsNone(payload.parent)
+        self.assertEqual(0, payload.depth)
+
+    def test_chain_is_not_compacted_before_COMPACTION_DEPTH(self):
+        with mock.patch.object(m, 'COMPACTION_DEPTH', 3):
+            payload = self.chain(3)
+
+        self.assertEqual(3, payload.depth)
+        self.assertEqual(u't1', payload.parent.transform_name)
+
+    def test_history_and_results_are_kept(self):
+        with mock.patch.object(m, 'COMPACTION_DEPTH', 3):
+            payload = self.chain(10)
+
+        self.assertEqual(
+            [u't{}'.format(i) for i in reversed(range(10))] + [u'START'],
+            payload.history())
+        self.assertEqual(range(10), sorted(payload.keys()))
+        self.assertEqual(9, payload[9])
+
+    def test_depth_is_bounded(self):
+        with mock.patch.object(m, 'COMPACTION_DEPTH', 3):
+            payload = self.chain(100)
+
+        depth = 0
+        while payload.parent is not None:
+            payload = payload.parent
+            depth += 1
+        self.assertLessEqual(depth, 3)
+
+    def test_limited_history_is_not_affected(self):
+        payload = m.new(u'input', history_limit=2)
+        for i in range(2 * m.COMPACTION_DEPTH):
+            payload = payload.with_new_input(u't{}'.format(i), i)
+
+        self.assertEqual(
+            [u't{}'.format(2 * m.COMPACTION_DEPTH - 1),
+             u't{}'.format(2 * m.COMPACTION_DEPTH - 2)],
+            payload.history())
+
+
+class Test_pickle(unittest.TestCase):
+
+    def roundtrips(self, value):
+        for pickle_module in (pickle, cPickle):
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+                yield pickle_module.loads(
+                    pickle_module.dumps(value, protocol))
+
+    def test_all_protocols(self):
+        payload = (
+            m.new(u'input')
+            .with_new_result(u'add', u'key', 1)
+            .with_new_results(u'add more', {u'key2': 2, u'key3': 3})
+            .with_key_removed(u'remove', u'key3')
+            .with_new_input(u'new input', u'input2'))
+
+        for copy in self.roundtrips(payload):
+            self.assertEqual(u'input2', copy.input)
+            self.assertEqual([u'key', u'key2'], sorted(copy.keys()))
+            self.assertEqual(payload.history(), copy.history())
+            with self.assertRaises(KeyError):
+                copy.parent[u'key3']
+
+    def test_limited_and_compacted_history(self):
+        payload = m.new(u'input', history_limit=2)
+        compacted = m.new(u'input')
+        for i in range(2 * m.COMPACTION_DEPTH):
+            payload = payload.with_new_input(u't{}'.format(i), i)
+            compacted = compacted.with_new_input(u't{}'.format(i), i)
+
+        for copy in self.roundtrips(payload):
+            self.assertEqual(payload.history(), copy.history())
+            self.assertEqual(
+                [u'next'] + payload.history()[:1],
+                copy.with_new_input(u'next', 0).history())
+        for copy in self.roundtrips(compacted):
+            self.assertEqual(compacted.history(), copy.history())
+
+    def test_data(self):
+        data = Data(u'id', m.new(u'input').with_new_result(u'add', u'key', 1))
+
+        for copy in self.roundtrips(data):
+            self.assertEqual(u'id', copy.id)
+            self.assertEqual(1, copy.payload[u'key'])
@@ -0,0 +1,247 @@
+import unittest
+import os.path
+import tempdir
+import tarr.profiling as m
+import tarr.compiler_base
+import tarr.compiler
+import tarr.tracing
+import tarr.codegen
+from tarr.compiler import (
+    RETURN_TRUE, RETURN_FALSE, DEF, IF, ELIF, ELIF_NOT, ELSE, ENDIF,
+    EXCLUSIVE_IF)
+from tarr.tests.test_compiler_base import Eq, Const, Add, IsOdd
+
+
+def ladder_spec():
+    return [
+        EXCLUSIVE_IF (Eq('a')),
+            Const('A'),
+        ELIF (Eq('b')),
+            Const('B'),
+        ELIF (Eq('c')),
+            Const('C'),
+        ELSE,
+            Const('-'),
+        ENDIF,
+        Add('.'),
+        RETURN_TRUE]
+
+# indices of the conditions in ladder_spec
+A, B, C = 0, 2, 4
+
+
+def profile(**branches):
+    return m.Profile(
+        (index, m.BranchProfile(*branches[name]))
+        for (name, index) in (('a', A), ('b', B), ('c', C))
+        if name in branches)
+
+
+def item_counts(prog, *indices):
+    return [prog.statistics[index].item_count for index in indices]
+
+
+class Test_Profile_order(unittest.TestCase):
+
+    def order(self, profile, spec=None):
+        c = tarr.compiler_base.Compiler()
+        c.compile(spec or ladder_spec())
+        [ladder] = c.exclusive_ladders
+        return [
+            (arm.index, negated)
+            for (arm, negated) in profile.order(ladder.arms)]
+
+    def test_most_hit_first_without_run_time(self):
+        p = profile(a=(10, 1, 9, 0), b=(9, 3, 6, 0), c=(6, 6, 0, 0))
+
+        self.assertEqual([(C, False), (B, False), (A, False)], self.order(p))
+
+    def test_cheapest_per_hit_first(self):
+        # cost per hit: a: 0.5 / 1, b: 2.0 / 3, c: 1.0 / 6
+        p = profile(a=(10, 1, 9, 5.0), b=(9, 3, 6, 18.0), c=(6, 6, 0, 6.0))
+
+        self.assertEqual([(C, False), (A, False), (B, False)], self.order(p))
+
+    def test_run_time_is_ignored_if_not_measured_for_all(self):
+        p = profile(a=(10, 1, 9, 5.0), b=(9, 3, 6, 0), c=(6, 6, 0, 6.0))
+
+        self.assertEqual([(C, False), (B, False), (A, False)], self.order(p))
+
+    def test_never_hit_and_untested_arms_are_last(self):
+        p = profile(a=(10, 0, 10, 0), b=(10, 10, 0, 0), c=(0, 0, 0, 0))
+
+        self.assertEqual([(B, False), (A, False), (C, False)], self.order(p))
+
+    def test_empty_profile_keeps_order(self):
+        self.assertEqual(
+            [(A, False), (B, False), (C, False)], self.order(m.Profile()))
+
+    def test_hits_of_negated_arm_are_failures(self):
+        spec = [
+            EXCLUSIVE_IF (Eq('a')),
+                Const('A'),
+            ELIF_NOT (Eq('b')),
+                Const('not b'),
+            ENDIF,
+            RETURN_TRUE]
+        p = m.Profile([
+            (0, m.BranchProfile(10, 2, 8, 0)),
+            (2, m.BranchProfile(8, 7, 1, 0))])
+
+        self.assertEqual([(0, False), (2, True)], self.order(p, spec))
+
+
+class Test_reordered_Program(unittest.TestCase):
+
+    PROGRAM_CLASS = tarr.compiler.Program
+
+    HOT_C = profile(a=(10, 1, 9, 0), b=(9, 1, 8, 0), c=(8, 8, 0, 0))
+
+    def test_hot_arm_is_tested_first(self):
+        prog = self.PROGRAM_CLASS(ladder_spec(), profile=self.HOT_C)
+
+        self.assertEqual('C.', prog.run('c'))
+
+        self.assertEqual([0, 0, 1], item_counts(prog, A, B, C))
+
+    def test_results_are_the_same(self):
+        prog = self.PROGRAM_CLASS(ladder_spec(), profile=self.HOT_C)
+
+        self.assertEqual(
+            ['A.', 'B.', 'C.', '-.'],
+            [prog.run(value) for value in ('a', 'b', 'c', 'x')])
+        self.assertEqual([3, 2, 4], item_counts(prog, A, B, C))
+
+    def test_source_instructions_are_not_changed(self):
+        prog = self.PROGRAM_CLASS(ladder_spec(), profile=self.HOT_C)
+        original = self.PROGRAM_CLASS(ladder_spec())
+
+        self.assertEqual(original.to_text(), prog.to_text())
+
+    def test_negated_arm(self):
+        spec = [
+            EXCLUSIVE_IF (Eq(1)),
+                Const('one'),
+            ELIF_NOT (IsOdd),
+                Const('even'),
+            ENDIF,
+            RETURN_TRUE]
+        p = m.Profile([
+            (0, m.BranchProfile(10, 1, 9, 0)),
+            (2, m.BranchProfile(9, 1, 8, 0))])
+        prog = self.PROGRAM_CLASS(spec, profile=p)
+
+        self.assertEqual(
+            ['one', 'even', 3], [prog.run(value) for value in (1, 2, 3)])
+        self.assertEqual([2, 3], item_counts(prog, 0, 2))
+
+    def test_call_arms(self):
+        spec = [
+            EXCLUSIVE_IF ('is_a'),
+                Const('A'),
+            ELIF ('is_b'),
+                Const('B'),
+            ENDIF,
+            RETURN_TRUE,
+
+            DEF ('is_a'),
+                IF (Eq('a')),
+                    RETURN_TRUE,
+                ENDIF,
+                RETURN_FALSE,
+
+            DEF ('is_b'),
+                IF (Eq('b')),
+                    RETURN_TRUE,
+                ENDIF,
+                RETURN_FALSE]
+        p = m.Profile([
+            (0, m.BranchProfile(10, 1, 9, 0)),
+            (2, m.BranchProfile(9, 9, 0, 0))])
+        prog = self.PROGRAM_CLASS(spec, profile=p)
+
+        self.assertEqual(
+            ['A', 'B', 'x'], [prog.run(value) for value in ('a', 'b', 'x')])
+        self.assertEqual([2, 3], item_counts(prog, 0, 2))
+
+    def test_ladders_in_subprogram_and_else(self):
+        spec = [
+            'classify',
+            RETURN_TRUE,
+
+            DEF ('classify'),
+                EXCLUSIVE_IF (Eq('a')),
+                    Const('A'),
+                ELIF (Eq('b')),
+                    Const('B'),
+                ELSE,
+                    EXCLUSIVE_IF (Eq('c')),
+                        Const('C'),
+                    ELIF (Eq('d')),
+                        Const('D'),
+                    ENDIF,
+                ENDIF,
+                RETURN_TRUE]
+        p = m.Profile([
+            (2, m.BranchProfile(10, 1, 9, 0)),
+            (4, m.BranchProfile(9, 9, 0, 0)),
+            (6, m.BranchProfile(10, 1, 9, 0)),
+            (8, m.BranchProfile(9, 9, 0, 0))])
+        prog = self.PROGRAM_CLASS(spec, profile=p)
+
+        self.assertEqual(
+            ['A', 'B', 'C', 'D', 'x'],
+            [prog.run(value) for value in ('a', 'b', 'c', 'd', 'x')])
+        self.assertEqual([4, 5, 2, 3], item_counts(prog, 2, 4, 6, 8))
+
+
+class Test_reordered_Program_codegen(Test_reordered_Program):
+
+    PROGRAM_CLASS = tarr.codegen.Program
+
+
+class Test_reordered_Program_tracing(Test_reordered_Program):
+
+    class PROGRAM_CLASS(tarr.tracing.Program):
+        trace_threshold = 1
+
+
+class Test_Profile_files(unittest.TestCase):
+
+    def test_save_and_load(self):
+        p = profile(a=(10, 1, 9, 0.5), c=(6, 6, 0, 0))
+
+        with tempdir.TempDir() as d:
+            filename = os.path.join(d.name, 'profile')
+            p.save(filename)
+            loaded = m.Profile.load(filename)
+
+        self.assertEqual([A, C], sorted(loaded.branches))
+        self.assertEqual(
+            (10, 1, 9, 0.5), vars_of(loaded.branches[A]))
+        self.assertEqual(
+            (6, 6, 0, 0), vars_of(loaded.branches[C]))
+
+    def test_profile_saved_from_program(self):
+        prog = tarr.compiler.Program(ladder_spec())
+        for value in 'abcccc':
+            prog.run(value)
+
+        with tempdir.TempDir() as d:
+            filename = os.path.join(d.name, 'profile')
+            prog.save_profile(filename)
+            p = m.Profile.load(filename)
+
+        self.assertEqual((6, 1, 5), vars_of(p.branches[A])[:3])
+        self.assertEqual((5, 1, 4), vars_of(p.branches[B])[:3])
+        self.assertEqual((4, 4, 0), vars_of(p.branches[C])[:3])
+
+        prog = tarr.compiler.Program(ladder_spec(), profile=p)
+        self.assertEqual('C.', prog.run('c'))
+        self.assertEqual('A.', prog.run('a'))
+
+
+def vars_of(branch):
+    return (
+        branch.item_count, branch.success_count, branch.failure_count,
+        branch.run_time)
@@ -0,0 +1,169 @@
+import collections
+import io
+import pickle
+import unittest
+
+import tarr.serialize as m
+import tarr.payload
+from tarr.data import Data
+
+
+Point = collections.namedtuple('Point', 'x y')
+
+
+def payload(history_limit=tarr.payload.HISTORY_ALL):
+    return (
+        tarr.payload.new(u'input', history_limit=history_limit)
+        .with_new_result(u'add', u'key', 1)
+        .with_new_results(u'add more', {'bytes key': [1, 2], 3: Point(1, 2)})
+        .with_new_input(u'new input', u'input2'))
+
+
+def roundtrip(data_items, history=False, lazy=False):
+    return m.loads_batch(m.dumps_batch(data_items, history), lazy)
+
+
+class Test_batch(unittest.TestCase):
+
+    def test_data(self):
+        [data] = roundtrip([Data((u'file', 12), payload())])
+
+        self.assertEqual((u'file', 12), data.id)
+        self.assertEqual(u'input2', data.payload.input)
+        self.assertEqual(
+            {u'key': 1, 'bytes key': [1, 2], 3: Point(1, 2)},
+            dict(data.payload.results.items()))
+
+    def test_non_ascii_strings(self):
+        [data] = roundtrip([Data(1, tarr.payload.new(u'').with_new_results(
+            u'\xe1rv\xedzt\u0171r\u0151', {'\xff': 1, u'\u0151': 2}))],
+            history=True)
+
+        self.assertEqual(
+            {'\xff': 1, u'\u0151': 2}, dict(data.payload.results.items()))
+        self.assertEqual(
+            u'\xe1rv\xedzt\u0171r\u0151', data.payload.transform_name)
+
+    def test_keys_and_names_are_stored_once_per_batch(self):
+        data_items = [Data(i, payload()) for i in range(10)]
+
+        one = len(m.dumps_batch(data_items[:1], history=True))
+        ten = len(m.dumps_batch(data_items, history=True))
+
+        self.assertLess(ten, 10 * one)
+        self.assertEqual(
+            1, m.dumps_batch(data_items, history=True).count('new input'))
+
+    def test_is_smaller_than_pickle(self):
+        data_items = [Data(i, payload()) for i in range(100)]
+
+        self.assertLess(
+            len(m.dumps_batch(data_items, history=True)),
+            len(pickle.dumps(data_items, pickle.HIGHEST_PROTOCOL)))
+
+    def test_named_tuples_of_local_classes(self):
+        # can not be pickled
+        Id = collections.namedtuple('Id', 'file line')
+        Input = collections.namedtuple('Input', '')
+
+        [data] = roundtrip(
+            [Data(Id(u'file', 1), tarr.payload.new(Input()).with_new_result(
+                u'add', Id(u'nested', Point(1, 2)), Id(2, 3)))])
+
+        self.assertEqual((u'file', 1), data.id)
+        self.assertEqual('Id', data.id.__class__.__name__)
+        self.assertEqual(1, data.id.line)
+        self.assertEqual((), data.payload.input)
+        self.assertEqual(
+            [((u'nested', (1, 2)), (2, 3))], data.payload.results.items())
+        self.assertEqual(2, data.payload.keys()[0].line.y)
+
+    def test_empty_batch(self):
+        self.assertEqual([], roundtrip([]))
+
+    def test_keys_are_interned(self):
+        key = u''.join([u'k', u'ey'])
+
+        [data] = roundtrip([Data(1, tarr.payload.new(u'').with_new_result(
+            u'add', key, 1))])
+
+        self.assertIs(tarr.payload.interned(u'key'), data.payload.keys()[0])
+
+    def test_not_a_batch(self):
+        with self.assertRaises(m.FormatError):
+            m.loads_batch('PK\x03\x04\x00')
+
+
+class Test_history(unittest.TestCase):
+
+    def test_history_is_dropped_by_default(self):
+        [data] = roundtrip([Data(1, payload())])
+
+        self.assertEqual([], data.payload.history())
+        self.assertEqual(
+            [], data.payload.with_new_input(u'x', u'y').history())
+
+    def test_history_is_kept(self):
+        [data] = roundtrip([Data(1, payload())], history=True)
+
+        self.assertEqual(payload().history(), data.payload.history())
+        self.assertEqual(
+            [u'next'] + payload().history(),
+            data.payload.with_new_input(u'next', u'y').history())
+
+    def test_limited_history_is_kept(self):
+        [data] = roundtrip([Data(1, payload(history_limit=2))], history=True)
+
+        self.assertEqual([u'new input', u'add more'], data.payload.history())
+        self.assertEqual(
+            [u'next', u'new input'],
+            data.payload.with_new_input(u'next', u'y').history())
+
+
+class Test_lazy(unittest.TestCase):
+
+    def test_results_are_decoded_on_first_use(self):
+        [data] = roundtrip([Data(1, payload())], lazy=True)
+
+        self.assertIsNone(data.payload._results)
+        self.assertEqual(1, data.payload[u'key'])
+        self.assertIsNotNone(data.payload._results)
+
+    def test_lazy_payload_is_pickled_without_the_batch(self):
+        payload = tarr.payload.new(u'').with_new_result(u'add', u'key', 1)
+        [data] = roundtrip([Data(1, payload)], lazy=True)
+
+        copy = pickle.loads(pickle.dumps(data.payload))
+
+        self.assertIsNone(copy._encoded)
+        self.assertEqual(1, copy[u'key'])
+
+    def test_new_results_of_lazy_payload(self):
+        [data] = roundtrip([Data(1, payload())], lazy=True)
+
+        new = data.payload.with_new_result(u'add', u'key2', 2)
+
+        self.assertEqual((1, 2), (new[u'key'], new[u'key2']))
+
+
+class Test_file(unittest.TestCase):
+
+    def test_batches(self):
+        f = io.BytesIO()
+        m.dump_batch([Data(1, payload()), Data(2, payload())], f)
+        m.dump_batch([Data(3, payload())], f, history=True)
+        f.seek(0)
+
+        data_items = list(m.iter_load(f))
+
+        self.assertEqual([1, 2, 3], [data.id for data in data_items])
+        self.assertEqual([], data_items[0].payload.history())
+        self.assertEqual(payload().history(), data_items[2].payload.history())
+
+    def test_truncated_file(self):
+        f = io.BytesIO()
+        m.dump_batch([Data(1, payload())], f)
+        f = io.BytesIO(f.getvalue()[:-1])
+
+        with self.assertRaises(m.FormatError):
+            list(m.iter_load(f))
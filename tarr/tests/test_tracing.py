@@ -0,0 +1,175 @@
+import random
+import unittest
+import tarr.tracing as m
+import tarr.compiler
+import tarr.optimizer
+from tarr.data import Data
+import tarr.tests.test_compiler_base
+from tarr.tests.test_compiler import add1, odd
+from tarr.tests.test_optimizer import DispatcherProgram, classifier_spec
+from tarr.compiler import (
+    RETURN_TRUE, RETURN_FALSE, DEF, IF, ELSE, ENDIF)
+
+
+class EagerProgram(m.Program):
+
+    trace_threshold = 1
+
+
+class Test_Program(tarr.tests.test_compiler_base.Test_Program):
+
+    PROGRAM_CLASS = EagerProgram
+
+
+class Test_Runner_call_stack(
+        tarr.tests.test_compiler_base.Test_Runner_call_stack):
+
+    PROGRAM_CLASS = EagerProgram
+
+
+def odd_even_spec():
+    return [
+        'add1_if_odd',
+        'add1_if_odd',
+        RETURN_TRUE,
+
+        DEF ('add1_if_odd'),
+            IF (odd),
+                add1,
+                RETURN_TRUE,
+            ELSE,
+                RETURN_FALSE,
+            ENDIF,
+    ]
+
+
+def run(prog, *payloads):
+    results = []
+    for payload in payloads:
+        data = prog.run(Data(None, payload))
+        results.append((data.payload, prog.runner.exit_status))
+    return results
+
+
+def counts(prog):
+    return [
+        (stat.item_count, stat.success_count, stat.failure_count)
+        for stat in prog.statistics]
+
+
+class Test_TracingRunner(unittest.TestCase):
+
+    def prog(self, spec=None, threshold=2, max_hot_paths=None):
+        class Program(m.Program):
+            trace_threshold = threshold
+
+        prog = Program(spec or odd_even_spec())
+        if max_hot_paths is not None:
+            prog.runner.max_hot_paths = max_hot_paths
+        return prog
+
+    def test_cold_program_is_not_compiled(self):
+        prog = self.prog()
+
+        run(prog, 1)
+
+        self.assertEqual({}, prog.runner.traces)
+
+    def test_hot_path_is_compiled(self):
+        prog = self.prog()
+
+        run(prog, 1, 3)
+
+        self.assertEqual(1, len(prog.runner.traces))
+        [source] = prog.runner.sources.values()
+        self.assertIn('def trace0(data, status):', source)
+
+    def test_trace_gives_the_same_results(self):
+        prog = self.prog()
+        payloads = [1, 3, 5, 2, 7, 4, 9]
+
+        self.assertEqual(
+            run(tarr.compiler.Program(odd_even_spec()), *payloads),
+            run(prog, *payloads))
+
+    def test_side_exit_resumes_interpreting_inside_call(self):
+        prog = self.prog()
+        run(prog, 1, 1)
+        self.assertEqual(1, len(prog.runner.traces))
+
+        # 1 -> 2, which is even: leaves the hot path in the second call
+        self.assertEqual([(2, True)], run(prog, 1))
+        self.assertEqual([(2, True)], run(prog, 2))
+
+    def test_paths_through_side_exits_become_hot(self):
+        prog = self.prog()
+        run(prog, 1, 1)
+
+        run(prog, 2, 2)
+
+        [source] = prog.runner.sources.values()
+        self.assertIn('def trace1(data, status):', source)
+        self.assertIn('def trace2(data, status):', source)
+        self.assertEqual([(4, True), (2, True)], run(prog, 3, 2))
+
+    def test_max_hot_paths(self):
+        prog = self.prog(max_hot_paths=1)
+        run(prog, 1, 1)
+
+        run(prog, 2, 2, 2)
+
+        [source] = prog.runner.sources.values()
+        self.assertNotIn('def trace1(data, status):', source)
+        self.assertEqual([(2, True)], run(prog, 2))
+
+    def test_counted_paths_are_bounded(self):
+        spec = []
+        for i in range(16):
+            spec.extend([IF (odd), add1, ENDIF])
+        spec.append(RETURN_TRUE)
+        prog = self.prog(spec, threshold=100)
+        prog.runner.max_paths = 50
+        payloads = [random.getrandbits(16) for i in range(2000)]
+
+        run(prog, *payloads)
+
+        [path_counts] = prog.runner.path_counts.values()
+        self.assertLessEqual(len(path_counts), 50)
+
+    def test_paths_are_not_recorded_after_max_hot_paths(self):
+        prog = self.prog(max_hot_paths=1)
+        run(prog, 1, 1)
+        self.assertEqual({}, prog.runner.path_counts)
+
+        # side exits
+        run(prog, 2, 2, 2)
+
+        self.assertEqual({}, prog.runner.path_counts)
+        self.assertEqual([(2, True)], run(prog, 2))
+
+    def test_statistics_are_the_same_as_interpreted(self):
+        prog = self.prog()
+        payloads = [1, 3, 5, 2, 7, 4, 9, 6, 6, 6]
+        interpreted = tarr.compiler.Program(odd_even_spec())
+
+        run(interpreted, *payloads)
+        run(prog, *payloads)
+
+        self.assertEqual(counts(interpreted), counts(prog))
+
+    def test_dispatch_in_trace(self):
+        class Program(m.Program):
+            trace_threshold = 1
+            optimizers = (tarr.optimizer.Dispatcher(),)
+
+        prog = Program(classifier_spec())
+        objects = ['dog', 'tree', 'tree', 'fish', 'dog', 'fish']
+        reference = DispatcherProgram(classifier_spec())
+
+        for what in objects:
+            self.assertEqual(
+                reference.run(Data(None, {'object': what})).payload,
+                prog.run(Data(None, {'object': what})).payload)
+            self.assertEqual(
+                reference.runner.exit_status, prog.runner.exit_status)
+        self.assertEqual(counts(reference), counts(prog))
@@ -0,0 +1,417 @@
+'''
+Trace based specialization of hot paths.
+
+TracingRunner collects statistics like StatisticsCollectorRunner, and
+records the path every item takes through the program as a sequence of
+events:
+
+    (RUN, instruction, outcome)  instruction was run, outcome is the
+                                 branch taken (None if not branching)
+    (ENTER, i_call, None)        a subprogram was called
+    (LEAVE, i_call, outcome)     the called subprogram returned
+
+Paths taken `threshold` times are hot: the hot paths from a start
+instruction are merged into a tree and compiled into straight-line Python
+functions. Branch points have guards: when an item leaves the hot paths,
+the runner resumes interpreting it at the next instruction, with the
+call stack of the trace - this is a side exit. Paths through side exits
+are recorded as well, so they can become hot later.
+
+Traces update the item, success and failure counts of the instructions
+like the interpreter does, but do not measure run time.
+'''
+
+from tarr import compiler_base, compiler
+from tarr.compiler import StatisticsCollectorRunner, HAVE_NOT_DONE_IT
+from tarr.optimizer import Dispatch
+from tarr.flat import opcode, RULE, BRANCH, BRANCH_RULE, RETURN
+
+
+# events
+RUN = 'run'
+ENTER = 'enter'
+LEAVE = 'leave'
+
+# returned by TraceCompiler.emit_guards if there is no outcome to
+# continue with on the current path
+NO_OUTCOME = object()
+
+
+def outcome(instruction, exit_status):
+    '''The branch taken after instruction'''
+    if isinstance(instruction, Dispatch):
+        return exit_status
+    if isinstance(instruction, compiler_base.BranchingInstruction):
+        return bool(exit_status)
+    return None
+
+
+def make_tree(paths):
+    '''Prefix tree of paths, nodes are dicts of event -> child node'''
+    tree = dict()
+    for path in paths:
+        node = tree
+        for event in path:
+            node = node.setdefault(event, dict())
+    return tree
+
+
+class SideExit(object):
+
+    '''Where to continue interpreting after a failed guard
+
+    prefix is the path before the guarded event of kind on instruction.
+    '''
+
+    def __init__(self, start_instruction, prefix, kind, instruction, calls):
+        self.start_instruction = start_instruction
+        self.prefix = prefix
+        self.kind = kind
+        self.instruction = instruction
+        self.calls = calls
+
+
+class TraceCompiler(object):
+
+    '''
+    Generates the Python source of a trace tree.
+
+    Straight paths of the tree become the body of a function, every
+    branch point with more than one hot outcome tail calls the functions
+    of its subtrees, so the generated code is not nested deeply.
+    '''
+
+    def __init__(self, runner, start_instruction, tree):
+        self.start_instruction = start_instruction
+        self.lines = []
+        self.namespace = dict(
+            runner=runner,
+            statistics=runner.statistics,
+            item_count=runner.statistics.item_count,
+            success_count=runner.statistics.success_count,
+            failure_count=runner.statistics.failure_count,
+            HAVE_NOT_DONE_IT=HAVE_NOT_DONE_IT)
+        self.names = dict()
+        self.pending = []
+        self.entry = self.function(tree, (), ())
+
+    # names in the generated code
+
+    def name(self, prefix, value):
+        key = (prefix, id(value))
+        if key not in self.names:
+            self.names[key] = '{}{}'.format(prefix, len(self.names))
+            self.namespace[self.names[key]] = value
+        return self.names[key]
+
+    def function(self, node, prefix, calls):
+        name = 'trace{}'.format(len(self.pending))
+        self.pending.append((name, node, prefix, calls))
+        return name
+
+    # source output
+
+    def add(self, depth, line):
+        self.lines.append('    ' * depth + line)
+
+    def source(self):
+        done = 0
+        while done < len(self.pending):
+            name, node, prefix, calls = self.pending[done]
+            done += 1
+            self.add(0, '')
+            self.add(0, 'def {}(data, status):'.format(name))
+            self.emit_path(node, prefix, calls)
+        return '\n'.join(self.lines) + '\n'
+
+    def count(self, depth, instruction, counter):
+        self.add(depth, '{}[{}] += 1'.format(counter, instruction.index))
+
+    def count_exit_status(self, instruction):
+        self.add(1, 'if status:')
+        self.count(2, instruction, 'success_count')
+        self.add(1, 'else:')
+        self.count(2, instruction, 'failure_count')
+
+    def emit_path(self, node, prefix, calls):
+        # prefix: the events before node
+        while node:
+            events = node.keys()
+            (kind, instruction, _) = events[0]
+            outcomes = dict(
+                (event[2], child) for (event, child) in node.iteritems())
+
+            if kind == ENTER:
+                self.add(1, '# CALL "{}"'.format(instruction.label))
+                self.count(1, instruction, 'item_count')
+                calls = calls + (instruction,)
+            elif kind == LEAVE:
+                self.add(1, '# RETURN to CALL "{}"'.format(instruction.label))
+                calls = calls[:-1]
+            else:
+                self.emit_run(instruction)
+
+            if kind == ENTER:
+                expected = None
+            elif kind == RUN and outcomes.keys() == [None]:
+                if opcode(instruction) == RETURN:
+                    self.count(
+                        1, instruction,
+                        'success_count' if instruction.return_value
+                        else 'failure_count')
+                else:
+                    self.count_exit_status(instruction)
+                expected = None
+            else:
+                expected = self.emit_guards(
+                    kind, instruction, outcomes, prefix, calls)
+                if expected is NO_OUTCOME:
+                    return
+
+            node = outcomes[expected]
+            prefix = prefix + ((kind, instruction, expected),)
+
+        self.add(1, 'runner.exit_status = status')
+        self.add(1, 'return data')
+
+    def emit_run(self, instruction):
+        self.add(1, '# {} {}'.format(
+            instruction.index,
+            getattr(
+                instruction, 'instruction_name',
+                instruction.__class__.__name__)))
+        op = opcode(instruction)
+        if not isinstance(instruction, Dispatch):
+            self.count(1, instruction, 'item_count')
+        if op == RULE:
+            self.add(1, 'data.payload = {}(data.payload)'.format(
+                self.name('c', instruction.func)))
+        elif op == BRANCH:
+            self.add(1, 'status = {}(data.payload)'.format(
+                self.name('c', instruction.func)))
+        elif op == BRANCH_RULE:
+            self.add(1, 'output = {}(data.payload)'.format(
+                self.name('c', instruction.func)))
+            self.add(1, 'status = output is not HAVE_NOT_DONE_IT')
+            self.add(1, 'if status:')
+            self.add(2, 'data.payload = output')
+        elif op == RETURN:
+            self.add(1, 'status = {!r}'.format(instruction.return_value))
+        else:
+            self.add(1, 'runner.exit_status = status')
+            self.add(1, 'data = {}.run(runner, data)'.format(
+                self.name('i', instruction)))
+            self.add(1, 'status = runner.exit_status')
+        if isinstance(instruction, Dispatch):
+            self.add(1, '{}.count(statistics, status)'.format(
+                self.name('i', instruction)))
+
+    def emit_guards(self, kind, instruction, outcomes, prefix, calls):
+        '''Branch on the outcome of instruction.
+
+        Returns the outcome to continue with inline, NO_OUTCOME if the
+        hot outcomes continue in new functions.
+        '''
+        def condition(outcome):
+            if outcome is True:
+                return 'status'
+            if outcome is False:
+                return 'not status'
+            return 'status == {!r}'.format(outcome)
+
+        def count_outcome(depth, outcome):
+            if isinstance(instruction, Dispatch):
+                # counted with the arms when run
+                return
+            if outcome is True:
+                self.count(depth, instruction, 'success_count')
+            elif outcome is False:
+                self.count(depth, instruction, 'failure_count')
+            else:
+                self.add(depth, 'if status:')
+                self.count(depth + 1, instruction, 'success_count')
+                self.add(depth, 'else:')
+                self.count(depth + 1, instruction, 'failure_count')
+
+        side_exit = 'return runner.side_exit({}, data, status)'.format(
+            self.name(
+                'x',
+                SideExit(
+                    self.start_instruction, prefix, kind, instruction,
+                    calls)))
+
+        if len(outcomes) == 1:
+            [expected] = outcomes.keys()
+            self.add(1, 'if not ({}):'.format(condition(expected)))
+            count_outcome(2, None)
+            self.add(2, side_exit)
+            count_outcome(1, expected)
+            return expected
+
+        for (expected, child) in sorted(outcomes.items()):
+            child_prefix = prefix + ((kind, instruction, expected),)
+            self.add(1, 'if {}:'.format(condition(expected)))
+            count_outcome(2, expected)
+            self.add(2, 'return {}(data, status)'.format(
+                self.function(child, child_prefix, calls)))
+        # 0 == False and 1 == True, but a Dispatch has more arms
+        if (isinstance(instruction, Dispatch) or
+                set(outcomes) != set([True, False])):
+            count_outcome(1, None)
+            self.add(1, side_exit)
+        return NO_OUTCOME
+
+
+def decay(path_counts):
+    '''Halve the counts, drop the paths taken only once'''
+    for (path, count) in path_counts.items():
+        if count > 1:
+            path_counts[path] = count // 2
+        else:
+            path_counts.pop(path, None)
+
+
+class TracingRunner(StatisticsCollectorRunner):
+
+    '''
+    Collects statistics and compiles the hot paths of the program.
+
+    threshold:     a path is hot after taken this many times
+    max_hot_paths: at most this many paths are compiled for a start
+                   instruction, the others stay interpreted
+    max_paths:     at most this many distinct paths are counted for a
+                   start instruction, when there are more, all the counts
+                   are halved and the paths taken only once are dropped
+
+    Paths are no longer recorded from a start instruction having
+    max_hot_paths compiled paths.
+    '''
+
+    threshold = 100
+    max_hot_paths = 16
+    max_paths = 1024
+
+    # start instruction -> {path: count}
+    path_counts = None
+    hot_paths = None
+    saturated = None
+    traces = None
+    sources = None
+    recording = None
+
+    def __init__(
+            self, statistics, threshold=None, max_hot_paths=None,
+            max_paths=None):
+        super(TracingRunner, self).__init__(statistics)
+        if threshold is not None:
+            self.threshold = threshold
+        if max_hot_paths is not None:
+            self.max_hot_paths = max_hot_paths
+        if max_paths is not None:
+            self.max_paths = max_paths
+        self.path_counts = dict()
+        self.hot_paths = dict()
+        self.saturated = set()
+        self.traces = dict()
+        self.sources = dict()
+
+    def run(self, start_instruction, state):
+        trace = self.traces.get(start_instruction)
+        if trace is not None:
+            return trace(state, self.exit_status)
+        if start_instruction in self.saturated:
+            return self.resume(start_instruction, state, [])
+
+        self.recording = []
+        try:
+            state = self.resume(start_instruction, state, [])
+            self.count_path(start_instruction, self.recording)
+        finally:
+            self.recording = None
+        return state
+
+    def side_exit(self, side_exit, state, exit_status):
+        '''Continue interpreting where a trace has left the hot paths'''
+        self.exit_status = exit_status
+        if side_exit.start_instruction in self.saturated:
+            return self.resume(
+                side_exit.instruction.next_instruction(exit_status),
+                state, [(i_call, None) for i_call in side_exit.calls])
+
+        self.recording = list(side_exit.prefix)
+        self.recording.append(
+            (
+                side_exit.kind,
+                side_exit.instruction,
+                outcome(side_exit.instruction, exit_status)))
+        call_stack = [(i_call, None) for i_call in side_exit.calls]
+        try:
+            state = self.resume(
+                side_exit.instruction.next_instruction(exit_status),
+                state, call_stack)
+            self.count_path(side_exit.start_instruction, self.recording)
+        finally:
+            self.recording = None
+        return state
+
+    # recording
+
+    def run_instruction(self, instruction, state):
+        state = super(TracingRunner, self).run_instruction(instruction, state)
+        if self.recording is not None:
+            self.recording.append(
+                (RUN, instruction, outcome(instruction, self.exit_status)))
+        return state
+
+    def enter_call(self, i_call):
+        if self.recording is not None:
+            self.recording.append((ENTER, i_call, None))
+        return super(TracingRunner, self).enter_call(i_call)
+
+    def leave_call(self, i_call, context):
+        super(TracingRunner, self).leave_call(i_call, context)
+        if self.recording is not None:
+            self.recording.append(
+                (LEAVE, i_call, outcome(i_call, self.exit_status)))
+
+    # compilation
+
+    def count_path(self, start_instruction, recording):
+        path_counts = self.path_counts.setdefault(start_instruction, dict())
+        path = tuple(recording)
+        count = path_counts.get(path, 0) + 1
+        if count == 1 and len(path_counts) >= self.max_paths:
+            decay(path_counts)
+            if len(path_counts) >= self.max_paths:
+                return
+        if count < self.threshold:
+            path_counts[path] = count
+            return
+
+        # hot, it is run by the trace from now on
+        path_counts.pop(path, None)
+        hot_paths = self.hot_paths.setdefault(start_instruction, [])
+        hot_paths.append(path)
+        self.compile(start_instruction)
+        if len(hot_paths) >= self.max_hot_paths:
+            self.saturated.add(start_instruction)
+            del self.path_counts[start_instruction]
+
+    def compile(self, start_instruction):
+        tree = make_tree(self.hot_paths[start_instruction])
+        generator = TraceCompiler(self, start_instruction, tree)
+        source = generator.source()
+        namespace = generator.namespace
+        exec compile(source, '<tarr trace>', 'exec') in namespace
+        self.sources[start_instruction] = source
+        self.traces[start_instruction] = namespace[generator.entry]
+
+
+class Program(compiler.Program):
+
+    trace_threshold = TracingRunner.threshold
+
+    def make_runner(self):
+        return TracingRunner(
+            compiler.make_statistics(len(self.instructions)),
+            threshold=self.trace_threshold)